@@ -0,0 +1,163 @@
+"""Endpoint benchmark: drives every v2/v3 route (the same urls as the test
+suite) in-process through an ASGI transport, against networks of growing
+size. Reports p50/p99 latency, req/s and peak RSS per feed and network.
+
+    python bench/endpoints.py --sizes 100,1000,10000 -n 50 -o results.json
+
+    # against an existing database
+    python bench/endpoints.py --db citybikes.db
+
+Results are saved as JSON, to be compared across runs.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+import subprocess
+
+
+def seed(path, sizes, mixes, vehicles):
+    from citybikes.db import get_session, migrate
+    from citybikes.db.ingest import store_network
+    from citybikes import synthetic
+
+    with get_session(path) as db:
+        assert migrate(db)
+        for network in synthetic.networks(sizes, mixes, vehicles):
+            store_network(db, network)
+
+
+def network_sizes(path):
+    con = sqlite3.connect(path)
+    rows = con.execute("""
+        SELECT tag, json_array_length(stations), json_array_length(vehicles)
+        FROM networks
+    """)
+    return {tag: {"stations": s, "vehicles": v} for tag, s, v in rows}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def peak_rss_kb():
+    # linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def bench_url(client, url, n, concurrency):
+    await client.get(url)  # warm up
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await client.get(url)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, (url, response.status_code)
+
+    start = time.perf_counter()
+    share, rest = divmod(n, concurrency)
+    await asyncio.gather(
+        *(worker(share + (i < rest)) for i in range(concurrency))
+    )
+    elapsed = time.perf_counter() - start
+
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "rps": round(n / elapsed, 1),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+async def run(args, sizes):
+    import httpx
+    from citybikes.gbfs.app import app
+    from tests.conftest import get_urls
+
+    urls = await get_urls(app)
+    if args.filter:
+        urls = [u for u in urls if args.filter in u]
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+        async with client:
+            for url in urls:
+                parts = url.strip("/").split("/")
+                tag = parts[1] if len(parts) > 2 else None
+                result = {
+                    "url": url,
+                    "version": parts[0],
+                    "feed": parts[-1],
+                    "network": tag,
+                    **sizes.get(tag, {}),
+                    **await bench_url(client, url, args.n, args.concurrency),
+                }
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+
+    return results
+
+
+def main(args):
+    path = args.db
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        sizes = [int(s) for s in args.sizes.split(",")]
+        mixes = args.mixes.split(",") if args.mixes else None
+        seed(path, sizes, mixes, args.vehicles)
+
+    # configure the app before importing it
+    os.environ["DB_URI"] = path
+    os.environ["TEST_DB_URI"] = path
+    os.environ["CACHE"] = "1" if args.cache else "0"
+
+    results = asyncio.run(run(args, network_sizes(path)))
+
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "n": args.n,
+            "concurrency": args.concurrency,
+            "cache": args.cache,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="benchmark an existing database")
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--mixes", default="plain,ebikes")
+    parser.add_argument("--vehicles", type=int, default=None)
+    parser.add_argument("-n", type=int, default=20, help="requests per url")
+    parser.add_argument("-c", "--concurrency", type=int, default=1)
+    parser.add_argument("--cache", action="store_true", help="enable feed cache")
+    parser.add_argument("--filter", help="only urls containing this")
+    parser.add_argument("-o", "--output")
+    main(parser.parse_args())
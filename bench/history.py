@@ -0,0 +1,135 @@
+"""Availability history storage benchmark: records a day of synthetic
+scrapes through the subscriber path and reports the storage cost per
+station-day, as recorded and after the rollup, next to what copying every
+changed stat JSON blob would take. Also times the query of a station and
+of the whole network.
+
+    python bench/history.py --stations 1000 --interval 120 --change 0.1
+    python bench/history.py --mix ebikes -o history.json
+
+Changes are a random walk of bikes (and ebikes, on mixes that have them),
+a station changing on a given scrape with probability --change.
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+
+DAY = 86400
+
+
+def scrapes(network, start, interval, change, seed=0):
+    """the network once every interval seconds for a day, from start"""
+    from datetime import datetime, timezone
+
+    rng = random.Random(seed)
+    for t in range(start, start + DAY, interval):
+        timestamp = datetime.fromtimestamp(t, timezone.utc).isoformat()
+        for s in network["stations"]:
+            s["timestamp"] = timestamp
+            if rng.random() >= change:
+                continue
+            slots = s["extra"]["slots"]
+            s["bikes"] = min(slots, max(0, s["bikes"] + rng.choice([-1, 1])))
+            s["free"] = slots - s["bikes"]
+            if "ebikes" in s["extra"]:
+                s["extra"]["ebikes"] = min(s["extra"]["ebikes"], s["bikes"])
+                if "normal_bikes" in s["extra"]:
+                    s["extra"]["normal_bikes"] = s["bikes"] - s["extra"]["ebikes"]
+        yield network
+
+
+def table_bytes(con, table):
+    """pages of table and its indexes, off dbstat"""
+    return con.execute(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (table,)
+    ).fetchone()[0]
+
+
+def main(args):
+    from citybikes.db import get_session, history, migrate
+    from citybikes.db.ingest import store_network
+    from citybikes.db.maintenance import connect
+    from citybikes import synthetic
+
+    # a day ending past the rollup age, so it can be rolled up after
+    start = (int(time.time()) // DAY - 9) * DAY
+    network = synthetic.network("bench", args.stations, 0, args.mix, seed=0)
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "history.db")
+    recorder = history.History()
+    samples = json_bytes = messages = 0
+
+    t0 = time.perf_counter()
+    with get_session(path) as db:
+        assert migrate(db)
+        for message in scrapes(network, start, args.interval, args.change):
+            before = dict(recorder.last)
+            store_network(db, message, recorder)
+            messages += 1
+            # what storing each changed stat blob would have cost
+            for s in message["stations"]:
+                if before.get(s["id"]) != recorder.last[s["id"]]:
+                    samples += 1
+                    stat = {k: s[k] for k in ["bikes", "free", "timestamp", "extra"]}
+                    json_bytes += len(json.dumps(stat))
+    record_time = time.perf_counter() - t0
+
+    con = connect(path)
+    stations = args.stations
+    recorded = table_bytes(con, "history")
+    data = con.execute("SELECT SUM(LENGTH(data)) FROM history").fetchone()[0]
+
+    uid = network["stations"][0]["id"]
+    t0 = time.perf_counter()
+    history.get(con, "bench", uid, start, start + DAY)
+    station_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    series = history.get(con, "bench", None, start, start + DAY)
+    network_ms = (time.perf_counter() - t0) * 1000
+    assert len(series) == stations
+
+    history.rollup(con, 7, args.step)
+    con.execute("VACUUM")
+    rolled = table_bytes(con, "history")
+    con.close()
+
+    result = {
+        "stations": stations,
+        "mix": args.mix,
+        "interval_s": args.interval,
+        "change": args.change,
+        "messages": messages,
+        "samples_per_station_day": round(samples / stations, 1),
+        "bytes_per_station_day": {
+            "json_blobs": round(json_bytes / stations),
+            "packed_data": round(data / stations),
+            "on_disk": round(recorded / stations),
+            f"on_disk_rolled_up_{args.step}s": round(rolled / stations),
+        },
+        "record_ms_per_message": round(record_time / messages * 1000, 2),
+        "query_ms": {
+            "station_day": round(station_ms, 2),
+            "network_day": round(network_ms, 2),
+        },
+    }
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--mix", default="ebikes")
+    parser.add_argument("--interval", type=int, default=120, help="seconds")
+    parser.add_argument("--change", type=float, default=0.1)
+    parser.add_argument("--step", type=int, default=900, help="rollup seconds")
+    parser.add_argument("-o", "--output")
+    main(parser.parse_args())
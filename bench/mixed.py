@@ -0,0 +1,245 @@
+"""Mixed read/write load test: API read latency while the subscriber is
+committing networks to a WAL database.
+
+A writer process stands in for the publisher and subscriber: it stores
+synthetic networks through the same mapping as Sqlitesubscriber, at a
+given rate. Meanwhile the app is hammered in-process through its single
+aiosqlite reader. SQLite auto-checkpoints are emulated by the writer (same
+threshold, PASSIVE, right after the commit that crosses it) so these can be
+timed. Reads are then bucketed by what they overlapped with.
+
+    python bench/mixed.py --sizes 1000,10000 --rate 2 --duration 30 -c 8
+
+Runs offline, on a single linux box (CLOCK_MONOTONIC is shared by both
+processes).
+"""
+
+import os
+import json
+import time
+import struct
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+
+def tag(size):
+    return f"synth-{size}-ebikes"
+
+
+def wal_size(path):
+    try:
+        return os.path.getsize(path + "-wal")
+    except FileNotFoundError:
+        return 0
+
+
+def wal_frames(path):
+    """frames in the wal since it was last reset, what sqlite compares to
+    wal_autocheckpoint. The file itself never shrinks, so this is read off
+    mxFrame of the wal-index header in -shm (native byte order)"""
+    with open(path + "-shm", "rb") as f:
+        header = f.read(20)
+    return struct.unpack("=I", header[16:20])[0]
+
+
+def writer(path, sizes, rate, autocheckpoint, stop, events):
+    from citybikes.db.ingest import store_network
+    from citybikes import synthetic
+
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode = WAL")
+    if autocheckpoint:
+        # checkpoints are run (and timed) here instead
+        con.execute("PRAGMA wal_autocheckpoint = 0")
+
+    # a few variants per network, so every commit changes availability
+    messages = [
+        synthetic.network(tag(size), size, size, "ebikes", seed=i)
+        for i in range(3)
+        for size in sizes
+    ]
+
+    i = 0
+    while not stop.is_set():
+        start = time.monotonic()
+        network = messages[i % len(messages)]
+        store_network(con, network)
+        end = time.monotonic()
+        events.put(("commit", start, end, network["tag"], len(network["stations"])))
+
+        if autocheckpoint and wal_frames(path) >= autocheckpoint:
+            start = time.monotonic()
+            busy, log, done = con.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            end = time.monotonic()
+            events.put(("checkpoint", start, end, busy, log - done))
+
+        i += 1
+        time.sleep(max(0, 1 / rate - (time.monotonic() - start)))
+
+    con.close()
+    events.put(None)
+
+
+def summary(values):
+    if not values:
+        return {"n": 0}
+    values = sorted(v * 1000 for v in values)
+    pick = lambda p: values[min(len(values) - 1, int(len(values) * p))]  # NOQA
+    return {
+        "n": len(values),
+        "p50_ms": round(statistics.median(values), 3),
+        "p90_ms": round(pick(0.90), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(values[-1], 3),
+    }
+
+
+async def readers(urls, concurrency, duration):
+    import httpx
+    from citybikes.gbfs.app import app
+
+    reads = []
+    deadline = time.monotonic() + duration
+    transport = httpx.ASGITransport(app=app)
+
+    async def reader(n):
+        i = n
+        while time.monotonic() < deadline:
+            url = urls[i % len(urls)]
+            start = time.monotonic()
+            response = await client.get(url)
+            reads.append((start, time.monotonic(), url, response.status_code))
+            i += 1
+
+    async with app.router.lifespan_context(app):
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+        async with client:
+            await asyncio.gather(*(reader(n) for n in range(concurrency)))
+
+    return reads
+
+
+def overlaps(read, events):
+    start, end = read[0], read[1]
+    return any(e[1] < end and start < e[2] for e in events)
+
+
+def classify(reads, commits, checkpoints):
+    buckets = {"idle": [], "during_commit": [], "during_checkpoint": []}
+    for read in reads:
+        if overlaps(read, checkpoints):
+            bucket = "during_checkpoint"
+        elif overlaps(read, commits):
+            bucket = "during_commit"
+        else:
+            bucket = "idle"
+        buckets[bucket].append(read[1] - read[0])
+    return buckets
+
+
+def stored(path, tags):
+    con = sqlite3.connect(path)
+    try:
+        rows = con.execute("SELECT tag FROM networks").fetchall()
+    finally:
+        con.close()
+    return set(tags) <= {t for t, in rows}
+
+
+def main(args):
+    from citybikes.db import get_session, migrate
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    path = args.db or os.path.join(tempfile.mkdtemp(), "mixed.db")
+    with get_session(path) as db:
+        assert migrate(db)
+        db.execute("PRAGMA journal_mode = WAL")
+
+    tags = [tag(size) for size in sizes]
+    urls = [f"/3/{t}/{f}" for t in tags for f in args.feeds.split(",")]
+
+    # configure the app before importing it
+    os.environ["DB_URI"] = path
+    os.environ["CACHE"] = "1" if args.cache else "0"
+
+    # sqlite connections do not survive a fork
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    events = ctx.Queue()
+    proc = ctx.Process(
+        target=writer,
+        args=(path, sizes, args.rate, args.autocheckpoint, stop, events),
+    )
+    proc.start()
+
+    # let the first round of networks land
+    while not stored(path, tags):
+        time.sleep(0.1)
+
+    reads = asyncio.run(readers(urls, args.concurrency, args.duration))
+
+    stop.set()
+    collected = []
+    while (event := events.get()) is not None:
+        collected.append(event)
+    proc.join()
+
+    commits = [e for e in collected if e[0] == "commit"]
+    checkpoints = [e for e in collected if e[0] == "checkpoint"]
+    ok = [r for r in reads if r[3] == 200]
+    buckets = classify(ok, commits, checkpoints)
+
+    report = {
+        "meta": {
+            "sizes": sizes,
+            "rate": args.rate,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "autocheckpoint": args.autocheckpoint,
+            "cache": args.cache,
+            "sqlite": sqlite3.sqlite_version,
+        },
+        "reads": {
+            "all": summary([r[1] - r[0] for r in ok]),
+            **{k: summary(v) for k, v in buckets.items()},
+            "errors": len(reads) - len(ok),
+            "rps": round(len(reads) / args.duration, 1),
+        },
+        "commits": summary([e[2] - e[1] for e in commits]),
+        "checkpoints": {
+            **summary([e[2] - e[1] for e in checkpoints]),
+            "busy": sum(e[3] for e in checkpoints),
+            "max_frames_left": max((e[4] for e in checkpoints), default=0),
+        },
+        "wal_size_bytes": wal_size(path),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="database path, a temporary one by default")
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument(
+        "--feeds", default="station_status.json,station_information.json"
+    )
+    parser.add_argument("--rate", type=float, default=2, help="commits per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--autocheckpoint",
+        type=int,
+        default=1000,
+        help="pages, as PRAGMA wal_autocheckpoint. 0 leaves it to sqlite",
+    )
+    parser.add_argument("--cache", action="store_true", help="enable feed cache")
+    parser.add_argument("-o", "--output")
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+"""Latency of a small network while a large one is being rendered, with
+every render inline and with those of the large network on the process
+pool (OFFLOAD_ROWS).
+
+    python bench/offload.py --large 20000 --small 100 --duration 10
+    python bench/offload.py --workers 4 -o offload.json
+
+Clients of the large network fetch its station_status back to back, while
+a single client of the small one measures its own. Feeds are not cached,
+so every request renders.
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+BASE = "http://localhost:8000"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(app, args):
+    from citybikes.gbfs.render import fetch
+
+    stop = time.perf_counter() + args.duration
+    large = small = 0
+    latencies = []
+
+    async def hammer():
+        nonlocal large
+        while time.perf_counter() < stop:
+            status, _ = await fetch(app, f"{BASE}/3/large/station_status.json")
+            assert status == 200
+            large += 1
+
+    async def measure():
+        nonlocal small
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            status, _ = await fetch(app, f"{BASE}/3/small/station_status.json")
+            latencies.append((time.perf_counter() - t0) * 1000)
+            assert status == 200
+            small += 1
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(measure(), *[hammer() for _ in range(args.concurrency)])
+    return {
+        "large_renders": large,
+        "small_renders": small,
+        "small_ms": {
+            "p50": round(statistics.median(latencies), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(max(latencies), 2),
+        },
+    }
+
+
+async def main(args):
+    from citybikes.db import get_session, migrate
+    from citybikes.db.ingest import store_network
+    from citybikes.db.shards import open_cbd
+    from citybikes.gbfs.offload import Offload
+    from citybikes.gbfs.render import renderer
+    from citybikes import synthetic
+
+    path = os.path.join(tempfile.mkdtemp(), "offload.db")
+    with get_session(path) as con:
+        assert migrate(con)
+        con.execute("PRAGMA journal_mode = WAL")
+        store_network(con, synthetic.network("large", args.large, 0, "ebikes", seed=0))
+        store_network(con, synthetic.network("small", args.small, 0, "ebikes", seed=1))
+
+    results = {"large": args.large, "small": args.small, "cpus": os.cpu_count()}
+    async with open_cbd(path) as db:
+        app = renderer(db)
+        results["inline"] = await run(app, args)
+
+        app.offload = Offload(path, workers=args.workers, threshold=args.large)
+        # workers start on their first job
+        await app.offload.render(f"{BASE}/3/large/station_status.json", "warmup")
+        try:
+            results["offload"] = await run(app, args)
+        finally:
+            app.offload.close()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--large", type=int, default=20000, help="stations")
+    parser.add_argument("--small", type=int, default=100, help="stations")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("-c", "--concurrency", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("-o", "--output")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""Sharded ingest throughput: stores the same rounds of synthetic networks
+on a single db, and split over shards with a writer process each, as a
+subscriber per shard would. Reports the rows stored per second of each.
+
+    python bench/shards.py --networks 16 --stations 2000 --rounds 5
+    python bench/shards.py --shards 1,2,4,8 -o shards.json
+
+Every round changes the availability of all stations, so each store is a
+full upsert of the network. Throughput only scales up to the cores of the
+box, and to what the disk takes.
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+
+def writer(path, shard, shards, args, start):
+    from citybikes.db import get_session, migrate
+    from citybikes.db.ingest import store_network
+    from citybikes.db.shards import shard_of
+    from citybikes import synthetic
+
+    networks = [
+        synthetic.network(f"synth-{i}", args.stations, 0, "ebikes", seed=i)
+        for i in range(args.networks)
+    ]
+    networks = [n for n in networks if shard_of(n["tag"], shards) == shard]
+
+    with get_session(path) as con:
+        assert migrate(con)
+        con.execute("PRAGMA journal_mode = WAL")
+        start.wait()
+        for r in range(args.rounds):
+            for network in networks:
+                for s in network["stations"]:
+                    s["bikes"] = (s["bikes"] + 1) % (s["extra"]["slots"] + 1)
+                store_network(con, network)
+    return len(networks) * args.stations * args.rounds
+
+
+def run(tmp, shards, args):
+    from citybikes.db.shards import paths
+
+    files = paths(os.path.join(tmp, f"bench-{shards}.db"), shards)
+    start = multiprocessing.Manager().Event()
+    with multiprocessing.Pool(shards) as pool:
+        jobs = [
+            pool.apply_async(writer, (path, i, shards, args, start))
+            for i, path in enumerate(files)
+        ]
+        # networks are generated before the clock starts
+        time.sleep(1)
+        t0 = time.perf_counter()
+        start.set()
+        rows = sum(job.get() for job in jobs)
+        elapsed = time.perf_counter() - t0
+    return {
+        "shards": shards,
+        "rows": rows,
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(rows / elapsed),
+    }
+
+
+def main(args):
+    tmp = tempfile.mkdtemp()
+    results = {
+        "cpus": os.cpu_count(),
+        "networks": args.networks,
+        "stations": args.stations,
+        "rounds": args.rounds,
+        "runs": [run(tmp, int(n), args) for n in args.shards.split(",")],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--networks", type=int, default=16)
+    parser.add_argument("--stations", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("-o", "--output")
+    main(parser.parse_args())
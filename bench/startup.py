@@ -0,0 +1,73 @@
+"""Cold start benchmark: import time, lifespan (startup) and time to first
+response, each measured on a fresh interpreter.
+
+    python bench/startup.py -n 20 --url /3/bicing/station_status.json
+    READ_ONLY=1 python bench/startup.py -o startup.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+PROBE = """
+import sys, time, json, asyncio
+
+t0 = time.perf_counter()
+from citybikes.gbfs.app import app
+from citybikes.gbfs.render import fetch
+t1 = time.perf_counter()
+
+async def main():
+    async with app.router.lifespan_context(app):
+        t2 = time.perf_counter()
+        status, _ = await fetch(app, "http://localhost" + sys.argv[1])
+        t3 = time.perf_counter()
+    assert status == 200, status
+    return t2, t3
+
+t2, t3 = asyncio.run(main())
+print(json.dumps({"import": t1 - t0, "startup": t2 - t1, "first_response": t3 - t2}))
+"""
+
+
+def run(url):
+    r = subprocess.run(
+        [sys.executable, "-c", PROBE, url],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return json.loads(r.stdout.splitlines()[-1])
+
+
+def main(args):
+    samples = [run(args.url) for _ in range(args.n)]
+    result = {
+        "url": args.url,
+        "env": {k: os.environ[k] for k in ["DB_URI", "READ_ONLY"] if k in os.environ},
+        "n": args.n,
+    }
+    for phase in ["import", "startup", "first_response"]:
+        values = sorted(s[phase] * 1000 for s in samples)
+        result[phase] = {
+            "p50_ms": round(statistics.median(values), 2),
+            "max_ms": round(values[-1], 2),
+        }
+    total = sorted(sum(s.values()) * 1000 for s in samples)
+    result["total"] = {"p50_ms": round(statistics.median(total), 2)}
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--url", default="/3/manifest.json")
+    parser.add_argument("-o", "--output")
+    main(parser.parse_args())
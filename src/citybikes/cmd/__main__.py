@@ -4,4 +4,8 @@ Commands:
 
   srv           start server
   migrate       run migrations
+  load          bulk load a dump of networks
+  maintain      expire stale networks, vacuum and optimize the db
+  snapshot      render all feeds into a shared snapshot
+  export        render all feeds into a static directory tree
 """)
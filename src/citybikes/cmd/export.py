@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from citybikes.db.shards import open_read_only
+from citybikes.gbfs.app import VERSIONS
+from citybikes.gbfs.render import renderer, feed_paths, fetch, network_of
+
+DB_URI = os.getenv("DB_URI", "citybikes.db")
+SHARDS = int(os.getenv("SHARDS", "1"))
+EXPORT_DIR = os.getenv("EXPORT_DIR", "gbfs")
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8000/")
+# keeps track of what was exported, to only re-render what changed. Out of
+# the output dir, that is served as is (default: next to it)
+EXPORT_STATE = os.getenv("EXPORT_STATE")
+
+log = logging.getLogger("export")
+
+
+def write(output, path, body):
+    """atomically write body to output/path"""
+    dest = os.path.join(output, path.lstrip("/"))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".export-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+async def export(tags, output, base_url):
+    """render and write the feeds of tags. None renders global feeds.
+    Returns the feeds written, and the tags of those that failed"""
+    # the subscriber writes to the db meanwhile, not migrated from here
+    async with open_read_only(DB_URI, SHARDS) as db:
+        app = renderer(db)
+        all_tags = await app.db.get_tags()
+        count = 0
+        failed = set()
+        for path in feed_paths(app, all_tags):
+            if network_of(path) not in tags:
+                continue
+            status, body = await fetch(app, base_url.rstrip("/") + path)
+            if status != 200:
+                log.warning("Failed rendering %s: %d", path, status)
+                failed.add(network_of(path))
+                continue
+            write(output, path, body)
+            count += 1
+        return count, failed
+
+
+def export_job(tags, output, base_url):
+    # process pool entry point, each job gets its own db connection
+    return asyncio.run(export(set(tags), output, base_url))
+
+
+def chunks(items, n):
+    return [items[i::n] for i in range(n) if items[i::n]]
+
+
+async def main(args):
+    base_url = args.base_url.rstrip("/") + "/"
+    state_path = args.state or args.output.rstrip("/") + ".export.json"
+
+    # XXX used to be kept in the output dir, where it was served along
+    legacy = os.path.join(args.output, ".export.json")
+    if os.path.exists(legacy):
+        os.unlink(legacy)
+
+    state = {}
+    if os.path.exists(state_path) and not args.full:
+        with open(state_path) as f:
+            state = json.load(f)
+    # versions are (updated, seq), updated alone misses changes within a second
+    if state.get("base_url") != base_url or "versions" not in state:
+        state = {"base_url": base_url, "versions": {}, "global": False}
+
+    async with open_read_only(DB_URI, SHARDS) as db:
+        versions = {t: list(v) for t, v in (await db.get_versions()).items()}
+
+    changed = [t for t, v in versions.items() if state["versions"].get(t) != v]
+    removed = [t for t in state["versions"] if t not in versions]
+
+    start = time.perf_counter()
+    count = 0
+    failed = set()
+    if changed:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            jobs = [
+                pool.submit(export_job, tags, args.output, base_url)
+                for tags in chunks(sorted(changed), args.jobs)
+            ]
+            for job in jobs:
+                n, f = job.result()
+                count += n
+                failed |= f
+
+    for tag in removed:
+        for version in VERSIONS:
+            major = version.split(".")[0]
+            shutil.rmtree(os.path.join(args.output, major, tag), ignore_errors=True)
+
+    # feeds not tied to a network (ie: manifest) depend on all of them
+    if changed or removed or not state.get("global"):
+        n, f = await export({None}, args.output, base_url)
+        count += n
+        state["global"] = not f
+
+    # networks that failed are left as they were, to retry on the next run
+    state["versions"] = {
+        t: state["versions"][t] if t in failed else v
+        for t, v in versions.items()
+        if t not in failed or t in state["versions"]
+    }
+    write(*os.path.split(os.path.abspath(state_path)), json.dumps(state).encode())
+
+    log.info(
+        "Exported %d feeds of %d networks (%d removed, %d failed) in %.2fs",
+        count,
+        len(changed),
+        len(removed),
+        len(failed),
+        time.perf_counter() - start,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s.%(msecs)03d | %(levelname)s | %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stderr)],
+        datefmt="%H:%M:%S",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", default=EXPORT_DIR)
+    parser.add_argument("-b", "--base-url", default=BASE_URL)
+    parser.add_argument(
+        "--state", default=EXPORT_STATE, help="default: <output>.export.json"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--full", action="store_true", help="re-render all")
+    args, _ = parser.parse_known_args()
+    asyncio.run(main(args))
@@ -0,0 +1,156 @@
+import os
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+
+from citybikes.db import get_session, migrate
+from citybikes.db.ingest import write_network
+from citybikes.db.shards import paths, shard_of
+
+DB_URI = os.getenv("DB_URI", "citybikes.db")
+SHARDS = int(os.getenv("SHARDS", 1))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# indexes no write reads from, built once after the load instead of row by
+# row. The rest back the GC of ingest and the pruning of changes
+DEFERRED = ["idx_stations_grid", "idx_vehicles_grid"]
+
+log = logging.getLogger("load")
+
+
+def read(path):
+    """networks of a dump, either a JSON list or NDJSON, optionally gzipped"""
+    if path == "-":
+        f = sys.stdin
+    elif path.endswith(".gz"):
+        f = gzip.open(path, "rt")
+    else:
+        f = open(path)
+
+    with f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if not first:
+            return
+        if first == "[":
+            yield from json.loads(first + f.read())
+            return
+        yield json.loads(first + f.readline())
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load(con, networks, progress=100):
+    """store networks on a single transaction, as the subscriber would.
+    Returns (networks, stations, vehicles) loaded"""
+    # index drops included, nothing is left behind if the load fails
+    con.execute("BEGIN")
+    deferred = con.execute(
+        f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND name IN ({",".join("?" * len(DEFERRED))})
+    """,
+        DEFERRED,
+    ).fetchall()
+    for index in deferred:
+        con.execute(f"DROP INDEX {index['name']}")
+
+    start = time.perf_counter()
+    count = [0, 0, 0]
+    cursor = con.cursor()
+    for network in networks:
+        # dumps may leave out empty lists
+        network.setdefault("stations", [])
+        network.setdefault("vehicles", [])
+        write_network(cursor, network)
+
+        count[0] += 1
+        count[1] += len(network["stations"])
+        count[2] += len(network["vehicles"])
+        if count[0] % progress == 0:
+            elapsed = time.perf_counter() - start
+            log.info(
+                "%d networks, %d rows, %.0f rows/s",
+                count[0],
+                count[1] + count[2],
+                (count[1] + count[2]) / elapsed,
+            )
+
+    for index in deferred:
+        log.info("Building %s", index["name"])
+        con.execute(index["sql"])
+
+    log.info("Committing")
+    con.commit()
+    return tuple(count)
+
+
+def main(args):
+    # ingest logs every network, too much for a load
+    logging.getLogger("db").setLevel(logging.WARNING)
+
+    networks = read(args.dump)
+    path = args.db
+    if args.shards > 1:
+        # the networks of the shard, run once per shard
+        path = paths(args.db, args.shards)[args.shard]
+        networks = (
+            n for n in networks if shard_of(n["tag"], args.shards) == args.shard
+        )
+        log.info("Loading shard %d of %d into %s", args.shard, args.shards, path)
+
+    with get_session(path) as con:
+        assert migrate(con)
+
+        # XXX trades durability for speed, a crash mid load may leave the db
+        # corrupt. Meant to bootstrap a node, not to load into a live db
+        journal_mode = con.execute("PRAGMA journal_mode").fetchone()["journal_mode"]
+        con.execute("PRAGMA journal_mode = MEMORY")
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute(f"PRAGMA cache_size = -{args.cache_size * 1024}")
+        con.execute("PRAGMA temp_store = MEMORY")
+
+        start = time.perf_counter()
+        networks, stations, vehicles = load(con, networks, args.progress)
+        elapsed = time.perf_counter() - start
+
+        con.execute(f"PRAGMA journal_mode = {journal_mode}")
+
+    rows = stations + vehicles
+    log.info(
+        "Loaded %d networks, %d stations and %d vehicles in %.1fs (%.0f rows/s)",
+        networks,
+        stations,
+        vehicles,
+        elapsed,
+        rows / elapsed if elapsed else 0,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stderr)],
+        datefmt="%H:%M:%S",
+    )
+
+    parser = argparse.ArgumentParser(
+        description="load a dump of networks (JSON list or NDJSON of hyper "
+        "messages, optionally gzipped, - for stdin) into the db"
+    )
+    parser.add_argument("dump")
+    parser.add_argument("--db", default=DB_URI)
+    parser.add_argument("--cache-size", type=int, default=256, help="MiB")
+    parser.add_argument("--progress", type=int, default=100, help="networks")
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    parser.add_argument("--shard", type=int, default=0)
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error(f"--shard must be between 0 and {args.shards - 1}")
+    main(args)
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import logging
+import argparse
+
+from citybikes.db.maintenance import connect, convert, maintain
+from citybikes.db.shards import paths
+
+DB_URI = os.getenv("DB_URI", "citybikes.db")
+SHARDS = int(os.getenv("SHARDS", 1))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# delete networks not updated in this many hours, 0 keeps them
+EXPIRE_AFTER_HOURS = float(os.getenv("EXPIRE_AFTER_HOURS", 0))
+# free pages given back per run, 0 is all of them
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", 0))
+# history rows older than this are downsampled to a sample every
+# HISTORY_STEP seconds, and deleted past HISTORY_KEEP_DAYS (0 keeps them)
+HISTORY_ROLLUP_DAYS = float(os.getenv("HISTORY_ROLLUP_DAYS", 7))
+HISTORY_STEP = int(os.getenv("HISTORY_STEP", 900))
+HISTORY_KEEP_DAYS = float(os.getenv("HISTORY_KEEP_DAYS", 0))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stderr)],
+        datefmt="%H:%M:%S",
+    )
+
+    parser = argparse.ArgumentParser(
+        description="expire stale networks, vacuum and optimize the db"
+    )
+    parser.add_argument("--db", default=DB_URI)
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help="switch to incremental auto_vacuum first, with a full VACUUM. "
+        "Once per db, with the subscriber stopped",
+    )
+    parser.add_argument("--expire-after", type=float, default=EXPIRE_AFTER_HOURS)
+    parser.add_argument("--vacuum-pages", type=int, default=VACUUM_PAGES)
+    parser.add_argument(
+        "--history-rollup-days", type=float, default=HISTORY_ROLLUP_DAYS
+    )
+    parser.add_argument("--history-step", type=int, default=HISTORY_STEP)
+    parser.add_argument("--history-keep-days", type=float, default=HISTORY_KEEP_DAYS)
+    args = parser.parse_args()
+
+    rollup = (args.history_rollup_days, args.history_step, args.history_keep_days)
+    reports = {}
+    # one shard after the other
+    for path in paths(args.db, args.shards):
+        con = connect(path)
+        try:
+            if args.convert:
+                convert(con)
+            reports[path] = maintain(
+                con, args.expire_after, args.vacuum_pages, rollup, analyze=True
+            )
+        finally:
+            con.close()
+    report = reports[args.db] if args.shards <= 1 else reports
+    print(json.dumps(report, indent=2))
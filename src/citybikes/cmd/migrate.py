@@ -3,9 +3,11 @@ import sys
 import logging
 
 from citybikes.db import get_session, migrate
+from citybikes.db.shards import paths
 
 
 DB_URI = os.getenv("DB_URI", "citybikes.db")
+SHARDS = int(os.getenv("SHARDS", 1))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
 
@@ -16,5 +18,7 @@ if __name__ == "__main__":
         handlers=[logging.StreamHandler(stream=sys.stderr)],
         datefmt="%H:%M:%S",
     )
-    with get_session(DB_URI) as db:
-        sys.exit(int(not migrate(db)))
+    for path in paths(DB_URI, SHARDS):
+        with get_session(path) as db:
+            if not migrate(db):
+                sys.exit(1)
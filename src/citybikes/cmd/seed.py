@@ -1,12 +1,36 @@
 import os
+import argparse
 from importlib import resources
 
-from citybikes.db import get_session
+from citybikes.db import get_session, migrate
+from citybikes.db.ingest import store_network
 
 DB_URI = os.getenv("DB_URI", "citybikes.db")
 
 
 if __name__ == "__main__":
-    test_data = resources.files("tests") / "fixtures/test_data.sql"
-    with get_session(DB_URI) as db:
-        db.executescript(test_data.read_text())
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="seed generated networks instead of the test data",
+    )
+    parser.add_argument("--sizes", default="100,1000", help="stations per network")
+    parser.add_argument("--mixes", default=None, help="extra fields mixes")
+    parser.add_argument("--vehicles", type=int, default=None)
+    args = parser.parse_args()
+
+    if not args.synthetic:
+        test_data = resources.files("tests") / "fixtures/test_data.sql"
+        backfill = resources.files("citybikes.db") / "network_stats.sql"
+        with get_session(DB_URI) as db:
+            db.executescript(test_data.read_text() + backfill.read_text())
+    else:
+        from citybikes import synthetic
+
+        sizes = [int(s) for s in args.sizes.split(",")]
+        mixes = args.mixes.split(",") if args.mixes else None
+        with get_session(DB_URI) as db:
+            assert migrate(db)
+            for network in synthetic.networks(sizes, mixes, args.vehicles):
+                store_network(db, network)
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+from citybikes.db.shards import open_cbd
+from citybikes.gbfs.cache import Watcher
+from citybikes.gbfs.render import renderer, feed_paths, fetch, network_of
+from citybikes.gbfs.shared import publish
+
+DB_URI = os.getenv("DB_URI", "citybikes.db")
+SHARDS = int(os.getenv("SHARDS", "1"))
+SHARED_FEEDS = os.getenv("SHARED_FEEDS", "feeds.snapshot")
+# feeds contain absolute urls, workers only serve from the snapshot
+# requests on this same base url
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8000/")
+WATCH_INTERVAL_MS = int(os.getenv("WATCH_INTERVAL_MS", "500"))
+
+log = logging.getLogger("snapshot")
+
+
+async def render(app, paths, base_url):
+    feeds = {}
+    for path in paths:
+        status, body = await fetch(app, base_url.rstrip("/") + path)
+        if status != 200:
+            log.warning("Failed rendering %s: %d", path, status)
+            continue
+        feeds[path] = body
+    return feeds
+
+
+async def main(args):
+    base_url = args.base_url.rstrip("/") + "/"
+    interval = WATCH_INTERVAL_MS / 1000
+
+    async with open_cbd(DB_URI, SHARDS) as db:
+        app = renderer(db)
+
+        feeds = {}
+        changed = set()
+        watcher = Watcher(db, interval=interval)
+        watcher.subscribe(changed.update)
+        await watcher.poll()
+
+        while True:
+            if changed:
+                start = time.perf_counter()
+                tags = await db.get_tags()
+                # drop changed networks and feeds that depend on all of them
+                feeds = {
+                    path: body
+                    for path, body in feeds.items()
+                    if network_of(path) and network_of(path) not in changed
+                }
+                paths = [p for p in feed_paths(app, tags) if p not in feeds]
+                feeds.update(await render(app, paths, base_url))
+                publish(args.output, feeds, base_url)
+                log.info(
+                    "Published %d feeds (%d rendered, %d networks changed) in %.2fs",
+                    len(feeds),
+                    len(paths),
+                    len(changed),
+                    time.perf_counter() - start,
+                )
+                changed.clear()
+
+            if not args.watch:
+                break
+
+            await asyncio.sleep(interval)
+            await watcher.poll()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s.%(msecs)03d | %(levelname)s | %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stderr)],
+        datefmt="%H:%M:%S",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", default=SHARED_FEEDS)
+    parser.add_argument("-b", "--base-url", default=BASE_URL)
+    parser.add_argument("-w", "--watch", action="store_true")
+    args, _ = parser.parse_known_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,11 +1,29 @@
+import os
 import sys
 import subprocess
 
+from citybikes.db import get_session, migrate
+from citybikes.db.shards import paths
+
+DB_URI = os.getenv("DB_URI", "citybikes.db")
+SHARDS = int(os.getenv("SHARDS", 1))
+# number of uvicorn worker processes. Workers keep their own caches, kept
+# coherent through citybikes.gbfs.cache.Watcher
+WORKERS = os.getenv("WORKERS", "1")
+
 
 # death to argparse
 if __name__ == "__main__":
+    # migrate once, before workers race to do so
+    for path in paths(DB_URI, SHARDS):
+        with get_session(path) as db:
+            assert migrate(db)
+
+    args = sys.argv[1:]
+    if "--workers" not in args:
+        args += ["--workers", WORKERS]
     try:
-        r = subprocess.run(["uvicorn", "citybikes.gbfs.app:app"] + sys.argv[1:])
+        r = subprocess.run(["uvicorn", "citybikes.gbfs.app:app"] + args)
         sys.exit(r.returncode)
     except KeyboardInterrupt:
         pass
@@ -6,12 +6,47 @@ import signal
 import logging
 import argparse
 
+import zmq
+import zmq.asyncio
+
+from citybikes import metrics
 from citybikes.db import migrate
+from citybikes.db.ingest import store_network
+from citybikes.db.wal import Checkpointer
+from citybikes.db.history import History
+from citybikes.db.maintenance import Maintainer
+from citybikes.db.shards import paths, shard_of, tag_of
 from citybikes.hyper.subscriber import ZMQSubscriber
 
 DB_URI = os.getenv("DB_URI", "citybikes.db")
 ZMQ_ADDR = os.getenv("ZMQ_ADDR", "tcp://127.0.0.1:5555")
 ZMQ_TOPIC = os.getenv("ZMQ_TOPIC", "")
+# store only the networks of shard SHARD out of SHARDS, on its own db file,
+# see citybikes.db.shards. Run a subscriber per shard
+SHARDS = int(os.getenv("SHARDS", 1))
+SHARD = int(os.getenv("SHARD", 0))
+# expose prometheus metrics on this port
+METRICS_PORT = os.getenv("METRICS_PORT")
+# checkpoint the WAL from a background thread every this many seconds,
+# instead of inline on commits. 0 leaves it to sqlite auto-checkpoints
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", 0))
+# escalate to a truncating checkpoint when the WAL grows over this size
+WAL_SIZE_LIMIT_MB = int(os.getenv("WAL_SIZE_LIMIT_MB", 64))
+# pages, see PRAGMA wal_autocheckpoint. Defaults to 0 (off) when running
+# the checkpointer, and to the sqlite default otherwise
+WAL_AUTOCHECKPOINT = os.getenv("WAL_AUTOCHECKPOINT")
+# run maintenance (see citybikes.cmd.maintain) every this many hours, 0 is
+# never
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", 0))
+EXPIRE_AFTER_HOURS = float(os.getenv("EXPIRE_AFTER_HOURS", 0))
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", 0))
+# record the availability history of stations, see db.history
+HISTORY = os.getenv("HISTORY", "0") == "1"
+# history rows older than this are downsampled to a sample every
+# HISTORY_STEP seconds, and deleted past HISTORY_KEEP_DAYS (0 keeps them)
+HISTORY_ROLLUP_DAYS = float(os.getenv("HISTORY_ROLLUP_DAYS", 7))
+HISTORY_STEP = int(os.getenv("HISTORY_STEP", 900))
+HISTORY_KEEP_DAYS = float(os.getenv("HISTORY_KEEP_DAYS", 0))
 
 log = logging.getLogger("subscriber")
 
@@ -20,168 +55,50 @@ log = logging.getLogger("subscriber")
 
 
 class Sqlitesubscriber(ZMQSubscriber):
-    def __init__(self, con, *args, **kwargs):
+    def __init__(self, con, *args, history=None, shard=(0, 1), **kwargs):
         super().__init__(*args, **kwargs)
         self.con = con
+        self.history = history
+        self.shard = shard
 
     def handle_message(self, topic, message):
+        shard, shards = self.shard
+        # XXX every subscriber still gets every message, zmq topics filter by
+        # prefix and can not split by hash. Only those of the shard are decoded
+        if shards > 1 and shard_of(tag_of(message), shards) != shard:
+            return
         network = json.loads(message)
-        meta = network["meta"]
-
-        station_ids = [s["id"] for s in network.get("stations", [])]
-        vehicle_ids = [v["id"] for v in network.get("vehicles", [])]
-
-        cursor = self.con.cursor()
-
-        # XXX check JSONB types
-        log.info("Processing %s", meta)
-
-        cursor.execute(
-            """
-            INSERT INTO networks (tag, name, latitude, longitude, meta, stations, vehicles)
-            VALUES (?, ?, ?, ?, json(?), json(?), json(?))
-            ON CONFLICT(tag) DO UPDATE SET
-                name=excluded.name,
-                latitude=excluded.latitude,
-                longitude=excluded.longitude,
-                meta=json(excluded.meta),
-                stations=json(excluded.stations),
-                vehicles=json(excluded.vehicles)
-            WHERE
-                -- ignore info if no stations (prob an error)
-                excluded.stations != '[]' OR excluded.vehicles != '[]'
-        """,
-            (
-                network["tag"],
-                meta["name"],
-                meta["latitude"],
-                meta["longitude"],
-                json.dumps(meta),
-                json.dumps(station_ids),
-                json.dumps(vehicle_ids),
-            ),
-        )
-
-        self.con.commit()
-
-        log.info("[%s] Got %d stations" % (network["tag"], len(network["stations"])))
-
-        data_iter = (
-            (
-                s["id"],
-                s["name"],
-                s["latitude"],
-                s["longitude"],
-                json.dumps(
-                    {
-                        "bikes": s["bikes"],
-                        "free": s["free"],
-                        "timestamp": s["timestamp"],
-                        "extra": s["extra"],
-                    }
-                ),
-                network["tag"],
-            )
-            for s in network["stations"]
-        )
-
-        cursor.executemany(
-            """
-            INSERT INTO stations (hash, name, latitude, longitude, stat, network_tag)
-            VALUES (?, ?, ?, ?, json(?), ?)
-            ON CONFLICT(hash) DO UPDATE SET
-                -- some networks may stop providing a name randomly
-                name=coalesce(excluded.name, name),
-                --
-                latitude=excluded.latitude,
-                longitude=excluded.longitude,
-                stat=json(excluded.stat),
-                network_tag=excluded.network_tag
-        """,
-            data_iter,
-        )
-        self.con.commit()
-        log.info(
-            "[%s] Finished processing %d stations"
-            % (network["tag"], len(network["stations"]))
-        )
-
-        log.info("[%s] Got %d vehicles" % (network["tag"], len(network["vehicles"])))
-
-        data_iter = (
-            (
-                v["id"],
-                v["latitude"],
-                v["longitude"],
-                v["kind"],
-                json.dumps(
-                    {
-                        "timestamp": v["timestamp"],
-                        "extra": v["extra"],
-                    }
-                ),
-                network["tag"],
-            )
-            for v in network["vehicles"]
-        )
-
-        cursor.executemany(
-            """
-            INSERT INTO vehicles (hash, latitude, longitude, kind, stat, network_tag)
-            VALUES (?, ?, ?, ?, json(?), ?)
-            ON CONFLICT(hash) DO UPDATE SET
-                latitude=excluded.latitude,
-                longitude=excluded.longitude,
-                kind=excluded.kind,
-                stat=json(excluded.stat),
-                network_tag=excluded.network_tag
-        """,
-            data_iter,
-        )
-        self.con.commit()
-        log.info(
-            "[%s] Finished processing %d vehicles"
-            % (network["tag"], len(network["vehicles"]))
-        )
-
-        # Now its probably a good time to clean up orphaned vehicles and
-        # stations ...
-        # XXX: this could be an update trigger on networks
-        cursor.execute(
-            """
-            DELETE FROM stations
-            WHERE network_tag = ?
-              AND hash NOT IN (
-                SELECT value FROM networks, json_each(networks.stations)
-                WHERE networks.tag = ?
-            );
-         """,(network['tag'], network['tag'], ))
-
-        log.info(
-            "[%s] GC %d stations"
-            % (network["tag"], cursor.rowcount)
-        )
-
-        cursor.execute(
-            """
-            DELETE FROM vehicles
-            WHERE network_tag = ?
-              AND hash NOT IN (
-                SELECT value FROM networks, json_each(networks.vehicles)
-                WHERE networks.tag = ?
-            );
-         """,(network['tag'], network['tag'], ))
-
-        log.info(
-            "[%s] GC %d vehicles"
-            % (network["tag"], cursor.rowcount)
-        )
-
-        self.con.commit()
+        store_network(self.con, network, self.history)
+
+
+async def areader(addr, topic, handle_message):
+    """asyncio counterpart of ZMQSubscriber.reader, to run the subscriber
+    logic as a task inside an event loop (ie: the API lifespan).
+    handle_message is a coroutine function, awaited one message at a time"""
+
+    ctx = zmq.asyncio.Context.instance()
+    sock = ctx.socket(zmq.SUB)
+    sock.connect(addr)
+    sock.setsockopt_string(zmq.SUBSCRIBE, topic)
+    log.info("Subscribed to %s (topic: '%s')", addr, topic)
+
+    try:
+        while True:
+            topic, message = await sock.recv_multipart()
+            topic = topic.decode("utf-8")
+            try:
+                await handle_message(topic, message.decode("utf-8"))
+            except Exception:
+                # a bad message (ie: not json, or an invalid network) is
+                # skipped, not the end of the subscriber
+                log.exception("Failed handling message (topic: '%s')", topic)
+    finally:
+        sock.close()
 
 
 def main(args):
-    db = sqlite3.connect(DB_URI)
+    path = paths(args.db, args.shards)[args.shard]
+    db = sqlite3.connect(path)
     db.row_factory = lambda *a: dict(sqlite3.Row(*a))
     assert migrate(db)
 
@@ -191,7 +108,38 @@ def main(args):
     """)
     db.commit()
 
+    limit = args.wal_size_limit * 2**20
+    autocheckpoint = args.wal_autocheckpoint
+    if autocheckpoint is None and args.checkpoint_interval:
+        autocheckpoint = 0
+    if autocheckpoint is not None:
+        db.execute(f"PRAGMA wal_autocheckpoint = {int(autocheckpoint)}")
+    # truncate the WAL file back to the limit whenever it is reset
+    db.execute(f"PRAGMA journal_size_limit = {limit}")
+
+    checkpointer = None
+    if args.checkpoint_interval:
+        checkpointer = Checkpointer(path, args.checkpoint_interval, limit)
+        checkpointer.start()
+        log.info("Checkpointing every %ss", args.checkpoint_interval)
+
+    maintainer = None
+    if args.maintenance_interval:
+        maintainer = Maintainer(
+            path,
+            args.maintenance_interval * 3600,
+            args.expire_after,
+            args.vacuum_pages,
+            (args.history_rollup_days, args.history_step, args.history_keep_days),
+        )
+        maintainer.start()
+        log.info("Maintenance every %sh", args.maintenance_interval)
+
     def shutdown(*args, **kwargs):
+        if checkpointer:
+            checkpointer.stop()
+        if maintainer:
+            maintainer.stop()
         log.info("Closing DB conn")
         db.close()
         sys.exit(0)
@@ -199,7 +147,21 @@ def main(args):
     for sig in (signal.SIGINT, signal.SIGTERM):
         signal.signal(sig, shutdown)
 
-    subscriber = Sqlitesubscriber(db, args.addr, args.topic)
+    if args.metrics_port:
+        metrics.serve(int(args.metrics_port))
+        log.info("Serving metrics on :%s/metrics", args.metrics_port)
+
+    history = None
+    if args.history:
+        history = History()
+        log.info("Recording availability history")
+
+    if args.shards > 1:
+        log.info("Storing shard %d of %d on %s", args.shard, args.shards, path)
+
+    subscriber = Sqlitesubscriber(
+        db, args.addr, args.topic, history=history, shard=(args.shard, args.shards)
+    )
     subscriber.reader()
 
 
@@ -214,5 +176,27 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-a", "--addr", default=ZMQ_ADDR)
     parser.add_argument("-t", "--topic", default=ZMQ_TOPIC)
+    parser.add_argument("-m", "--metrics-port", default=METRICS_PORT)
+    parser.add_argument("--db", default=DB_URI)
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    parser.add_argument("--shard", type=int, default=SHARD)
+    parser.add_argument(
+        "--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL
+    )
+    parser.add_argument("--wal-size-limit", type=int, default=WAL_SIZE_LIMIT_MB)
+    parser.add_argument("--wal-autocheckpoint", type=int, default=WAL_AUTOCHECKPOINT)
+    parser.add_argument(
+        "--maintenance-interval", type=float, default=MAINTENANCE_INTERVAL
+    )
+    parser.add_argument("--expire-after", type=float, default=EXPIRE_AFTER_HOURS)
+    parser.add_argument("--vacuum-pages", type=int, default=VACUUM_PAGES)
+    parser.add_argument(
+        "--history-rollup-days", type=float, default=HISTORY_ROLLUP_DAYS
+    )
+    parser.add_argument("--history-step", type=int, default=HISTORY_STEP)
+    parser.add_argument("--history-keep-days", type=float, default=HISTORY_KEEP_DAYS)
+    parser.add_argument("--history", action="store_true", default=HISTORY)
     args, _ = parser.parse_known_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error(f"--shard must be between 0 and {args.shards - 1}")
     main(args)
@@ -14,16 +14,30 @@ def get_session(*args, **kwargs):
         yield db
 
 
+def script(path):
+    """sql of a script, with the `.read <file>` lines of the sqlite3 shell
+    replaced by that file of citybikes.db"""
+    files = resources.files("citybikes.db")
+    lines = path.read_text().splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.startswith(".read "):
+            lines[i] = (files / line.split(None, 1)[1].strip()).read_text()
+    return "".join(lines)
+
+
 def migrate(conn):
     migrations_path = resources.files("citybikes.db") / "migrations"
     migrations = sorted(list(migrations_path.glob("*.sql")))
     version = conn.execute("PRAGMA user_version").fetchone()
     version = version["user_version"]
+    if version == 0:
+        # only takes effect before tables are created, see db.maintenance
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
     for migration in migrations[version:]:
         cur = conn.cursor()
         try:
             log.info("Applying %s", migration.name)
-            cur.executescript("begin;" + migration.read_text())
+            cur.executescript("begin;" + script(migration))
         except Exception as e:
             log.error("Failed migration %s: %s. Bye", migration.name, e)
             cur.execute("rollback")
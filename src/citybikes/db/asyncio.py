@@ -5,6 +5,8 @@ from contextlib import asynccontextmanager
 
 import aiosqlite
 
+from citybikes.db import script
+
 log = logging.getLogger("db")
 
 # XXX: try to dedupe with db/__init__.py
@@ -15,11 +17,14 @@ async def migrate(conn):
     migrations = sorted(list(migrations_path.glob("*.sql")))
     version = await (await conn.execute("PRAGMA user_version")).fetchone()
     version = version["user_version"]
+    if version == 0:
+        # only takes effect before tables are created, see db.maintenance
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
     for migration in migrations[version:]:
         cur = await conn.cursor()
         try:
             log.info("Applying %s", migration.name)
-            await cur.executescript("begin;" + migration.read_text())
+            await cur.executescript("begin;" + script(migration))
         except Exception as e:
             log.error("Failed migration %s: %s. Bye", migration.name, e)
             await cur.execute("rollback")
@@ -30,6 +35,19 @@ async def migrate(conn):
     return True
 
 
+async def check_version(conn):
+    # read only startup, verify the schema is up to date instead of migrating
+    migrations_path = resources.files("citybikes.db") / "migrations"
+    migrations = list(migrations_path.glob("*.sql"))
+    version = await (await conn.execute("PRAGMA user_version")).fetchone()
+    version = version["user_version"]
+    if version != len(migrations):
+        log.error("DB at version %d, expected %d. Bye", version, len(migrations))
+        return False
+
+    return True
+
+
 @staticmethod
 @asynccontextmanager
 async def get_session(*args, **kwargs):
@@ -1,7 +1,24 @@
+import json
+
+from citybikes import metrics
+from citybikes.db import geo, history
 from citybikes.db.types import Station, Network, Vehicle
 
+QUERY_TIME = metrics.histogram(
+    "cbd_query_duration_seconds",
+    "Time spent on CBD queries",
+    ["method"],
+)
+
+
+def timed(fn):
+    return metrics.timed(QUERY_TIME, method=fn.__name__)(fn)
+
 
 class CBD:
+    # updates that removals are kept for, see migrations/0004
+    TOMBSTONES = 1440
+
     def __init__(self, db):
         self.db = db
 
@@ -9,6 +26,7 @@ class CBD:
     def __getattr__(self, attr):
         return getattr(self.db, attr)
 
+    @timed
     async def get_network(self, uid):
         cur = await self.db.execute(
             """
@@ -26,7 +44,63 @@ class CBD:
 
         return Network(**row)
 
-    async def get_stations(self, uid):
+    async def _within(self, table, bbox, uid=None, available=False):
+        west, south, east, north = bbox
+        first, last = geo.bands(south, north)
+
+        # one range of longitude per band of the grid index
+        if last - first + 1 > geo.MAX_BANDS:
+            grid = "BETWEEN ? AND ?"
+            args = [first, last]
+        else:
+            grid = "IN (SELECT value FROM json_each(?))"
+            args = [json.dumps(list(range(first, last + 1)))]
+
+        args += [west, east, south, north]
+        where = ""
+        if uid:
+            # unary + keeps the planner off idx_network_tag
+            where += " AND +network_tag = ?"
+            args.append(uid)
+        if available:
+            where += " AND stat->>'bikes' > 0"
+
+        cur = await self.db.execute(
+            f"""
+            SELECT * FROM {table}
+            WHERE CAST((latitude + 90) * 100 AS INTEGER) {grid}
+              AND longitude BETWEEN ? AND ?
+              AND latitude BETWEEN ? AND ?
+              {where}
+            ORDER BY hash
+        """,
+            args,
+        )
+        return await cur.fetchall()
+
+    @timed
+    async def nearby(self, lat, lon, k=10, available=False):
+        """(tag, station, meters) of the k stations closest to a point,
+        across networks"""
+        hits = []
+        for bbox, meters in geo.searches(lat, lon):
+            rows = await self._within("stations", bbox, available=available)
+            hits = [
+                (geo.distance(lat, lon, r["latitude"], r["longitude"]), r)
+                for r in rows
+            ]
+            hits = sorted((h for h in hits if h[0] <= meters), key=lambda h: h[0])
+            if len(hits) >= k:
+                break
+
+        return [(r["network_tag"], Station(**r), d) for d, r in hits[:k]]
+
+    @timed
+    async def get_stations(self, uid, bbox=None):
+        if bbox:
+            rows = await self._within("stations", bbox, uid)
+            return [Station(**r) for r in rows]
+
         cur = await self.db.execute(
             """
             SELECT s.*
@@ -44,7 +118,69 @@ class CBD:
         stations = map(lambda r: Station(**r), await cur.fetchall())
         return list(stations)
 
-    async def get_vehicles(self, uid):
+    @timed
+    async def get_stations_by_id(self, uid, ids):
+        """stations of uid by id, off the primary key"""
+        cur = await self.db.execute(
+            """
+            SELECT * FROM stations
+            WHERE hash IN (SELECT value FROM json_each(?))
+              AND network_tag = ?
+            ORDER BY hash
+        """,
+            (json.dumps(ids), uid),
+        )
+
+        stations = map(lambda r: Station(**r), await cur.fetchall())
+        return list(stations)
+
+    async def iter_stations(self, since=None):
+        """(tag, updated, stations) of every network updated after since, in
+        tag order, streamed off a single cursor holding at most one network
+        in memory"""
+
+        # XXX the statement keeps a read snapshot open on this connection
+        # for as long as the consumer takes, so other queries sharing the
+        # connection (ie: the watcher) do not see newer commits until done,
+        # and WAL checkpoints can not get past it. Streams to clients get a
+        # connection of their own, see app.streams
+        cur = await self.db.execute(
+            """
+            SELECT n.updated AS network_updated, s.*
+            FROM networks n
+            -- join order matters, from networks to json_each to stations
+            CROSS JOIN json_each(n.stations) j
+            CROSS JOIN stations s ON s.hash = j.value
+            WHERE n.updated > ?
+              AND s.network_tag = n.tag
+            ORDER BY n.tag, s.hash
+        """,
+            (since or "",),
+        )
+
+        try:
+            tag, updated, stations = None, None, []
+            while rows := await cur.fetchmany(1024):
+                for row in rows:
+                    if row["network_tag"] != tag:
+                        if stations:
+                            yield tag, updated, stations
+                        tag, updated = row["network_tag"], row["network_updated"]
+                        stations = []
+                    stations.append(Station(**row))
+
+            if stations:
+                yield tag, updated, stations
+        finally:
+            # ends the read snapshot as soon as the consumer is gone
+            await cur.close()
+
+    @timed
+    async def get_vehicles(self, uid, bbox=None):
+        if bbox:
+            rows = await self._within("vehicles", bbox, uid)
+            return [Vehicle(**r) for r in rows]
+
         cur = await self.db.execute(
             """
             SELECT v.*
@@ -63,6 +199,68 @@ class CBD:
         vehicles = map(lambda r: Vehicle(**r), await cur.fetchall())
         return list(vehicles)
 
+    @timed
+    async def get_history(self, uid, station_id=None, start=None, end=None):
+        """{station_id: [history.Sample]} of the current stations of uid, or
+        of one of them, between start and end (epoch seconds)"""
+        sql, args = history.query(uid, station_id, start, end)
+        cur = await self.db.execute(sql, args)
+        rows = [(r["hash"], r["hour"], r["data"]) for r in await cur.fetchall()]
+        return history.series(rows, start, end)
+
+    @timed
+    async def get_changes(self, uid, since, kind="station"):
+        """(cursor, full, rows, removed) of the stations or vehicles of uid
+        that changed after the since cursor. Cursors older than the kept
+        removals, or 0, get every row back with full set"""
+        table = {"station": "stations", "vehicle": "vehicles"}[kind]
+        model = Station if kind == "station" else Vehicle
+
+        # the cursor is read first, so rows of a commit landing in between
+        # are sent again on the next poll rather than missed
+        cur = await self.db.execute(
+            "SELECT seq FROM network_seq WHERE tag = ?", (uid,)
+        )
+        row = await cur.fetchone()
+        cursor = row["seq"] if row else 0
+
+        # cursors from the future come from another db, ie: a restore
+        full = since <= 0 or since > cursor or since < cursor - self.TOMBSTONES
+        if full:
+            get = self.get_stations if kind == "station" else self.get_vehicles
+            return cursor, True, await get(uid), []
+
+        cur = await self.db.execute(
+            f"""
+            SELECT t.*
+            FROM changes c
+            JOIN {table} t ON t.hash = c.hash
+            WHERE c.network_tag = ?
+              AND c.kind = ?
+              AND c.seq > ?
+              AND c.removed = 0
+            ORDER BY t.hash
+        """,
+            (uid, kind, since),
+        )
+        rows = [model(**r) for r in await cur.fetchall()]
+
+        cur = await self.db.execute(
+            """
+            SELECT hash FROM changes
+            WHERE network_tag = ?
+              AND kind = ?
+              AND seq > ?
+              AND removed = 1
+            ORDER BY hash
+        """,
+            (uid, kind, since),
+        )
+        removed = [r["hash"] for r in await cur.fetchall()]
+
+        return cursor, False, rows, removed
+
+    @timed
     async def network_exists(self, uid):
         cur = await self.db.execute(
             """
@@ -76,6 +274,22 @@ class CBD:
 
         return bool(row)
 
+    @timed
+    async def get_version(self, uid):
+        """changes on every update of the network, unlike updated that has
+        a resolution of seconds"""
+        cur = await self.db.execute(
+            """
+            SELECT n.updated, q.seq FROM networks n
+            LEFT JOIN network_seq q ON q.tag = n.tag
+            WHERE n.tag = ?
+        """,
+            (uid,),
+        )
+        row = await cur.fetchone()
+        return row and (row["updated"], row["seq"])
+
+    @timed
     async def get_last_updated(self, uid=None):
         if uid:
             cur = await self.db.execute(
@@ -95,6 +309,7 @@ class CBD:
         last_updated = (await cur.fetchone())["timestamp"]
         return last_updated
 
+    @timed
     async def vehicle_types(self, uid):
         # match vehicle types according to station information heuristics
         # XXX ideally, we should set these on the network level in pybikes
@@ -169,6 +384,19 @@ class CBD:
 
         return [k for k, _ in vehicle_types]
 
+    @timed
+    async def get_stats(self, uid=None):
+        """network_stats rows of uid, or of every network by tag. Totals
+        of all networks are a scan of this small table"""
+        if uid:
+            cur = await self.db.execute(
+                "SELECT * FROM network_stats WHERE tag = ?", (uid,)
+            )
+        else:
+            cur = await self.db.execute("SELECT * FROM network_stats ORDER BY tag")
+        return [dict(r) for r in await cur.fetchall()]
+
+    @timed
     async def get_tags(self):
         cur = await self.db.execute("""
             SELECT tag FROM networks
@@ -176,3 +404,27 @@ class CBD:
         """)
         rows = await cur.fetchall()
         return list(map(lambda r: r["tag"], rows))
+
+    @timed
+    async def data_version(self):
+        # changes whenever another connection commits to the db
+        cur = await self.db.execute("PRAGMA data_version")
+        return (await cur.fetchone())["data_version"]
+
+    @timed
+    async def get_updated(self):
+        cur = await self.db.execute("SELECT tag, updated FROM networks")
+        rows = await cur.fetchall()
+        return {r["tag"]: r["updated"] for r in rows}
+
+    @timed
+    async def get_versions(self):
+        """get_version of every network, in a single query"""
+        cur = await self.db.execute(
+            """
+            SELECT n.tag, n.updated, q.seq FROM networks n
+            LEFT JOIN network_seq q ON q.tag = n.tag
+        """
+        )
+        rows = await cur.fetchall()
+        return {r["tag"]: (r["updated"], r["seq"]) for r in rows}
@@ -0,0 +1,58 @@
+import math
+
+# bands of latitude per degree, as in the grid indexes of migrations/0005
+GRID = 100
+# past this many bands a bounding box is scanned as a single range
+MAX_BANDS = 1000
+# meters per degree of latitude
+DEGREE = 111_195
+
+
+def valid(lat, lon):
+    return (
+        math.isfinite(lat)
+        and math.isfinite(lon)
+        and -90 <= lat <= 90
+        and -180 <= lon <= 180
+    )
+
+
+def bands(south, north):
+    """(first, last) grid bands spanned by a range of latitude"""
+    south, north = max(south, -90), min(north, 90)
+    return int((south + 90) * GRID), int((north + 90) * GRID)
+
+
+def inside(bbox, lat, lon):
+    """bbox is min_lon, min_lat, max_lon, max_lat, as in GeoJSON"""
+    west, south, east, north = bbox
+    return south <= lat <= north and west <= lon <= east
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """haversine, in meters"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * DEGREE * math.degrees(math.asin(math.sqrt(a)))
+
+
+def around(lat, lon, radius):
+    """bounding box of a circle of radius degrees of latitude"""
+    # XXX does not wrap around the antimeridian
+    dlon = min(180, radius / max(math.cos(math.radians(lat)), 0.01))
+    return (
+        max(lon - dlon, -180),
+        max(lat - radius, -90),
+        min(lon + dlon, 180),
+        min(lat + radius, 90),
+    )
+
+
+def searches(lat, lon, start=0.01, limit=10):
+    """growing (bbox, meters) searches around a point: every point of bbox
+    closer than meters is a hit, the rest may be beaten by points outside"""
+    radius = start
+    while radius <= limit:
+        yield around(lat, lon, radius), radius * DEGREE
+        radius *= 2
@@ -0,0 +1,331 @@
+import time
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from citybikes import metrics
+from citybikes.db.types import Extra
+
+log = logging.getLogger("db")
+
+SAMPLES = metrics.counter("history_samples_total", "Availability samples recorded")
+ROLLED = metrics.counter("history_rolled_up_total", "History rows downsampled")
+
+HOUR = 3600
+# values of a sample, after its time. Counts are clamped to 0, and a
+# missing count is -1 on disk and None once unpacked
+FIELDS = ["bikes", "free"] + Extra.Meta.vehicle_attrs
+
+Sample = namedtuple("Sample", ["time"] + FIELDS)
+
+# Samples are packed one after the other as varints: seconds since the
+# previous sample (since the hour of the row for the first one), a bitmask
+# of the fields that changed, and the zigzag encoded delta of each of those.
+# The first sample of a row is against all zeros, so rows decode on their
+# own. A sample where bikes changed takes about 4 bytes
+
+
+def varint(n, out):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def pack(samples, last=None):
+    """samples of an hour as bytes, (seconds into the hour, *values). With
+    last, the bytes go right after that sample"""
+    out = bytearray()
+    prev = last or (0,) * (len(FIELDS) + 1)
+    for sample in samples:
+        varint(sample[0] - prev[0], out)
+        mask, deltas = 0, []
+        for i, (a, b) in enumerate(zip(prev[1:], sample[1:])):
+            if a != b:
+                mask |= 1 << i
+                deltas.append(b - a)
+        varint(mask, out)
+        for d in deltas:
+            varint(zigzag(d), out)
+        prev = sample
+    return bytes(out)
+
+
+# field indexes (past time) set on each mask
+MASKS = [
+    [f + 1 for f in range(len(FIELDS)) if mask & (1 << f)]
+    for mask in range(1 << len(FIELDS))
+]
+
+
+def unpack(data):
+    # varints first, on a tight loop
+    ints = []
+    value = shift = 0
+    for b in data:
+        if b < 0x80:
+            ints.append(value | (b << shift))
+            value = shift = 0
+        else:
+            value |= (b & 0x7F) << shift
+            shift += 7
+
+    samples = []
+    prev = [0] * (len(FIELDS) + 1)
+    it = iter(ints)
+    for dt in it:
+        prev[0] += dt
+        for f in MASKS[next(it)]:
+            z = next(it)
+            prev[f] += (z >> 1) ^ -(z & 1)
+        samples.append(tuple(prev))
+    return samples
+
+
+def value(n):
+    return -1 if n is None else max(n, 0)
+
+
+def sample(s):
+    """values of a pybikes station, in FIELDS order"""
+    extra = s["extra"]
+    return (value(s["bikes"]), value(s["free"])) + tuple(
+        value(extra.get(k)) for k in Extra.Meta.vehicle_attrs
+    )
+
+
+def epoch(timestamp):
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def downsample(samples, step):
+    """the first sample and the last of every step seconds, dropping those
+    that did not change"""
+    buckets = {}
+    for s in samples:
+        buckets[s[0] // step] = s
+    kept = samples[:1] + [s for s in buckets.values() if s is not samples[0]]
+    return [s for i, s in enumerate(kept) if i == 0 or s[1:] != kept[i - 1][1:]]
+
+
+class History:
+    """Records the availability of stations as they are stored, only when
+    it changes. Keeps the last sample of every station in memory to know
+    what changed, picked up from the db on the first message of a network"""
+
+    def __init__(self):
+        # hash -> (hour, sample)
+        self.last = {}
+        self.seen = set()
+
+    def prime(self, cursor, tag):
+        # the latest row of each station, a seek each
+        cur = cursor.connection.cursor()
+        cur.row_factory = None
+        rows = cur.execute(
+            """
+            SELECT h.hash, h.hour, h.data
+            FROM networks n
+            JOIN json_each(n.stations) j
+            JOIN history h ON h.network_tag = n.tag AND h.hash = j.value
+            WHERE n.tag = ?
+              AND h.hour = (
+                SELECT max(hour) FROM history
+                WHERE network_tag = n.tag AND hash = j.value
+              )
+        """,
+            (tag,),
+        )
+        for hash_, hour, data in rows.fetchall():
+            if samples := unpack(data):
+                self.last[hash_] = (hour, samples[-1])
+        self.seen.add(tag)
+
+    def forget(self, network):
+        """drop what is known of network, to be primed again from the db.
+        When the transaction record ran on is rolled back"""
+        self.seen.discard(network["tag"])
+        for s in network["stations"]:
+            self.last.pop(s["id"], None)
+
+    def record(self, cursor, network):
+        """write the samples of a network that changed, without committing.
+        Goes after write_network, on the same transaction"""
+        tag = network["tag"]
+        if tag not in self.seen:
+            self.prime(cursor, tag)
+
+        inserts, appends = [], []
+        epochs = {}
+        for s in network["stations"]:
+            ts = s["timestamp"]
+            if ts not in epochs:
+                epochs[ts] = epoch(ts)
+            hour, offset = divmod(epochs[ts], HOUR)
+            current = (offset,) + sample(s)
+
+            last = self.last.get(s["id"])
+            if last is None or last[0] < hour:
+                inserts.append((tag, s["id"], hour, pack([current])))
+            elif last[0] == hour and offset >= last[1][0]:
+                if current[1:] == last[1][1:]:
+                    continue
+                appends.append((pack([current], last[1]), tag, s["id"], hour))
+            else:
+                # out of order, older than what is recorded
+                continue
+            self.last[s["id"]] = (hour, current)
+
+        cursor.executemany(
+            """
+            INSERT INTO history (network_tag, hash, hour, data)
+            VALUES (?, ?, ?, ?)
+            -- only if the db got ahead of last, start the hour over
+            ON CONFLICT DO UPDATE SET data = excluded.data, step = 0
+        """,
+            inserts,
+        )
+        cursor.executemany(
+            """
+            UPDATE history SET data = CAST(data || ? AS BLOB)
+            WHERE network_tag = ? AND hash = ? AND hour = ?
+        """,
+            appends,
+        )
+        SAMPLES.inc(len(inserts) + len(appends))
+
+
+def query(uid, station_id=None, start=None, end=None):
+    """sql and args of the history rows of a network, or of one of its
+    stations, between start and end (epoch seconds)"""
+    # from the day before, for rolled up rows and the sample in effect at
+    # start
+    first = start // HOUR - 24 if start is not None else 0
+    last = end // HOUR if end is not None else 2**62
+    if station_id is not None:
+        return (
+            """
+            SELECT hash, hour, data FROM history
+            WHERE network_tag = ? AND hash = ? AND hour BETWEEN ? AND ?
+            ORDER BY hour
+        """,
+            (uid, station_id, first, last),
+        )
+    # a seek per current station of the network
+    return (
+        """
+        SELECT h.hash, h.hour, h.data FROM history h
+        WHERE h.network_tag = ?
+          AND h.hash IN (
+            SELECT value FROM networks
+              JOIN json_each(networks.stations) ON networks.tag = ?
+          )
+          AND h.hour BETWEEN ? AND ?
+        ORDER BY h.hash, h.hour
+    """,
+        (uid, uid, first, last),
+    )
+
+
+def series(rows, start=None, end=None):
+    """{hash: [Sample]} out of history rows in hour order. The first sample
+    of each station is the one in effect at start, if recorded"""
+    out = {}
+    for hash_, hour, data in rows:
+        samples = out.setdefault(hash_, [])
+        base = hour * HOUR
+        for s in unpack(data):
+            t = base + s[0]
+            if end is not None and t > end:
+                break
+            if start is not None and t <= start and samples:
+                # only the last sample before start is kept
+                samples.pop()
+            if -1 in s:
+                s = [None if v == -1 else v for v in s]
+            samples.append(Sample(t, *s[1:]))
+    return out
+
+
+def get(con, uid, station_id=None, start=None, end=None):
+    """{hash: [Sample]} of a network, or one of its stations"""
+    cur = con.cursor()
+    cur.row_factory = None
+    return series(cur.execute(*query(uid, station_id, start, end)), start, end)
+
+
+def rollup(con, after_days, step, keep_days=0, batch=1000):
+    """merge the rows of every station and day older than after_days into
+    a row a day, downsampled to a sample every step seconds, and delete
+    those older than keep_days (0 keeps them). Returns the rows rolled up
+    and deleted. con must be in autocommit mode"""
+    now = int(time.time()) // HOUR
+    # whole days only, the recorder never writes to hours this old
+    cutoff = int(now - after_days * 24) // 24 * 24
+    batch = max(batch, 48)
+    rolled, deleted, key = 0, 0, ("", "", 0)
+    while True:
+        # short transactions, the subscriber writes in between
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            rows = con.execute(
+                """
+                SELECT network_tag, hash, hour, data FROM history
+                WHERE (network_tag, hash, hour) > (?, ?, ?)
+                  AND hour < ? AND step < ?
+                LIMIT ?
+            """,
+                (*key, cutoff, step, batch),
+            ).fetchall()
+            days = {}
+            for tag, hash_, hour, data in rows:
+                days.setdefault((tag, hash_, hour // 24), []).append((hour, data))
+            if len(rows) == batch:
+                # the last day may go on in the next batch
+                days.popitem()
+
+            merged = []
+            for (tag, hash_, day), hours in days.items():
+                samples = []
+                for hour, data in hours:
+                    offset = (hour - day * 24) * HOUR
+                    samples += [(s[0] + offset,) + s[1:] for s in unpack(data)]
+                packed = pack(downsample(samples, step))
+                merged.append((tag, hash_, day * 24, step, packed))
+                key = (tag, hash_, hours[-1][0])
+
+            con.executemany(
+                """
+                DELETE FROM history
+                WHERE network_tag = ? AND hash = ? AND hour BETWEEN ? AND ?
+            """,
+                [(tag, hash_, hour, hour + 23) for tag, hash_, hour, _, _ in merged],
+            )
+            con.executemany(
+                """
+                INSERT INTO history (network_tag, hash, hour, step, data)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                merged,
+            )
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        rolled += sum(len(hours) for hours in days.values())
+        if len(rows) < batch:
+            break
+    ROLLED.inc(rolled)
+
+    if keep_days:
+        deleted = con.execute(
+            "DELETE FROM history WHERE hour < ?", (now - keep_days * 24,)
+        ).rowcount
+    return rolled, deleted
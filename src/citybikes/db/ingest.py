@@ -0,0 +1,249 @@
+import json
+import time
+import logging
+from datetime import datetime, timezone
+
+from citybikes import metrics
+from citybikes.db.types import Extra, vehicle_counts
+
+log = logging.getLogger("db")
+
+MESSAGES = metrics.counter("ingest_messages_total", "Networks processed")
+ROWS = metrics.counter("ingest_rows_total", "Rows written", ["table"])
+GC = metrics.counter("ingest_gc_total", "Orphaned rows deleted", ["table"])
+COMMIT_TIME = metrics.histogram(
+    "ingest_duration_seconds", "Time to store a network, up to commit"
+)
+LAG = metrics.histogram(
+    "ingest_lag_seconds",
+    "Time from the newest pybikes timestamp of a network to its commit",
+    buckets=metrics.LAG_BUCKETS,
+)
+
+
+def lag(network):
+    timestamps = [e["timestamp"] for e in network["stations"] + network["vehicles"]]
+    if not timestamps:
+        return None
+    newest = max(map(datetime.fromisoformat, timestamps))
+    if newest.tzinfo is None:
+        newest = newest.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - newest).total_seconds()
+
+
+# columns of network_stats, see migrations/0007
+STATS = ["stations", "online", "bikes", "docks", *Extra.Meta.vehicle_attrs, "vehicles"]
+
+
+def aggregate(network):
+    """network_stats row of a network message. Bikes and docks are counted
+    as station_status feeds count them, negatives as 0 and stations without
+    type counts as normal bikes. Stations are online unless their extra
+    says otherwise"""
+    row = dict.fromkeys(STATS)
+    row.update(stations=0, online=0, bikes=0, docks=0)
+    # the last one of repeated ids is the one stored
+    for s in {s["id"]: s for s in network["stations"]}.values():
+        extra, bikes = s["extra"], s["bikes"]
+        row["stations"] += 1
+        row["online"] += extra.get("online") is not False
+        row["bikes"] += max(bikes or 0, 0)
+        row["docks"] += max(s["free"] or 0, 0)
+        counts = vehicle_counts(
+            bikes, [(k, extra.get(k)) for k in Extra.Meta.vehicle_attrs]
+        )
+        for k, n in counts or [("normal_bikes", bikes or 0)]:
+            row[k] = (row[k] or 0) + max(n, 0)
+    row["vehicles"] = len(network["vehicles"])
+    return row
+
+
+def store_network(con, network, history=None):
+    # All changes to a network land on a single commit, so readers watching
+    # networks.updated never see the network row ahead of its stations
+    start = time.perf_counter()
+
+    cursor = con.cursor()
+    try:
+        write_network(cursor, network)
+        if history:
+            history.record(cursor, network)
+        con.commit()
+    except BaseException:
+        # not left open for the next message to commit, and history holds
+        # samples that never made it to the db
+        con.rollback()
+        if history:
+            history.forget(network)
+        raise
+
+    COMMIT_TIME.observe(time.perf_counter() - start)
+    MESSAGES.inc()
+    ROWS.inc(len(network["stations"]), table="stations")
+    ROWS.inc(len(network["vehicles"]), table="vehicles")
+    if (seconds := lag(network)) is not None:
+        LAG.observe(seconds)
+
+
+def write_network(cursor, network):
+    """upsert a network with its stations and vehicles, and delete those it
+    no longer has, without committing"""
+    meta = network["meta"]
+
+    station_ids = [s["id"] for s in network.get("stations", [])]
+    vehicle_ids = [v["id"] for v in network.get("vehicles", [])]
+
+    # XXX check JSONB types
+    log.info("Processing %s", meta)
+
+    cursor.execute(
+        """
+        INSERT INTO networks (tag, name, latitude, longitude, meta, stations, vehicles)
+        VALUES (?, ?, ?, ?, json(?), json(?), json(?))
+        ON CONFLICT(tag) DO UPDATE SET
+            name=excluded.name,
+            latitude=excluded.latitude,
+            longitude=excluded.longitude,
+            meta=json(excluded.meta),
+            stations=json(excluded.stations),
+            vehicles=json(excluded.vehicles)
+        WHERE
+            -- ignore info if no stations (prob an error)
+            excluded.stations != '[]' OR excluded.vehicles != '[]'
+    """,
+        (
+            network["tag"],
+            meta["name"],
+            meta["latitude"],
+            meta["longitude"],
+            json.dumps(meta),
+            json.dumps(station_ids),
+            json.dumps(vehicle_ids),
+        ),
+    )
+
+    log.info("[%s] Got %d stations" % (network["tag"], len(network["stations"])))
+
+    data_iter = (
+        (
+            s["id"],
+            s["name"],
+            s["latitude"],
+            s["longitude"],
+            json.dumps(
+                {
+                    "bikes": s["bikes"],
+                    "free": s["free"],
+                    "timestamp": s["timestamp"],
+                    "extra": s["extra"],
+                }
+            ),
+            network["tag"],
+        )
+        for s in network["stations"]
+    )
+
+    cursor.executemany(
+        """
+        INSERT INTO stations (hash, name, latitude, longitude, stat, network_tag)
+        VALUES (?, ?, ?, ?, json(?), ?)
+        ON CONFLICT(hash) DO UPDATE SET
+            -- some networks may stop providing a name randomly
+            name=coalesce(excluded.name, name),
+            --
+            latitude=excluded.latitude,
+            longitude=excluded.longitude,
+            stat=json(excluded.stat),
+            network_tag=excluded.network_tag
+    """,
+        data_iter,
+    )
+    log.info(
+        "[%s] Finished processing %d stations"
+        % (network["tag"], len(network["stations"]))
+    )
+
+    log.info("[%s] Got %d vehicles" % (network["tag"], len(network["vehicles"])))
+
+    data_iter = (
+        (
+            v["id"],
+            v["latitude"],
+            v["longitude"],
+            v["kind"],
+            json.dumps(
+                {
+                    "timestamp": v["timestamp"],
+                    "extra": v["extra"],
+                }
+            ),
+            network["tag"],
+        )
+        for v in network["vehicles"]
+    )
+
+    cursor.executemany(
+        """
+        INSERT INTO vehicles (hash, latitude, longitude, kind, stat, network_tag)
+        VALUES (?, ?, ?, ?, json(?), ?)
+        ON CONFLICT(hash) DO UPDATE SET
+            latitude=excluded.latitude,
+            longitude=excluded.longitude,
+            kind=excluded.kind,
+            stat=json(excluded.stat),
+            network_tag=excluded.network_tag
+    """,
+        data_iter,
+    )
+    log.info(
+        "[%s] Finished processing %d vehicles"
+        % (network["tag"], len(network["vehicles"]))
+    )
+
+    # Now its probably a good time to clean up orphaned vehicles and
+    # stations ...
+    # XXX: this could be an update trigger on networks
+    cursor.execute(
+        """
+        DELETE FROM stations
+        WHERE network_tag = ?
+          AND hash NOT IN (
+            SELECT value FROM networks, json_each(networks.stations)
+            WHERE networks.tag = ?
+        );
+     """,(network['tag'], network['tag'], ))
+
+    log.info(
+        "[%s] GC %d stations"
+        % (network["tag"], cursor.rowcount)
+    )
+    GC.inc(cursor.rowcount, table="stations")
+
+    cursor.execute(
+        """
+        DELETE FROM vehicles
+        WHERE network_tag = ?
+          AND hash NOT IN (
+            SELECT value FROM networks, json_each(networks.vehicles)
+            WHERE networks.tag = ?
+        );
+     """,(network['tag'], network['tag'], ))
+
+    log.info(
+        "[%s] GC %d vehicles"
+        % (network["tag"], cursor.rowcount)
+    )
+    GC.inc(cursor.rowcount, table="vehicles")
+
+    cursor.execute(
+        f"""
+        INSERT INTO network_stats (tag, {", ".join(STATS)})
+        VALUES (?{", ?" * len(STATS)})
+        ON CONFLICT(tag) DO UPDATE SET
+            {", ".join(f"{k}=excluded.{k}" for k in STATS)}
+        WHERE
+            -- same as networks, ignore if no stations
+            excluded.stations > 0 OR excluded.vehicles > 0
+    """,
+        (network["tag"], *aggregate(network).values()),
+    )
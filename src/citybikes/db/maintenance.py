@@ -0,0 +1,177 @@
+import sqlite3
+import logging
+import threading
+
+from citybikes import metrics
+from citybikes.db import history
+
+log = logging.getLogger("db")
+
+DB_SIZE = metrics.gauge("db_size_bytes", "Size of the database file")
+DB_FREE = metrics.gauge("db_free_bytes", "Size of the free pages of the database")
+EXPIRED = metrics.counter(
+    "maintenance_expired_networks_total", "Networks deleted for not updating"
+)
+MAINTENANCE_TIME = metrics.histogram(
+    "maintenance_duration_seconds", "Time spent on maintenance tasks", ["task"]
+)
+
+INCREMENTAL = 2
+
+
+def stats(con):
+    """size of the db, and how much of it is free pages"""
+    page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    pages = con.execute("PRAGMA page_count").fetchone()[0]
+    free = con.execute("PRAGMA freelist_count").fetchone()[0]
+    DB_SIZE.set(pages * page_size)
+    DB_FREE.set(free * page_size)
+    return {
+        "size": pages * page_size,
+        "free": free * page_size,
+        "fragmentation": round(free / pages, 4) if pages else 0,
+    }
+
+
+def expire(con, hours):
+    """delete networks not updated in hours, along with their stations,
+    vehicles, changes and history"""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        tags = [
+            r[0]
+            for r in con.execute(
+                "SELECT tag FROM networks WHERE updated < datetime('now', ?)",
+                (f"-{hours} hours",),
+            )
+        ]
+        for table, column in [
+            ("stations", "network_tag"),
+            ("vehicles", "network_tag"),
+            # after stations and vehicles, as deleting these records removals
+            ("changes", "network_tag"),
+            ("network_seq", "tag"),
+            ("network_stats", "tag"),
+            ("history", "network_tag"),
+            ("networks", "tag"),
+        ]:
+            con.executemany(
+                f"DELETE FROM {table} WHERE {column} = ?", [(t,) for t in tags]
+            )
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+
+    for tag in tags:
+        log.info("Expired %s", tag)
+    EXPIRED.inc(len(tags))
+    return tags
+
+
+def convert(con):
+    """switch a db to incremental auto_vacuum. auto_vacuum only changes on
+    empty databases or with a VACUUM, that migrations can not run as they
+    are transactions. Once per db, as a VACUUM rewrites the whole db holding
+    the write lock, not meant to run next to the subscriber"""
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL:
+        return False
+    log.warning("Converting db to incremental auto_vacuum with a VACUUM")
+    con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    con.execute("VACUUM")
+    return True
+
+
+def vacuum(con, pages=0):
+    """give free pages back to the filesystem, up to pages (0 is all)"""
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL:
+        log.warning(
+            "Skipping vacuum, auto_vacuum is not incremental. "
+            "Convert the db once with citybikes.cmd.maintain --convert"
+        )
+        return
+    # XXX execute stops at the first page freed, as the pragma has no
+    # columns. executescript steps it through
+    con.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+
+
+def optimize(con):
+    # XXX a full ANALYZE. With analysis_limit the row counts of WITHOUT
+    # ROWID tables come out far too low, and the planner scans stations
+    # instead of using idx_stations_grid
+    con.execute("ANALYZE")
+    con.execute("PRAGMA optimize")
+
+
+def maintain(con, expire_after=0, pages=0, rollup=None, analyze=False):
+    """run every maintenance task, returns a report of what it did. rollup
+    are the (after_days, step, keep_days) of history.rollup. con must be in
+    autocommit mode (isolation_level None).
+
+    analyze runs optimize, a full ANALYZE that holds the write lock for a
+    scan of every table, not meant to run next to the subscriber"""
+    report = {"before": stats(con), "expired": []}
+
+    if expire_after:
+        with MAINTENANCE_TIME.time(task="expire"):
+            report["expired"] = expire(con, expire_after)
+    if rollup:
+        with MAINTENANCE_TIME.time(task="rollup"):
+            report["rolled_up"], report["history_deleted"] = history.rollup(
+                con, *rollup
+            )
+    with MAINTENANCE_TIME.time(task="vacuum"):
+        vacuum(con, pages)
+    if analyze:
+        with MAINTENANCE_TIME.time(task="optimize"):
+            optimize(con)
+
+    report["after"] = stats(con)
+    before, after = report["before"], report["after"]
+    log.info(
+        "Maintenance: %d networks expired, %.1f -> %.1f MiB, "
+        "fragmentation %.1f%% -> %.1f%%",
+        len(report["expired"]),
+        before["size"] / 2**20,
+        after["size"] / 2**20,
+        before["fragmentation"] * 100,
+        after["fragmentation"] * 100,
+    )
+    return report
+
+
+def connect(path, timeout=5.0):
+    # the busy timeout is how long tasks wait on the writer
+    con = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+    con.isolation_level = None
+    return con
+
+
+class Maintainer(threading.Thread):
+    """Runs maintenance on a database every interval seconds, next to the
+    subscriber writing to it. See maintain. Without ANALYZE, the planner
+    keeps the stats of the last citybikes.cmd.maintain run, if any"""
+
+    def __init__(self, path, interval=3600, expire_after=0, pages=0, rollup=None):
+        super().__init__(daemon=True, name="maintainer")
+        self.path = path
+        self.interval = interval
+        self.expire_after = expire_after
+        self.pages = pages
+        self.rollup = rollup
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            con = connect(self.path)
+            try:
+                maintain(con, self.expire_after, self.pages, self.rollup)
+            except sqlite3.Error as e:
+                log.error("Maintenance failed: %s", e)
+            finally:
+                con.close()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,343 @@
+import json
+import queue
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+
+from citybikes.db import geo
+from citybikes.db.cbd import CBD
+from citybikes.db.ingest import aggregate, store_network
+from citybikes.db.types import Station, Network, Vehicle, Extra
+
+log = logging.getLogger("db")
+
+
+def now():
+    # same format as sqlite CURRENT_TIMESTAMP
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def vehicle_types(stations, vehicles):
+    """Python port of the CBD.vehicle_types heuristics, so these can be
+    precomputed once per snapshot instead of on every request"""
+
+    # same order as the query results
+    keys = ["normal_bikes", "ebikes", "cargo", "ecargo", "kid_bikes", "scooter"]
+    flags = dict.fromkeys(keys, False)
+
+    for station in stations:
+        extra, bikes = station.extra, station.bikes
+        counts = [getattr(extra, k) for k in Extra.Meta.vehicle_attrs]
+        for k in Extra.Meta.vehicle_attrs:
+            flags[k] |= getattr(extra, k) is not None
+
+        # handle missing normal_bikes in extra
+        if extra.normal_bikes is None and bikes is not None:
+            if extra.ebikes is not None and bikes > sum(c or 0 for c in counts):
+                flags["normal_bikes"] = True
+
+    for vehicle in vehicles:
+        flags["normal_bikes"] |= vehicle.kind == "bike"
+        flags["ebikes"] |= vehicle.kind == "ebike"
+        flags["scooter"] |= vehicle.kind == "scooter"
+
+    return [k for k, v in flags.items() if v]
+
+
+def availability(entity):
+    # timestamps change on every scrape, only availability and position count
+    stat = entity.stat.model_dump(exclude={"timestamp"})
+    return entity.latitude, entity.longitude, getattr(entity, "kind", None), stat
+
+
+def message(stations, vehicles):
+    """enough of a network message out of stations and vehicles to
+    aggregate it"""
+    return {
+        "stations": [
+            {
+                "id": s.uid,
+                "bikes": s.bikes,
+                "free": s.free,
+                "extra": {
+                    k: getattr(s.extra, k)
+                    for k in ["online", *Extra.Meta.vehicle_attrs]
+                },
+            }
+            for s in stations
+        ],
+        "vehicles": vehicles,
+    }
+
+
+class Snapshot:
+    def __init__(self, network, stations, vehicles, updated, version=0, seq=1):
+        self.network = network
+        self.updated = updated
+        self.version = version
+        self.seq = seq
+        self.stations = sorted(stations, key=lambda s: s.uid)
+        self.vehicles = sorted(vehicles, key=lambda v: v.uid)
+        self.station_index = {s.uid: s for s in self.stations}
+        self.vehicle_index = {v.uid: v for v in self.vehicles}
+        self.vehicle_types = vehicle_types(self.stations, self.vehicles)
+        self.stats = aggregate(message(self.stations, self.vehicles))
+        # seq at which every entity last changed or was removed, by kind
+        self.changes = {"station": {}, "vehicle": {}}
+        self.removed = {"station": {}, "vehicle": {}}
+
+    def index(self, kind):
+        return self.station_index if kind == "station" else self.vehicle_index
+
+    def track(self, last):
+        """carry change sequences over from the previous snapshot"""
+        for kind in self.changes:
+            index, last_index = self.index(kind), last.index(kind)
+            changes, last_changes = self.changes[kind], last.changes[kind]
+            for uid, entity in index.items():
+                old = last_index.get(uid)
+                if old is not None and availability(old) == availability(entity):
+                    changes[uid] = last_changes.get(uid, 0)
+                else:
+                    changes[uid] = self.seq
+
+            removed = self.removed[kind]
+            for uid, seq in last.removed[kind].items():
+                if uid not in index and seq > self.seq - CBD.TOMBSTONES:
+                    removed[uid] = seq
+            for uid in last_index.keys() - index.keys():
+                removed[uid] = self.seq
+
+
+class MemoryCBD:
+    """CBD compatible accessors over in-memory network snapshots.
+
+    Snapshots are replaced as a whole on update, so readers never see a
+    half-processed network.
+    """
+
+    def __init__(self):
+        self.snapshots = {}
+        self.version = 0
+
+    def update(self, network):
+        self.swap(self.build(network))
+
+    async def aupdate(self, network):
+        """update, building the snapshot off the event loop so reads are
+        not held by large networks. Messages are expected one at a time"""
+        self.swap(await asyncio.to_thread(self.build, network))
+
+    def build(self, network):
+        """the next snapshot of network, None when it is ignored"""
+        tag = network["tag"]
+        meta = network["meta"]
+        stations = network.get("stations", [])
+        vehicles = network.get("vehicles", [])
+        last = self.snapshots.get(tag)
+
+        # ignore info if no stations (prob an error)
+        if last and not stations and not vehicles:
+            return None
+
+        def name(s):
+            # some networks may stop providing a name randomly
+            if s["name"] is None and last and s["id"] in last.station_index:
+                return last.station_index[s["id"]].name
+            return s["name"]
+
+        snapshot = Snapshot(
+            network=Network(
+                tag=tag,
+                name=meta["name"],
+                latitude=meta["latitude"],
+                longitude=meta["longitude"],
+                meta=json.dumps(meta),
+            ),
+            stations=[
+                Station(
+                    hash=s["id"],
+                    name=name(s),
+                    latitude=s["latitude"],
+                    longitude=s["longitude"],
+                    stat=json.dumps(
+                        {
+                            "bikes": s["bikes"],
+                            "free": s["free"],
+                            "timestamp": s["timestamp"],
+                            "extra": s["extra"],
+                        }
+                    ),
+                )
+                for s in stations
+            ],
+            vehicles=[
+                Vehicle(
+                    hash=v["id"],
+                    latitude=v["latitude"],
+                    longitude=v["longitude"],
+                    kind=v["kind"],
+                    stat=json.dumps(
+                        {
+                            "timestamp": v["timestamp"],
+                            "extra": v["extra"],
+                        }
+                    ),
+                )
+                for v in vehicles
+            ],
+            updated=now(),
+            seq=last.seq + 1 if last else 1,
+        )
+        if last:
+            snapshot.track(last)
+        return snapshot
+
+    def swap(self, snapshot):
+        if snapshot is None:
+            return
+        self.version += 1
+        snapshot.version = self.version
+        self.snapshots[snapshot.network.uid] = snapshot
+
+    def load(self, con):
+        """prime snapshots from an existing sqlite database"""
+        networks = con.execute("SELECT * FROM networks").fetchall()
+        for row in networks:
+            stations = con.execute(
+                """
+                SELECT s.* FROM stations s
+                WHERE network_tag = ?
+                  AND hash IN (SELECT value FROM json_each(?))
+            """,
+                (row["tag"], row["stations"]),
+            ).fetchall()
+            vehicles = con.execute(
+                """
+                SELECT v.* FROM vehicles v
+                WHERE network_tag = ?
+                  AND hash IN (SELECT value FROM json_each(?))
+            """,
+                (row["tag"], row["vehicles"]),
+            ).fetchall()
+            self.snapshots[row["tag"]] = Snapshot(
+                network=Network(**row),
+                stations=[Station(**s) for s in stations],
+                vehicles=[Vehicle(**v) for v in vehicles],
+                updated=row["updated"],
+            )
+
+    async def get_network(self, uid):
+        snapshot = self.snapshots.get(uid)
+        return snapshot.network if snapshot else None
+
+    async def get_stations(self, uid, bbox=None):
+        stations = self.snapshots[uid].stations
+        if bbox:
+            return [s for s in stations if geo.inside(bbox, s.latitude, s.longitude)]
+        return list(stations)
+
+    async def get_stations_by_id(self, uid, ids):
+        index = self.snapshots[uid].station_index
+        return [index[i] for i in sorted(set(ids)) if i in index]
+
+    async def get_vehicles(self, uid, bbox=None):
+        vehicles = self.snapshots[uid].vehicles
+        if bbox:
+            return [v for v in vehicles if geo.inside(bbox, v.latitude, v.longitude)]
+        return list(vehicles)
+
+    async def nearby(self, lat, lon, k=10, available=False):
+        # XXX scans every station, fine for the sizes kept in memory
+        hits = [
+            (tag, s, geo.distance(lat, lon, s.latitude, s.longitude))
+            for tag, snapshot in self.snapshots.items()
+            for s in snapshot.stations
+            if not available or (s.bikes or 0) > 0
+        ]
+        return sorted(hits, key=lambda h: h[2])[:k]
+
+    async def iter_stations(self, since=None):
+        for tag in sorted(self.snapshots):
+            snapshot = self.snapshots.get(tag)
+            if snapshot and snapshot.stations and snapshot.updated > (since or ""):
+                yield tag, snapshot.updated, list(snapshot.stations)
+
+    async def get_changes(self, uid, since, kind="station"):
+        snapshot = self.snapshots[uid]
+        rows = snapshot.stations if kind == "station" else snapshot.vehicles
+        cursor = snapshot.seq
+
+        if since <= 0 or since > cursor or since < cursor - CBD.TOMBSTONES:
+            return cursor, True, list(rows), []
+
+        changes = snapshot.changes[kind]
+        rows = [r for r in rows if changes.get(r.uid, 0) > since]
+        removed = sorted(u for u, seq in snapshot.removed[kind].items() if seq > since)
+        return cursor, False, rows, removed
+
+    async def network_exists(self, uid):
+        return uid in self.snapshots
+
+    async def get_version(self, uid):
+        snapshot = self.snapshots.get(uid)
+        return snapshot and snapshot.version
+
+    async def get_last_updated(self, uid=None):
+        if uid:
+            return self.snapshots[uid].updated
+        return max((s.updated for s in self.snapshots.values()), default=None)
+
+    async def vehicle_types(self, uid):
+        return list(self.snapshots[uid].vehicle_types)
+
+    async def get_tags(self):
+        return sorted(self.snapshots)
+
+    async def get_stats(self, uid=None):
+        tags = [uid] if uid else sorted(self.snapshots)
+        return [
+            {"tag": tag, **self.snapshots[tag].stats}
+            for tag in tags
+            if tag in self.snapshots
+        ]
+
+    async def data_version(self):
+        return self.version
+
+    async def get_updated(self):
+        return {tag: s.updated for tag, s in self.snapshots.items()}
+
+    async def get_versions(self):
+        return {tag: s.version for tag, s in self.snapshots.items()}
+
+    async def get_history(self, uid, station_id=None, start=None, end=None):
+        # history is only recorded on sqlite, see citybikes.cmd.subscriber
+        return {}
+
+
+class WriteBehind(threading.Thread):
+    """Persists networks to sqlite off the event loop. In memory mode the
+    database is only a durable copy, so it is fine to lag behind"""
+
+    def __init__(self, con):
+        super().__init__(name="write-behind", daemon=True)
+        self.con = con
+        self.queue = queue.Queue()
+
+    def put(self, network):
+        self.queue.put(network)
+
+    def run(self):
+        while (network := self.queue.get()) is not None:
+            try:
+                store_network(self.con, network)
+            except Exception:
+                log.exception("[%s] Write behind failed", network["tag"])
+                self.con.rollback()
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        self.con.close()
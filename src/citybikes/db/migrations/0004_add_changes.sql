@@ -0,0 +1,136 @@
+PRAGMA user_version=4;
+
+-- per network change sequence, bumped on every update of the network
+CREATE TABLE IF NOT EXISTS network_seq (
+    tag TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO network_seq (tag, seq) SELECT tag, 1 FROM networks;
+
+-- sequence at which each station or vehicle last changed, or was removed
+CREATE TABLE IF NOT EXISTS changes (
+    kind TEXT,
+    hash TEXT,
+    network_tag TEXT,
+    seq INTEGER NOT NULL,
+    removed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, hash)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_changes_seq ON changes(network_tag, kind, seq);
+
+CREATE TRIGGER IF NOT EXISTS insert_network_seq AFTER INSERT ON networks
+BEGIN
+    INSERT INTO network_seq (tag, seq) VALUES (NEW.tag, 1)
+    ON CONFLICT(tag) DO UPDATE SET seq = seq + 1;
+END;
+
+-- removals are kept for 1440 updates (see CBD.TOMBSTONES), a day of
+-- minutely updates. Older cursors get a full feed. Only on updates of the
+-- entity lists, not those of update_network on `updated`
+CREATE TRIGGER IF NOT EXISTS update_network_seq
+AFTER UPDATE OF stations, vehicles ON networks
+BEGIN
+    INSERT INTO network_seq (tag, seq) VALUES (NEW.tag, 1)
+    ON CONFLICT(tag) DO UPDATE SET seq = seq + 1;
+
+    DELETE FROM changes
+    WHERE network_tag = NEW.tag
+      AND removed = 1
+      AND seq <= (SELECT seq FROM network_seq WHERE tag = NEW.tag) - 1440;
+END;
+
+-- timestamps change on every scrape, only availability and position count
+CREATE TRIGGER IF NOT EXISTS insert_station_change AFTER INSERT ON stations
+BEGIN
+    INSERT INTO changes (kind, hash, network_tag, seq, removed)
+    VALUES (
+        'station', NEW.hash, NEW.network_tag,
+        coalesce((SELECT seq FROM network_seq WHERE tag = NEW.network_tag), 0),
+        0
+    )
+    ON CONFLICT(kind, hash) DO UPDATE SET
+        network_tag = excluded.network_tag,
+        seq = excluded.seq,
+        removed = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_station_change AFTER UPDATE ON stations
+WHEN json_remove(OLD.stat, '$.timestamp') IS NOT json_remove(NEW.stat, '$.timestamp')
+  OR OLD.latitude IS NOT NEW.latitude
+  OR OLD.longitude IS NOT NEW.longitude
+  OR OLD.network_tag IS NOT NEW.network_tag
+BEGIN
+    INSERT INTO changes (kind, hash, network_tag, seq, removed)
+    VALUES (
+        'station', NEW.hash, NEW.network_tag,
+        coalesce((SELECT seq FROM network_seq WHERE tag = NEW.network_tag), 0),
+        0
+    )
+    ON CONFLICT(kind, hash) DO UPDATE SET
+        network_tag = excluded.network_tag,
+        seq = excluded.seq,
+        removed = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS delete_station_change AFTER DELETE ON stations
+BEGIN
+    INSERT INTO changes (kind, hash, network_tag, seq, removed)
+    VALUES (
+        'station', OLD.hash, OLD.network_tag,
+        coalesce((SELECT seq FROM network_seq WHERE tag = OLD.network_tag), 0),
+        1
+    )
+    ON CONFLICT(kind, hash) DO UPDATE SET
+        network_tag = excluded.network_tag,
+        seq = excluded.seq,
+        removed = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS insert_vehicle_change AFTER INSERT ON vehicles
+BEGIN
+    INSERT INTO changes (kind, hash, network_tag, seq, removed)
+    VALUES (
+        'vehicle', NEW.hash, NEW.network_tag,
+        coalesce((SELECT seq FROM network_seq WHERE tag = NEW.network_tag), 0),
+        0
+    )
+    ON CONFLICT(kind, hash) DO UPDATE SET
+        network_tag = excluded.network_tag,
+        seq = excluded.seq,
+        removed = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_vehicle_change AFTER UPDATE ON vehicles
+WHEN json_remove(OLD.stat, '$.timestamp') IS NOT json_remove(NEW.stat, '$.timestamp')
+  OR OLD.latitude IS NOT NEW.latitude
+  OR OLD.longitude IS NOT NEW.longitude
+  OR OLD.kind IS NOT NEW.kind
+  OR OLD.network_tag IS NOT NEW.network_tag
+BEGIN
+    INSERT INTO changes (kind, hash, network_tag, seq, removed)
+    VALUES (
+        'vehicle', NEW.hash, NEW.network_tag,
+        coalesce((SELECT seq FROM network_seq WHERE tag = NEW.network_tag), 0),
+        0
+    )
+    ON CONFLICT(kind, hash) DO UPDATE SET
+        network_tag = excluded.network_tag,
+        seq = excluded.seq,
+        removed = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS delete_vehicle_change AFTER DELETE ON vehicles
+BEGIN
+    INSERT INTO changes (kind, hash, network_tag, seq, removed)
+    VALUES (
+        'vehicle', OLD.hash, OLD.network_tag,
+        coalesce((SELECT seq FROM network_seq WHERE tag = OLD.network_tag), 0),
+        1
+    )
+    ON CONFLICT(kind, hash) DO UPDATE SET
+        network_tag = excluded.network_tag,
+        seq = excluded.seq,
+        removed = 1;
+END;
@@ -0,0 +1,10 @@
+PRAGMA user_version=5;
+
+-- spatial lookups: rows are indexed by a band of latitude, 0.01 degrees
+-- (~1.1km) wide, then by longitude. A bounding box is a range of longitude
+-- on each band it spans, see CBD.within
+CREATE INDEX IF NOT EXISTS idx_stations_grid
+    ON stations(CAST((latitude + 90) * 100 AS INTEGER), longitude);
+
+CREATE INDEX IF NOT EXISTS idx_vehicles_grid
+    ON vehicles(CAST((latitude + 90) * 100 AS INTEGER), longitude);
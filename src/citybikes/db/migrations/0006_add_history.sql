@@ -0,0 +1,14 @@
+PRAGMA user_version=6;
+
+-- availability history, a row per station and hour with the samples that
+-- changed in it packed into data, see db.history. Old rows are rolled up to
+-- a row per station and day, downsampled to a sample every step seconds.
+-- step is 0 for rows as recorded
+CREATE TABLE IF NOT EXISTS history (
+    network_tag TEXT,
+    hash TEXT,
+    hour INTEGER,
+    step INTEGER NOT NULL DEFAULT 0,
+    data BLOB NOT NULL,
+    PRIMARY KEY (network_tag, hash, hour)
+) WITHOUT ROWID;
@@ -0,0 +1,21 @@
+PRAGMA user_version=7;
+
+-- totals of every network, kept up to date on ingest (see
+-- db.ingest.aggregate) so summaries never go through stations. Counts of
+-- vehicle types no station of the network reports are NULL
+CREATE TABLE IF NOT EXISTS network_stats (
+    tag TEXT PRIMARY KEY,
+    stations INTEGER NOT NULL,
+    online INTEGER NOT NULL,
+    bikes INTEGER NOT NULL,
+    docks INTEGER NOT NULL,
+    normal_bikes INTEGER,
+    ebikes INTEGER,
+    cargo INTEGER,
+    ecargo INTEGER,
+    kid_bikes INTEGER,
+    vehicles INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- networks stored before, as in the sqlite3 shell (see db.script)
+.read network_stats.sql
@@ -0,0 +1,58 @@
+-- network_stats of networks stored before migrations/0007, same counts as
+-- db.ingest.aggregate. Also backfills the test data, that keeps no totals
+INSERT OR IGNORE INTO network_stats
+WITH counts AS (
+    SELECT
+        s.network_tag AS tag,
+        s.stat->>'extra'->>'online' AS online,
+        s.stat->>'bikes' AS bikes,
+        s.stat->>'free' AS free,
+        s.stat->>'extra'->>'normal_bikes' AS normal_bikes,
+        s.stat->>'extra'->>'ebikes' AS ebikes,
+        s.stat->>'extra'->>'cargo' AS cargo,
+        s.stat->>'extra'->>'ecargo' AS ecargo,
+        s.stat->>'extra'->>'kid_bikes' AS kid_bikes
+    FROM networks n
+    JOIN json_each(n.stations) j
+    JOIN stations s ON s.hash = j.value AND s.network_tag = n.tag
+), stats AS (
+    SELECT
+        tag,
+        COUNT(*) AS stations,
+        SUM(coalesce(online, 1) != 0) AS online,
+        SUM(max(coalesce(bikes, 0), 0)) AS bikes,
+        SUM(max(coalesce(free, 0), 0)) AS docks,
+        -- stations missing normal_bikes have the rest of bikes, if any
+        SUM(CASE
+            WHEN normal_bikes IS NOT NULL THEN max(normal_bikes, 0)
+            WHEN coalesce(bikes, 0) > coalesce(ebikes, 0) + coalesce(cargo, 0)
+                + coalesce(ecargo, 0) + coalesce(kid_bikes, 0)
+            THEN coalesce(bikes, 0) - coalesce(ebikes, 0) - coalesce(cargo, 0)
+                - coalesce(ecargo, 0) - coalesce(kid_bikes, 0)
+            -- and those without any count, as normal bikes
+            WHEN coalesce(ebikes, cargo, ecargo, kid_bikes) IS NULL THEN 0
+        END) AS normal_bikes,
+        SUM(max(ebikes, 0)) AS ebikes,
+        SUM(max(cargo, 0)) AS cargo,
+        SUM(max(ecargo, 0)) AS ecargo,
+        SUM(max(kid_bikes, 0)) AS kid_bikes
+    FROM counts
+    GROUP BY tag
+)
+SELECT
+    n.tag,
+    coalesce(stats.stations, 0),
+    coalesce(stats.online, 0),
+    coalesce(stats.bikes, 0),
+    coalesce(stats.docks, 0),
+    stats.normal_bikes,
+    stats.ebikes,
+    stats.cargo,
+    stats.ecargo,
+    stats.kid_bikes,
+    (
+        SELECT COUNT(*) FROM json_each(n.vehicles) j
+        JOIN vehicles v ON v.hash = j.value AND v.network_tag = n.tag
+    )
+FROM networks n
+LEFT JOIN stats ON stats.tag = n.tag;
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import zlib
+import heapq
+import asyncio
+import contextlib
+
+from citybikes.db.asyncio import CBD, check_version, get_session, migrate
+
+
+# Networks can be split by tag hash over several db files, each with its own
+# subscriber process as the only writer, so a large network only holds up
+# the commits of its shard and ingest runs on as many cores as shards.
+#
+# XXX the shard of a network depends on the number of shards, changing it
+# needs a reload of every shard (see citybikes.cmd.load)
+
+
+def shard_of(tag, shards):
+    # not hash(), which is salted per process
+    return zlib.crc32(tag.encode()) % shards
+
+
+# the tag of a network message, when it is its first key
+TAG = re.compile(r'\s*\{\s*"tag"\s*:\s*"([^"\\]*)"')
+
+
+def tag_of(message):
+    """tag of a network message, read off its start without decoding the
+    rest. Other messages are decoded"""
+    if match := TAG.match(message):
+        return match.group(1)
+    return json.loads(message)["tag"]
+
+
+def paths(path, shards):
+    """db files of shards, path itself when not sharded"""
+    if shards <= 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{i}{ext}" for i in range(shards)]
+
+
+def routed(name):
+    async def method(self, uid, *args, **kwargs):
+        return await getattr(self.shard(uid), name)(uid, *args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class ShardedCBD:
+    """CBD over the shards of a db. Queries of a network go to its shard,
+    the rest fan out to every shard at once and are merged as CBD returns
+    them"""
+
+    def __init__(self, shards):
+        self.shards = shards
+
+    def shard(self, uid):
+        return self.shards[shard_of(uid, len(self.shards))]
+
+    async def _all(self, name, *args, **kwargs):
+        # each aiosqlite connection runs on its own thread
+        return await asyncio.gather(
+            *[getattr(db, name)(*args, **kwargs) for db in self.shards]
+        )
+
+    get_network = routed("get_network")
+    get_stations = routed("get_stations")
+    get_stations_by_id = routed("get_stations_by_id")
+    get_vehicles = routed("get_vehicles")
+    get_history = routed("get_history")
+    get_changes = routed("get_changes")
+    network_exists = routed("network_exists")
+    get_version = routed("get_version")
+    vehicle_types = routed("vehicle_types")
+
+    async def get_last_updated(self, uid=None):
+        if uid:
+            return await self.shard(uid).get_last_updated(uid)
+        updated = [u for u in await self._all("get_last_updated") if u]
+        return max(updated, default=None)
+
+    async def get_stats(self, uid=None):
+        if uid:
+            return await self.shard(uid).get_stats(uid)
+        return list(heapq.merge(*await self._all("get_stats"), key=lambda r: r["tag"]))
+
+    async def get_tags(self):
+        return list(heapq.merge(*await self._all("get_tags")))
+
+    async def get_updated(self):
+        updated = {}
+        for shard in await self._all("get_updated"):
+            updated.update(shard)
+        return updated
+
+    async def get_versions(self):
+        versions = {}
+        for shard in await self._all("get_versions"):
+            versions.update(shard)
+        return versions
+
+    async def data_version(self):
+        # compared for equality only, changes when any shard does
+        return tuple(await self._all("data_version"))
+
+    async def nearby(self, lat, lon, k=10, available=False):
+        # the k closest of all are among the k closest of each shard
+        hits = await self._all("nearby", lat, lon, k, available)
+        return sorted((h for shard in hits for h in shard), key=lambda h: h[2])[:k]
+
+    async def iter_stations(self, since=None):
+        """as CBD.iter_stations, merging shards in tag order. Holds at most
+        a network per shard in memory"""
+        its = [db.iter_stations(since) for db in self.shards]
+        try:
+            heads = {}
+            for i, it in enumerate(its):
+                if (head := await anext(it, None)) is not None:
+                    heads[i] = head
+            while heads:
+                i = min(heads, key=lambda i: heads[i][0])
+                yield heads.pop(i)
+                if (head := await anext(its[i], None)) is not None:
+                    heads[i] = head
+        finally:
+            for it in its:
+                await it.aclose()
+
+
+def read_only(path):
+    """session of a db file others write to"""
+    return get_session(f"file:{path}?mode=ro", uri=True)
+
+
+def open_read_only(path, shards=1):
+    """open_cbd without migrating, checking the db is up to date instead"""
+    return open_cbd(path, shards, read_only, check_version)
+
+
+@contextlib.asynccontextmanager
+async def open_cbd(path, shards=1, session=get_session, check=migrate):
+    """CBD of the db at path, or a ShardedCBD of its shards. session opens
+    the db file of each, and check is run on every connection (migrate, or
+    check_version when read only)"""
+    async with contextlib.AsyncExitStack() as stack:
+        cbds = []
+        for p in paths(path, shards):
+            db = await stack.enter_async_context(session(p))
+            assert await check(db)
+            cbds.append(CBD(db))
+        yield cbds[0] if len(cbds) == 1 else ShardedCBD(cbds)
@@ -47,20 +47,25 @@ class Stat(BaseModel):
 
     def vehicle_counts(self):
         counts = [(k, getattr(self.extra, k)) for k in Extra.Meta.vehicle_attrs]
-        counts = list(filter(lambda kv: kv[1] is not None, counts))
+        return vehicle_counts(self.bikes, counts)
 
-        # XXX not all pybikes instances with ebikes include 'normal_bikes'
-        # assume that if normal_bikes missing and
-        # sum(counts) != station.stat.bikes
-        # then normal_bikes = station.stat.bikes - sum(counts)
-        if 'normal_bikes' not in [k for k, _ in counts]:
-            counted_bikes = sum(v for _, v in counts)
-            if self.bikes is not None and counted_bikes < self.bikes:
-                normal_bikes = self.bikes - counted_bikes
-                counts.append(('normal_bikes', normal_bikes))
 
-        return counts
+def vehicle_counts(bikes, counts):
+    """(attr, count) of the vehicle_attrs a station reports, out of all of
+    them (attr, count or None)"""
+    counts = list(filter(lambda kv: kv[1] is not None, counts))
 
+    # XXX not all pybikes instances with ebikes include 'normal_bikes'
+    # assume that if normal_bikes missing and
+    # sum(counts) != station.stat.bikes
+    # then normal_bikes = station.stat.bikes - sum(counts)
+    if 'normal_bikes' not in [k for k, _ in counts]:
+        counted_bikes = sum(v for _, v in counts)
+        if bikes is not None and counted_bikes < bikes:
+            normal_bikes = bikes - counted_bikes
+            counts.append(('normal_bikes', normal_bikes))
+
+    return counts
 
 
 class Station(BaseModel):
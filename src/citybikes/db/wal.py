@@ -0,0 +1,109 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from citybikes import metrics
+
+log = logging.getLogger("db")
+
+WAL_SIZE = metrics.gauge("wal_size_bytes", "Size of the WAL file")
+WAL_PENDING = metrics.gauge(
+    "wal_frames_pending", "Frames in the WAL not yet checkpointed"
+)
+CHECKPOINT_TIME = metrics.histogram(
+    "wal_checkpoint_duration_seconds", "Time spent on checkpoints", ["mode"]
+)
+CHECKPOINT_BUSY = metrics.counter(
+    "wal_checkpoint_busy_total", "Checkpoints that could not complete", ["mode"]
+)
+
+
+def wal_size(path):
+    try:
+        return os.path.getsize(path + "-wal")
+    except FileNotFoundError:
+        return 0
+
+
+class Checkpointer(threading.Thread):
+    """Checkpoints the WAL of a database on a timer, off the ingest path.
+
+    Checkpoints are PASSIVE, so they never wait on readers nor block the
+    writer. When the WAL file grows over limit bytes (ie: long reader
+    snapshots kept passive checkpoints from catching up) it escalates to
+    TRUNCATE, which waits up to timeout seconds for readers and resets the
+    WAL file to zero bytes.
+
+    Writers should set wal_autocheckpoint to 0, or leave it high, so commits
+    do not checkpoint inline.
+    """
+
+    def __init__(self, path, interval=1.0, limit=64 * 2**20, timeout=1.0):
+        super().__init__(daemon=True, name="checkpointer")
+        self.path = path
+        self.interval = interval
+        self.limit = limit
+        self.timeout = timeout
+        self.stopped = threading.Event()
+        self.con = None
+
+    def connect(self):
+        # the busy timeout is how long a TRUNCATE waits on readers and writer
+        con = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        con.isolation_level = None
+        return con
+
+    def checkpoint(self, mode="PASSIVE"):
+        if self.con is None:
+            self.con = self.connect()
+        start = time.perf_counter()
+        busy, frames, done = self.con.execute(
+            f"PRAGMA wal_checkpoint({mode})"
+        ).fetchone()
+        elapsed = time.perf_counter() - start
+
+        CHECKPOINT_TIME.observe(elapsed, mode=mode)
+        if busy:
+            CHECKPOINT_BUSY.inc(mode=mode)
+        # -1, -1 when the db is not in WAL mode
+        pending = max(frames - done, 0)
+        WAL_PENDING.set(pending)
+        return busy, frames, done
+
+    def tick(self):
+        mode = "PASSIVE"
+        if self.limit and wal_size(self.path) > self.limit:
+            mode = "TRUNCATE"
+
+        busy, frames, done = self.checkpoint(mode)
+        size = wal_size(self.path)
+        WAL_SIZE.set(size)
+
+        if mode != "PASSIVE" or busy:
+            log.log(
+                logging.WARNING if busy else logging.INFO,
+                "%s checkpoint%s: %d/%d frames, wal at %d bytes",
+                mode,
+                " (busy)" if busy else "",
+                done,
+                frames,
+                size,
+            )
+        return mode, busy
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.tick()
+            except sqlite3.Error as e:
+                log.error("Checkpoint failed: %s", e)
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        if self.con is not None:
+            self.con.close()
+            self.con = None
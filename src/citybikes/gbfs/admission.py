@@ -0,0 +1,105 @@
+import math
+import time
+from contextlib import contextmanager
+
+from starlette.exceptions import HTTPException
+
+from citybikes import metrics
+
+SHED = metrics.counter(
+    "gbfs_shed_total", "Requests turned away, by reason", ["reason", "feed"]
+)
+IN_FLIGHT = metrics.gauge("gbfs_renders_in_flight", "Feeds being rendered")
+
+
+class Admission:
+    """Sheds renders when the db falls behind, and rate limits clients.
+
+    Renders queue up behind the db connection. The expected wait of a new
+    render is the renders in flight times the time each takes, and when it
+    goes over max_wait the render is refused with a 503. Feeds out of
+    PRIORITY are refused sooner, past low_share of max_wait. Cache hits
+    never render, so are never refused.
+
+    With a rate, each client gets a token bucket of burst requests,
+    refilled at rate per second, and a 429 when empty. Clients are told
+    apart by address, or by header when behind a proxy that sets it.
+    """
+
+    # feeds kept ahead of the rest under load
+    PRIORITY = {"station_status", "vehicle_status", "free_bike_status", "station"}
+    low_share = 0.25
+    # weight of the last render on the service time average
+    alpha = 0.1
+    # XXX keyed by client address, cap clients tracked at once
+    max_clients = 65536
+
+    def __init__(self, max_wait=2.0, rate=0, burst=20, header=None):
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = burst
+        self.header = header
+        self.in_flight = 0
+        self.service_time = 0.0
+        self.buckets = {}
+
+    def retry_after(self, seconds):
+        return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+    def client(self, request):
+        if self.header and (forwarded := request.headers.get(self.header)):
+            # XXX the last address is the one the trusted proxy appended,
+            # those before it are whatever the client sent
+            return forwarded.rsplit(",", 1)[-1].strip()
+        return request.client.host
+
+    def limit(self, request, feed):
+        # in-process fetches (push, warming) have no client
+        if not self.rate or request.client is None:
+            return
+
+        now = time.monotonic()
+        client = self.client(request)
+        tokens, last = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+        if tokens < 1:
+            self.buckets[client] = (tokens, now)
+            SHED.inc(reason="rate_limit", feed=feed)
+            headers = self.retry_after((1 - tokens) / self.rate)
+            raise HTTPException(status_code=429, headers=headers)
+
+        if client not in self.buckets and len(self.buckets) >= self.max_clients:
+            # full buckets are the same as no bucket
+            idle = self.burst / self.rate
+            self.buckets = {
+                c: (t, at) for c, (t, at) in self.buckets.items() if now - at < idle
+            }
+        self.buckets[client] = (tokens - 1, now)
+
+    def wait(self):
+        return self.in_flight * self.service_time
+
+    @contextmanager
+    def admit(self, feed):
+        if self.max_wait:
+            wait = self.wait()
+            share = 1 if feed in self.PRIORITY else self.low_share
+            if wait > self.max_wait * share:
+                SHED.inc(reason="overload", feed=feed)
+                headers = self.retry_after(wait)
+                raise HTTPException(status_code=503, headers=headers)
+
+        # renders are served one after the other, one arriving behind n
+        # others takes about (n + 1) service times
+        ahead = self.in_flight
+        self.in_flight += 1
+        IN_FLIGHT.set(self.in_flight)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            IN_FLIGHT.set(self.in_flight)
+            elapsed = (time.perf_counter() - start) / (ahead + 1)
+            self.service_time += self.alpha * (elapsed - self.service_time)
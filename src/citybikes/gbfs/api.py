@@ -1,9 +1,80 @@
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
 from functools import wraps
+from contextlib import nullcontext
 
 from starlette.routing import Route
-from starlette.responses import JSONResponse
+from starlette.responses import Response, StreamingResponse
 from starlette.exceptions import HTTPException
 
+from citybikes import metrics
+from citybikes.db import geo
+from citybikes.gbfs import canonical
+from citybikes.gbfs.push import event
+from citybikes.gbfs.timing import Timing, NO_TIMING
+
+
+REQUEST_TIME = metrics.histogram(
+    "gbfs_request_duration_seconds",
+    "Time to respond a feed, by where it was served from",
+    ["version", "feed", "source"],
+)
+SERIALIZE_TIME = metrics.histogram(
+    "gbfs_serialize_duration_seconds",
+    "Time spent dumping and encoding rendered feeds",
+    ["version", "feed"],
+)
+RESPONSE_SIZE = metrics.histogram(
+    "gbfs_response_size_bytes",
+    "Size of rendered feeds",
+    ["version", "feed"],
+    buckets=metrics.SIZE_BUCKETS,
+)
+
+
+NO_ADMIT = nullcontext()
+
+# seconds between comments on idle push streams, so proxies keep them open
+KEEPALIVE = 15
+# most stations looked up at once with ?station_id=
+MAX_STATION_IDS = 100
+
+
+def dumps(content):
+    # same encoding as starlette JSONResponse
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def parse_time(value):
+    """either a v3 timestamp or a v2 epoch, to an UTC datetime. Timestamps
+    without an offset are UTC. Raises ValueError"""
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), timezone.utc)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_since(since):
+    """a last_updated value, either a v3 timestamp or a v2 epoch, to the
+    networks.updated format (sqlite CURRENT_TIMESTAMP, UTC)"""
+    if since is None:
+        return None
+    try:
+        dt = parse_time(since)
+    except (ValueError, OverflowError, OSError):
+        raise HTTPException(status_code=400, detail="Invalid since")
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
 
 class Gbfs:
     GBFS = None
@@ -12,34 +83,274 @@ class Gbfs:
     # prob. not worth, since most clients won't use it at all
     ttl = 0
 
+    def since(self, request):
+        """the ?since= cursor of delta feeds, if any"""
+        since = request.query_params.get("since")
+        if since is None:
+            return None
+        try:
+            return int(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid since")
+
+    def bbox(self, request):
+        """the ?bbox=min_lon,min_lat,max_lon,max_lat filter, if any"""
+        bbox = request.query_params.get("bbox")
+        if bbox is None:
+            return None
+        try:
+            west, south, east, north = map(float, bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid bbox")
+        if not (geo.valid(south, west) and geo.valid(north, east)):
+            raise HTTPException(status_code=400, detail="Invalid bbox")
+        if west > east or south > north:
+            raise HTTPException(status_code=400, detail="Invalid bbox")
+        return west, south, east, north
+
+    def station_ids(self, request):
+        """the ?station_id=a,b lookup of status feeds, if any"""
+        ids = request.query_params.getlist("station_id")
+        if not ids:
+            return None
+        ids = [i for param in ids for i in param.split(",") if i]
+        if not ids or len(ids) > MAX_STATION_IDS:
+            raise HTTPException(status_code=400, detail="Invalid station_id")
+        return ids
+
+    @staticmethod
+    def clip(rows, bbox):
+        if not bbox:
+            return rows
+        return [r for r in rows if geo.inside(bbox, r.latitude, r.longitude)]
+
+    async def stations(self, request, db, uid, bbox=None):
+        """canonical stations of uid, off its snapshot unless clipped"""
+        if bbox:
+            return list(map(canonical.station, await db.get_stations(uid, bbox)))
+        return await request.app.snapshots.stations(db, uid)
+
+    async def vehicles(self, request, db, uid, bbox=None):
+        if bbox:
+            return list(map(canonical.vehicle, await db.get_vehicles(uid, bbox)))
+        return await request.app.snapshots.vehicles(db, uid)
+
     def url_for(self, request, path, *args, **kwargs):
         version = kwargs.pop("version", self.GBFS.version)
         return str(request.url_for(f"{version}:{path}", *args, **kwargs))
 
-    def route_decorator(self, handler):
-        @wraps(handler)
-        async def _handler(request):
-            args = request.path_params
-            db = request.app.db
+    async def render(self, request, handler, *, timing=NO_TIMING, **args):
+        db = request.app.db
 
-            uid = args.get("uid", None)
+        uid = args.get("uid", None)
 
+        with timing.phase("exists"):
             if uid and not (await db.network_exists(uid)):
                 raise HTTPException(status_code=404)
 
+        with timing.phase("last_updated"):
+            last_updated = await db.get_last_updated(uid)
+
+        with timing.phase("handler"):
+            data = await handler(request, timing.db(db), **args)
+
+        with timing.phase("models"):
             response = self.GBFS.Response(
-                last_updated=await db.get_last_updated(uid),
+                last_updated=last_updated,
                 ttl=self.ttl,
-                data=await handler(request, db, **args),
+                data=data,
             )
-            return JSONResponse(response.model_dump(exclude_none=True))
+
+        labels = {"version": self.GBFS.version, "feed": handler.__name__}
+        with SERIALIZE_TIME.time(**labels):
+            with timing.phase("dump"):
+                content = response.model_dump(exclude_none=True)
+            with timing.phase("encode"):
+                body = dumps(content)
+        RESPONSE_SIZE.observe(len(body), **labels)
+
+        return body
+
+    async def offload(self, request, handler, uid, timing=NO_TIMING):
+        """body of the feed rendered on the process pool when the network is
+        large enough, see Offload. None renders it inline"""
+        offload, feed = request.app.offload, handler.__name__
+        if offload is None:
+            return None
+        if not await offload.wants(request, request.app.db, uid, feed):
+            return None
+        with timing.phase("offload"):
+            return await offload.render(str(request.url), feed)
+
+    def route_decorator(self, handler, cached=True):
+        @wraps(handler)
+        async def _handler(request):
+            start = time.perf_counter()
+            args = request.path_params
+            watcher, cache = request.app.watcher, request.app.cache
+            shared = request.app.shared
+            admission = request.app.admission
+            source = "shared"
+
+            if admission:
+                admission.limit(request, handler.__name__)
+
+            timing = NO_TIMING
+            slow_log = request.app.slow_log
+            if request.app.server_timing or (slow_log and slow_log.sample()):
+                timing = Timing()
+
+            if shared and (body := shared.get(request)) is not None:
+                return self.respond(request, body, handler, source, timing, start)
+
+            uid = args.get("uid", None)
+            # only plain feed urls are cached
+            key = None
+            if cache and cached and not request.url.query:
+                key = str(request.url)
+
+            if watcher:
+                await watcher.poll()
+
+            body = key and cache.get(uid, key)
+            source = "cache"
+
+            if body is None:
+                # a change landing while rendering bumps the generation, and
+                # the stale body is not cached (warming renders included)
+                generation = cache.generation(uid) if key else None
+                # warming is not demand, and keeps to a budget of its own
+                admit = NO_ADMIT
+                if admission and not getattr(request.state, "warming", False):
+                    admit = admission.admit(handler.__name__)
+                with admit:
+                    body = await self.offload(request, handler, uid, timing)
+                    if body is None:
+                        body = await self.render(
+                            request, handler, timing=timing, **args
+                        )
+                source = "render"
+                if key:
+                    cache.set(uid, key, body, generation)
+
+            # in-process fetches (push, warming) are not demand
+            warmer = request.app.warmer
+            if key and warmer and request.client:
+                warmer.hit(uid, key)
+
+            return self.respond(request, body, handler, source, timing, start)
 
         return _handler
 
-    def route(self, path, handler, *args, **kwargs):
+    def respond(self, request, body, handler, source, timing, start):
+        elapsed = time.perf_counter() - start
+        REQUEST_TIME.observe(
+            elapsed,
+            version=self.GBFS.version,
+            feed=handler.__name__,
+            source=source,
+        )
+
+        headers = {}
+        if timing is not NO_TIMING:
+            if source != "render":
+                timing.phases[source] = elapsed
+            if request.app.server_timing:
+                headers["Server-Timing"] = timing.header()
+            if request.app.slow_log:
+                request.app.slow_log.check(request, elapsed, timing)
+
+        return Response(body, media_type="application/json", headers=headers)
+
+    def route(self, path, handler, *args, cached=True, **kwargs):
         name = f"{self.GBFS.version}:{path}"
         kwargs.setdefault("name", name)
-        return Route(path, self.route_decorator(handler), *args, **kwargs)
+        return Route(path, self.route_decorator(handler, cached), *args, **kwargs)
+
+    def stream(self, path, handler):
+        # streamed responses skip the cache and render machinery
+        return Route(path, handler, name=f"{self.GBFS.version}:{path}")
+
+    def status(self, stations):
+        """station_status data out of canonical stations"""
+        raise NotImplementedError()
+
+    async def station(self, request, db, uid, station_id):
+        """station_status of a single station"""
+        stations = await db.get_stations_by_id(uid, [station_id])
+        if not stations:
+            raise HTTPException(status_code=404)
+        return self.status(map(canonical.station, stations))
+
+    async def firehose(self, request):
+        """station_status of every network, one per line, as NDJSON"""
+        since = parse_since(request.query_params.get("since"))
+        labels = {"version": self.GBFS.version, "feed": "firehose"}
+
+        # a connection of its own, closed when the client goes away
+        streams = request.app.streams
+        session = streams() if streams else nullcontext(request.app.db)
+
+        async def lines():
+            start = time.perf_counter()
+            async with session as db:
+                async for tag, updated, stations in db.iter_stations(since):
+                    response = self.GBFS.Response(
+                        last_updated=updated,
+                        ttl=self.ttl,
+                        data=self.status(map(canonical.station, stations)),
+                    )
+                    content = response.model_dump(exclude_none=True)
+                    yield dumps({"system_id": tag, **content}) + b"\n"
+            elapsed = time.perf_counter() - start
+            REQUEST_TIME.observe(elapsed, source="stream", **labels)
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def push(self, request):
+        """station_status of a network as server-sent events: a snapshot on
+        connect, then the feed (or its delta with ?mode=diff) on updates"""
+        uid = request.path_params["uid"]
+        push = request.app.push
+        mode = request.query_params.get("mode", "status")
+
+        if push is None:
+            raise HTTPException(status_code=404)
+        if mode not in ("status", "diff"):
+            raise HTTPException(status_code=400, detail="Invalid mode")
+        if request.app.watcher:
+            # networks may be cached, see NetworkCache
+            await request.app.watcher.poll()
+        if not await request.app.db.network_exists(uid):
+            raise HTTPException(status_code=404)
+
+        url = self.url_for(request, "/station_status.json", uid=uid)
+
+        async def events():
+            queue, snapshot = await push.subscribe(uid, url, mode)
+            if queue is None:
+                # nothing to diff from, closed for the client to retry
+                return
+            try:
+                if snapshot is not None:
+                    yield event("snapshot", snapshot)
+                while True:
+                    try:
+                        message = await asyncio.wait_for(queue.get(), KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield b": keepalive\n\n"
+                        continue
+                    if message is None:
+                        # fell behind, see Broadcaster
+                        return
+                    yield message
+            finally:
+                push.unsubscribe(uid, url, mode, queue)
+
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(
+            events(), media_type="text/event-stream", headers=headers
+        )
 
     @property
     def routes(self):
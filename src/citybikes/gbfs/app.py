@@ -1,5 +1,10 @@
+import asyncio
 import contextlib
+import json
 import os
+import signal
+import logging
+import sqlite3
 
 
 from starlette.applications import Starlette
@@ -7,26 +12,203 @@ from starlette.routing import Mount, Route
 from starlette.responses import Response
 
 
-from citybikes.db.asyncio import CBD, get_session, migrate
+from citybikes import metrics
+from citybikes.db.asyncio import get_session, migrate
+from citybikes.db.shards import open_cbd, open_read_only
 from citybikes.gbfs.versions.v3.api import Gbfs as Gbfs3
 from citybikes.gbfs.versions.v2.api import Gbfs as Gbfs2
+from citybikes.gbfs.cache import FeedCache, NetworkCache, Watcher
+from citybikes.gbfs.canonical import Snapshots
+from citybikes.gbfs.shared import SharedFeeds
+from citybikes.gbfs.timing import SlowLog
 from citybikes.gbfs.pages import HOME
 
 
 DB_URI = os.getenv("DB_URI", "citybikes.db")
+# networks split over this many db files by tag, see citybikes.db.shards
+SHARDS = int(os.getenv("SHARDS", "1"))
+# open the db read only and skip migrations, for workers of an already
+# migrated db (ie: python -m citybikes.cmd.migrate)
+READ_ONLY = os.getenv("READ_ONLY", "0") == "1"
+# serve from in-memory snapshots fed by an in-process subscriber
+MEMORY = os.getenv("MEMORY", "0") == "1"
+# keep writing networks to DB_URI when running in memory
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+ZMQ_ADDR = os.getenv("ZMQ_ADDR", "tcp://127.0.0.1:5555")
+ZMQ_TOPIC = os.getenv("ZMQ_TOPIC", "")
+# cache rendered feeds until their network changes
+CACHE = os.getenv("CACHE", "1") == "1"
+# keep tags and networks in memory until networks change
+NETWORK_CACHE = os.getenv("NETWORK_CACHE", "1") == "1"
+# how often to check for changes from other processes
+WATCH_INTERVAL_MS = int(os.getenv("WATCH_INTERVAL_MS", "500"))
+# add a Server-Timing breakdown header to every feed
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# log the breakdown of a sample of requests slower than this, 0 disables
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_SAMPLE = float(os.getenv("SLOW_REQUEST_SAMPLE", "0.01"))
+# serve feeds from a snapshot published by citybikes.cmd.snapshot
+SHARED_FEEDS = os.getenv("SHARED_FEEDS")
+# push station_status updates to clients of .../station_status.sse
+PUSH = os.getenv("PUSH", "0") == "1"
+# render the most requested feeds into the cache as soon as they change
+WARM = os.getenv("WARM", "0") == "1"
+WARM_TOP = int(os.getenv("WARM_TOP", "64"))
+# fraction of the event loop warming can take
+WARM_BUDGET = float(os.getenv("WARM_BUDGET", "0.25"))
+# where to keep the most requested feeds, to warm on startup
+WARM_FILE = os.getenv("WARM_FILE")
+# refuse renders expected to wait longer than this behind the db, 0 disables
+MAX_RENDER_WAIT_MS = int(os.getenv("MAX_RENDER_WAIT_MS", "0"))
+# requests per second and burst of each client, 0 disables
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", "0"))
+RATE_BURST = int(os.getenv("RATE_BURST", "20"))
+# header a trusted proxy sets to the client address (ie: X-Forwarded-For),
+# clients are told apart by it instead of by the address of the proxy
+RATE_LIMIT_HEADER = os.getenv("RATE_LIMIT_HEADER")
+# render feeds of networks with at least this many stations (or vehicles)
+# on a pool of OFFLOAD_WORKERS processes, 0 renders everything inline
+OFFLOAD_ROWS = int(os.getenv("OFFLOAD_ROWS", "0"))
+OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS", "2"))
 
 
 VERSIONS = [Gbfs2.GBFS.version, Gbfs3.GBFS.version]
 
+log = logging.getLogger("gbfs")
+
+
+@contextlib.asynccontextmanager
+async def sqlite_session():
+    if READ_ONLY:
+        session = open_read_only(DB_URI, SHARDS)
+    else:
+        session = open_cbd(DB_URI, SHARDS, get_session, migrate)
+    async with session as db:
+        yield db
+
+
+def sqlite_streams():
+    """a read only connection for a long lived stream (ie: the firehose), so
+    its read snapshot does not hold back the shared connection"""
+    return open_read_only(DB_URI, SHARDS)
+
+
+@contextlib.asynccontextmanager
+async def memory_session():
+    # hyper (and zmq) are only required when running in memory
+    from citybikes.cmd.subscriber import areader
+    from citybikes.db import migrate
+    from citybikes.db.memory import MemoryCBD, WriteBehind
+
+    db = MemoryCBD()
+    writer = None
+
+    if WRITE_BEHIND:
+        con = sqlite3.connect(DB_URI, check_same_thread=False)
+        con.row_factory = lambda *a: dict(sqlite3.Row(*a))
+        assert migrate(con)
+        db.load(con)
+        writer = WriteBehind(con)
+        writer.start()
+
+    async def handle_message(topic, message):
+        network = json.loads(message)
+        await db.aupdate(network)
+        if writer:
+            writer.put(network)
+
+    def died(task):
+        if task.cancelled():
+            return
+        # XXX stale data would be served from then on, exit to be restarted
+        log.critical("Subscriber died, exiting", exc_info=task.exception())
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    subscriber = asyncio.create_task(areader(ZMQ_ADDR, ZMQ_TOPIC, handle_message))
+    subscriber.add_done_callback(died)
+
+    try:
+        yield db
+    finally:
+        subscriber.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await subscriber
+        if writer:
+            writer.close()
+
 
 @contextlib.asynccontextmanager
 async def lifespan(app):
-    async with get_session(DB_URI) as db:
-        assert await migrate(db)
-        app.db = CBD(db)
+    session = memory_session if MEMORY else sqlite_session
+    async with session() as db:
+        app.db = db
         # XXX best way to avoid circular imports
         app.VERSIONS = VERSIONS
-        yield
+        app.cache = None
+        app.watcher = None
+        app.shared = None
+        app.push = None
+        app.warmer = None
+        app.admission = None
+        app.offload = None
+        # memory snapshots are not held back by streams
+        app.streams = None if MEMORY else sqlite_streams
+        app.snapshots = Snapshots()
+        app.server_timing = SERVER_TIMING
+        app.slow_log = None
+        if SLOW_REQUEST_MS:
+            app.slow_log = SlowLog(SLOW_REQUEST_MS / 1000, SLOW_REQUEST_SAMPLE)
+        if MAX_RENDER_WAIT_MS or RATE_LIMIT:
+            from citybikes.gbfs.admission import Admission
+
+            app.admission = Admission(
+                MAX_RENDER_WAIT_MS / 1000, RATE_LIMIT, RATE_BURST, RATE_LIMIT_HEADER
+            )
+        if OFFLOAD_ROWS and not MEMORY:
+            # multiprocessing is only required when offloading
+            from citybikes.gbfs.offload import Offload
+
+            # workers read DB_URI, there is nothing to read in memory mode
+            app.offload = Offload(DB_URI, SHARDS, OFFLOAD_WORKERS, OFFLOAD_ROWS)
+        if SHARED_FEEDS:
+            app.shared = SharedFeeds(SHARED_FEEDS, WATCH_INTERVAL_MS / 1000)
+        if CACHE or PUSH or NETWORK_CACHE:
+            app.watcher = Watcher(db, interval=WATCH_INTERVAL_MS / 1000)
+        if NETWORK_CACHE and not MEMORY:
+            # first, so later listeners already see the changed networks
+            app.db = NetworkCache(db, app.watcher)
+        if CACHE:
+            app.cache = FeedCache()
+            # before push, so pushed feeds are rendered fresh and cached
+            app.watcher.subscribe(app.cache.invalidate)
+        if PUSH:
+            from citybikes.gbfs.push import Broadcaster
+
+            app.push = Broadcaster(app, app.watcher, WATCH_INTERVAL_MS / 1000)
+            poller = asyncio.create_task(app.push.run())
+        if CACHE and WARM:
+            from citybikes.gbfs.warm import Warmer
+
+            app.warmer = Warmer(
+                app, app.watcher, WARM_TOP, WARM_BUDGET, path=WARM_FILE
+            )
+            app.warmer.load()
+            warmer = asyncio.create_task(app.warmer.run())
+
+        try:
+            yield
+        finally:
+            if PUSH:
+                poller.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await poller
+            if CACHE and WARM:
+                warmer.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await warmer
+                app.warmer.save()
+            if app.offload:
+                app.offload.close()
 
 
 gbfs_v2 = Gbfs2()
@@ -38,6 +220,11 @@ routes = [
     Mount("/3", routes=gbfs_v3.routes),
     # XXX this will do for now
     Route("/", lambda r: Response(HOME.format(endpoint=str(r.base_url)))),
+    # XXX per process, with several workers each scrape hits a random one
+    Route(
+        "/metrics",
+        lambda r: Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE),
+    ),
 ]
 
 app = Starlette(
@@ -0,0 +1,149 @@
+import time
+import logging
+
+log = logging.getLogger("cache")
+
+
+class FeedCache:
+    """Rendered feeds, grouped by network so these can be dropped when a
+    network changes. Feeds not tied to a network (ie: manifest) go under
+    None and are dropped on any change.
+
+    Renders take a generation of their network before reading, and are not
+    cached if the network was invalidated while rendering, as those may
+    have read rows from before the change"""
+
+    # XXX feeds are keyed by url, which includes the host. Cap the number of
+    # entries per network so a client can not grow it indefinitely, evicting
+    # the least recently used
+    max_entries = 64
+
+    def __init__(self):
+        self.feeds = {}
+        # uid -> bumped on every invalidation
+        self.generations = {}
+
+    def generation(self, uid):
+        return self.generations.get(uid, 0)
+
+    def get(self, uid, key):
+        feeds = self.feeds.get(uid)
+        if not feeds or key not in feeds:
+            return None
+        # most recently used last
+        feeds[key] = body = feeds.pop(key)
+        return body
+
+    def set(self, uid, key, body, generation=None):
+        if generation is not None and generation != self.generation(uid):
+            return
+        feeds = self.feeds.setdefault(uid, {})
+        feeds.pop(key, None)
+        if len(feeds) >= self.max_entries:
+            del feeds[next(iter(feeds))]
+        feeds[key] = body
+
+    def invalidate(self, uids):
+        for uid in uids | {None}:
+            self.feeds.pop(uid, None)
+            self.generations[uid] = self.generation(uid) + 1
+
+
+class Watcher:
+    """Detects writes from other processes (ie: the subscriber).
+
+    Checks PRAGMA data_version at most once every interval seconds, and only
+    when it changes looks at the version of every network (see
+    CBD.get_version) to tell which networks did.
+    """
+
+    def __init__(self, db, interval=0.5):
+        self.db = db
+        self.interval = interval
+        self.checked = 0
+        self.version = None
+        self.versions = {}
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    async def poll(self):
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return
+        self.checked = now
+
+        version = await self.db.data_version()
+        if version == self.version:
+            return
+        self.version = version
+
+        # not networks.updated alone, with a resolution of seconds
+        versions = await self.db.get_versions()
+        changed = {
+            tag
+            for tag in versions.keys() | self.versions.keys()
+            if versions.get(tag) != self.versions.get(tag)
+        }
+        self.versions = versions
+
+        if not changed:
+            return
+
+        log.debug("Changed networks: %s", changed)
+        for listener in self.listeners:
+            listener(changed)
+
+
+class NetworkCache:
+    """CBD keeping the set of tags and parsed networks in memory, so unknown
+    networks (404s) and network metadata do not need a query. Both are
+    dropped whenever the watcher sees networks change"""
+
+    def __init__(self, db, watcher):
+        self.db = db
+        self.tags = None
+        self.networks = {}
+        # bumped on every change, loads that raced one are not kept
+        self.generation = 0
+        watcher.subscribe(self.invalidate)
+
+    # attr dispatcher to the cached db
+    def __getattr__(self, attr):
+        return getattr(self.db, attr)
+
+    async def _tags(self):
+        tags = self.tags
+        if tags is None:
+            generation = self.generation
+            # ordered as get_tags, and a set for lookups
+            tags = dict.fromkeys(await self.db.get_tags())
+            if generation == self.generation:
+                self.tags = tags
+        return tags
+
+    async def get_tags(self):
+        return list(await self._tags())
+
+    async def network_exists(self, uid):
+        return uid in await self._tags()
+
+    async def get_network(self, uid):
+        network = self.networks.get(uid)
+        if network is not None:
+            return network
+        if not await self.network_exists(uid):
+            return None
+
+        generation = self.generation
+        network = await self.db.get_network(uid)
+        if network is not None and generation == self.generation:
+            self.networks[uid] = network
+        return network
+
+    def invalidate(self, uids):
+        self.generation += 1
+        self.tags = None
+        for uid in uids:
+            self.networks.pop(uid, None)
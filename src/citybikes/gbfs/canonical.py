@@ -0,0 +1,136 @@
+from datetime import datetime
+from dataclasses import dataclass
+
+from citybikes.gbfs.constants import Vehicles
+
+# vehicle_type_id by name, and by Citybikes station counts and vehicle kinds
+VEHICLE_TYPES = {
+    name: v["vehicle_type_id"]
+    for name, v in vars(Vehicles).items()
+    if isinstance(v, dict)
+}
+VEHICLE_TYPES.update({
+    "normal_bikes": VEHICLE_TYPES["normal_bike"],
+    "ebikes": VEHICLE_TYPES["electric_bike"],
+    "cargo": VEHICLE_TYPES["cargo_bike"],
+    "ecargo": VEHICLE_TYPES["electric_cargo_bike"],
+    "kid_bikes": VEHICLE_TYPES["normal_kid_bike"],
+    "bike": VEHICLE_TYPES["normal_bike"],
+    "ebike": VEHICLE_TYPES["electric_bike"],
+})  # fmt: skip
+DEFAULT_TYPE = VEHICLE_TYPES["normal_bike"]
+
+
+def coord(x):
+    return round(x, 6)
+
+
+def count(n):
+    return n if n is None else max(n, 0)
+
+
+@dataclass(slots=True, frozen=True)
+class Station:
+    """A station with every value GBFS feeds need, already parsed, clamped
+    and rounded. Versions only rename fields and format timestamps"""
+
+    uid: str
+    name: str
+    latitude: float
+    longitude: float
+    address: str | None
+    post_code: str | None
+    rental_methods: list[str] | None
+    capacity: int | None
+    rental_uris: dict | None
+    bikes: int
+    free: int | None
+    # (vehicle_type_id, count)
+    vehicle_types: tuple
+    online: bool
+    last_reported: datetime
+
+
+@dataclass(slots=True, frozen=True)
+class Vehicle:
+    uid: str
+    vehicle_type_id: str
+    latitude: float
+    longitude: float
+    online: bool
+    last_reported: datetime
+
+
+def station(s):
+    """canonical Station out of a db Station"""
+    stat, extra = s.stat, s.stat.extra
+
+    rental_methods = extra.payment
+    if extra.payment_terminal is not None:
+        rental_methods = sorted(set(rental_methods or [] + ["key", "creditcard"]))
+
+    counts = stat.vehicle_counts()
+    if counts:
+        types = tuple((VEHICLE_TYPES[k], count(v)) for k, v in counts)
+    else:
+        types = ((DEFAULT_TYPE, count(stat.bikes)),)
+
+    return Station(
+        uid=s.uid,
+        name=s.name,
+        latitude=coord(s.latitude),
+        longitude=coord(s.longitude),
+        address=extra.address,
+        post_code=extra.post_code,
+        rental_methods=rental_methods,
+        capacity=count(extra.slots),
+        rental_uris=extra.rental_uris,
+        bikes=count(stat.bikes),
+        free=count(stat.free),
+        vehicle_types=types,
+        # XXX status ? and if not available, default to true
+        online=getattr(stat, "online", None) is not False,
+        last_reported=datetime.fromisoformat(stat.timestamp),
+    )
+
+
+def vehicle(v):
+    """canonical Vehicle out of a db Vehicle"""
+    return Vehicle(
+        uid=v.uid,
+        vehicle_type_id=VEHICLE_TYPES.get(v.kind, DEFAULT_TYPE),
+        latitude=coord(v.latitude),
+        longitude=coord(v.longitude),
+        online=getattr(v.stat, "online", None) is not False,
+        last_reported=datetime.fromisoformat(v.stat.timestamp),
+    )
+
+
+class Snapshots:
+    """Canonical stations and vehicles of networks, built once per version
+    of each network and shared by every GBFS version"""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    async def get(self, db, uid, kind):
+        # the version is read first, so a commit landing in between only
+        # costs a rebuild on the next request
+        version = await db.get_version(uid)
+        key = (uid, kind)
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1]
+
+        if kind == "station":
+            entities = list(map(station, await db.get_stations(uid)))
+        else:
+            entities = list(map(vehicle, await db.get_vehicles(uid)))
+        self.snapshots[key] = (version, entities)
+        return entities
+
+    async def stations(self, db, uid):
+        return await self.get(db, uid, "station")
+
+    async def vehicles(self, db, uid):
+        return await self.get(db, uid, "vehicle")
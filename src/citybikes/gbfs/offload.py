@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import contextlib
+import multiprocessing
+from multiprocessing import util
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from starlette.exceptions import HTTPException
+
+from citybikes import metrics
+from citybikes.db.shards import open_read_only
+
+log = logging.getLogger("offload")
+
+OFFLOADED = metrics.counter(
+    "gbfs_offloaded_total", "Feeds rendered on the process pool", ["feed"]
+)
+
+# feeds whose render grows with the rows of a network, and which rows
+ROWS = {
+    "station_information": "stations",
+    "station_status": "stations",
+    "vehicle_status": "vehicles",
+    "free_bike_status": "vehicles",
+}
+
+# of the pool process, see init
+worker = None
+
+
+def init(path, shards):
+    """pool process initializer. A read only connection and a renderer of
+    its own, on a loop kept for the life of the process"""
+    # XXX best way to avoid circular imports
+    from citybikes.gbfs.render import renderer
+
+    global worker
+
+    loop = asyncio.new_event_loop()
+    stack = contextlib.AsyncExitStack()
+    db = loop.run_until_complete(
+        stack.enter_async_context(open_read_only(path, shards))
+    )
+    worker = (loop, renderer(db))
+    # XXX aiosqlite connections run on a non daemon thread, the process
+    # would not exit without closing them first
+    def close():
+        loop.run_until_complete(stack.aclose())
+
+    util.Finalize(None, close, exitpriority=10)
+
+
+def render(url):
+    # XXX best way to avoid circular imports
+    from citybikes.gbfs.render import fetch
+
+    loop, app = worker
+    return loop.run_until_complete(fetch(app, url))
+
+
+class Offload:
+    """Renders the feeds of networks with at least threshold rows on a pool
+    of processes, so turning thousands of rows into models and JSON does
+    not hold the event loop (and every other request) for as long.
+
+    Workers read the db on their own and return encoded bodies, that are
+    cached and served as any other. Smaller networks render inline.
+    """
+
+    def __init__(self, path, shards=1, workers=2, threshold=5000):
+        self.threshold = threshold
+        # not forked off a process running threads (ie: aiosqlite)
+        self.pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init,
+            initargs=(path, shards),
+        )
+        self.broken = False
+
+    async def wants(self, request, db, uid, feed):
+        """whether to render feed of uid on the pool"""
+        kind = ROWS.get(feed)
+        if self.broken or uid is None or kind is None:
+            return False
+        # lookups of a few stations are small whatever the network
+        if "station_id" in request.query_params:
+            return False
+        stats = await db.get_stats(uid)
+        return bool(stats) and stats[0][kind] >= self.threshold
+
+    async def render(self, url, feed):
+        """body of url rendered on the pool, None if the pool is gone"""
+        try:
+            status, body = await asyncio.wrap_future(self.pool.submit(render, url))
+        except BrokenProcessPool:
+            log.error("Process pool broken, rendering inline from now on")
+            self.broken = True
+            return None
+        if status != 200:
+            raise HTTPException(status_code=status)
+        OFFLOADED.inc(feed=feed)
+        return body
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
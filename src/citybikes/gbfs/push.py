@@ -0,0 +1,155 @@
+import json
+import asyncio
+import logging
+
+from citybikes import metrics
+
+log = logging.getLogger("push")
+
+CLIENTS = metrics.gauge("gbfs_push_clients", "Connected push clients")
+MESSAGES = metrics.counter(
+    "gbfs_push_messages_total", "Rendered push messages, before fan out", ["mode"]
+)
+DROPPED = metrics.counter(
+    "gbfs_push_dropped_total", "Messages dropped for clients falling behind"
+)
+
+
+def event(name, body):
+    # feeds are dumped without newlines, so they fit in a single data field
+    return b"event: " + name.encode() + b"\ndata: " + bytes(body) + b"\n\n"
+
+
+class Channel:
+    def __init__(self, url, mode):
+        self.url = url
+        self.mode = mode
+        self.queues = set()
+        self.cursor = None
+        self.body = None
+        self.lock = asyncio.Lock()
+
+
+class Broadcaster:
+    """Pushes station_status of a network to every subscribed client.
+
+    Learns about updates from the watcher, and renders each changed feed
+    once per update, no matter how many clients listen. In diff mode the
+    message is the delta since the previous update instead (see ?since=).
+    Clients that fall behind lose their oldest pending messages. As diffs
+    build on each other, diff clients instead get their pending messages
+    replaced by a fresh snapshot, or their stream closed (a None message)
+    if one can not be rendered, so they resubscribe.
+    """
+
+    def __init__(self, app, watcher, interval=0.5, queue_size=8):
+        self.app = app
+        self.watcher = watcher
+        self.interval = interval
+        self.queue_size = queue_size
+        self.channels = {}
+        self.tasks = set()
+        watcher.subscribe(self.changed)
+
+    async def fetch(self, url):
+        from citybikes.gbfs.render import fetch
+
+        status, body = await fetch(self.app, url)
+        if status != 200:
+            return None
+        return body
+
+    async def subscribe(self, uid, url, mode):
+        """a queue of messages for a new client, and its first message (a
+        full snapshot). No queue for a diff client when there is no cursor
+        to diff from"""
+        key = (uid, url, mode)
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = Channel(url, mode)
+        if mode == "diff" and channel.cursor is None:
+            async with channel.lock:
+                body = await self.fetch(f"{url}?since=0")
+                if body is not None:
+                    channel.cursor = json.loads(body)["data"]["cursor"]
+            if channel.cursor is None:
+                if not channel.queues:
+                    self.channels.pop(key, None)
+                return None, None
+
+        queue = asyncio.Queue(self.queue_size)
+        channel.queues.add(queue)
+        CLIENTS.set(sum(len(c.queues) for c in self.channels.values()))
+        snapshot = await self.fetch(url)
+        if channel.body is None:
+            channel.body = snapshot
+        return queue, snapshot
+
+    def unsubscribe(self, uid, url, mode, queue):
+        key = (uid, url, mode)
+        channel = self.channels.get(key)
+        if channel is None:
+            return
+        channel.queues.discard(queue)
+        if not channel.queues:
+            del self.channels[key]
+        CLIENTS.set(sum(len(c.queues) for c in self.channels.values()))
+
+    def changed(self, tags):
+        for (uid, _, _), channel in list(self.channels.items()):
+            if uid in tags:
+                task = asyncio.create_task(self.publish(channel))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def publish(self, channel):
+        # the watcher reports every network on its first poll, and updates
+        # may not touch availability. Nothing new is not pushed
+        snapshot = None
+        async with channel.lock:
+            if channel.mode == "diff":
+                # from scratch, if the cursor was never set
+                since = 0 if channel.cursor is None else channel.cursor
+                body = await self.fetch(f"{channel.url}?since={since}")
+                if body is None:
+                    return
+                data = json.loads(body)["data"]
+                channel.cursor = data["cursor"]
+                if not data["stations"] and not data["removed"]:
+                    return
+                # after the diff, so it is as new as it
+                if any(q.full() for q in channel.queues):
+                    snapshot = await self.fetch(channel.url)
+            else:
+                body = await self.fetch(channel.url)
+                if body is None or body == channel.body:
+                    return
+                channel.body = body
+
+        message = event(channel.mode, body)
+        MESSAGES.inc(mode=channel.mode)
+        for queue in channel.queues:
+            if not queue.full():
+                queue.put_nowait(message)
+                continue
+            if channel.mode != "diff":
+                queue.get_nowait()
+                DROPPED.inc()
+                queue.put_nowait(message)
+                continue
+            # a dropped diff would leave the client out of sync for good
+            DROPPED.inc(queue.qsize())
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(snapshot and event("snapshot", snapshot))
+
+    async def run(self):
+        """poll for changes while anyone is listening"""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.channels:
+                continue
+            try:
+                await self.watcher.poll()
+            except Exception:
+                log.exception("Failed polling for changes")
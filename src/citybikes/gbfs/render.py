@@ -0,0 +1,92 @@
+from urllib.parse import urlsplit
+
+from starlette.applications import Starlette
+from starlette.schemas import SchemaGenerator
+
+from citybikes.gbfs.app import routes, VERSIONS
+from citybikes.gbfs.canonical import Snapshots
+
+
+def renderer(db):
+    """A copy of the app that always renders from db, to render feeds outside
+    of requests (ie: shared snapshots)"""
+    app = Starlette(routes=routes)
+    app.db = db
+    app.VERSIONS = VERSIONS
+    app.cache = None
+    app.watcher = None
+    app.shared = None
+    app.push = None
+    app.warmer = None
+    app.admission = None
+    app.offload = None
+    app.streams = None
+    app.snapshots = Snapshots()
+    app.server_timing = False
+    app.slow_log = None
+    return app
+
+
+# feeds that need query parameters, or change with the time of the request
+DYNAMIC = ["/3/nearby.json", "/3/{uid}/history.json"]
+
+
+def feed_paths(app, tags):
+    """Paths of every static feed, for every network"""
+    schema = SchemaGenerator({})
+    paths = [r.path for r in schema.get_endpoints(app.routes)]
+
+    for path in sorted(paths):
+        if not path.endswith(".json") or path in DYNAMIC:
+            continue
+        # only feeds that depend on nothing but the network
+        if path.replace("{uid}", "").count("{"):
+            continue
+        if "{uid}" in path:
+            yield from (path.format(uid=tag) for tag in tags)
+        else:
+            yield path
+
+
+def network_of(path):
+    """/3/bicing/gbfs.json -> bicing, /3/manifest.json -> None"""
+    parts = path.strip("/").split("/")
+    return parts[1] if len(parts) > 2 else None
+
+
+async def fetch(app, url, state=None):
+    """GET url from app in-process, returns (status, body). state is set
+    on the request (ie: request.state.warming)"""
+    url = urlsplit(url)
+    port = url.port or (443 if url.scheme == "https" else 80)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": url.scheme,
+        "server": (url.hostname, port),
+        "client": None,
+        "root_path": "",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": [(b"host", url.netloc.encode())],
+        "state": dict(state or {}),
+    }
+
+    status = None
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(body)
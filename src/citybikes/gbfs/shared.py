@@ -0,0 +1,105 @@
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import tempfile
+
+log = logging.getLogger("shared")
+
+# File layout:
+#   MAGIC | header length (u64 le) | json header | feed bodies...
+# where the header is {"base_url": str, "index": {path: [offset, length]}}
+# and offsets are relative to the end of the header
+MAGIC = b"CBGBFS01"
+HEAD = struct.Struct("<8sQ")
+
+
+def publish(path, feeds, base_url):
+    """Atomically replace the snapshot at path with feeds, a dict of
+    {url path: rendered body}"""
+
+    index = {}
+    offset = 0
+    for key, body in feeds.items():
+        index[key] = [offset, len(body)]
+        offset += len(body)
+
+    header = json.dumps({"base_url": base_url, "index": index}).encode()
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEAD.pack(MAGIC, len(header)))
+            f.write(header)
+            f.write(b"".join(feeds.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class SharedFeeds:
+    """Read only view on a snapshot written by `publish`. Bodies are
+    returned as slices of the mapping, so all workers share a single copy.
+
+    The file is checked for replacement at most once every interval.
+    """
+
+    def __init__(self, path, interval=0.5):
+        self.path = path
+        self.interval = interval
+        self.checked = 0
+        self.stat = None
+        self.view = None
+        self.start = 0
+        self.base_url = None
+        self.index = {}
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return
+        self.checked = now
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.view, self.index, self.stat = None, {}, None
+            return
+
+        if self.stat and (st.st_ino, st.st_mtime_ns) == self.stat:
+            return
+
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, length = HEAD.unpack_from(mm)
+        if magic != MAGIC:
+            log.error("%s is not a feed snapshot", self.path)
+            return
+        header = json.loads(mm[HEAD.size : HEAD.size + length])
+
+        # old mappings are unmapped once no response holds a slice of them
+        self.view = memoryview(mm)
+        self.start = HEAD.size + length
+        self.base_url = header["base_url"]
+        self.index = header["index"]
+        self.stat = (st.st_ino, st.st_mtime_ns)
+        log.info("Loaded %d feeds from %s", len(self.index), self.path)
+
+    def get(self, request):
+        self.refresh()
+        if request.url.query or str(request.base_url) != self.base_url:
+            return None
+        entry = self.index.get(request.url.path)
+        if entry is None:
+            return None
+        offset, length = entry
+        offset += self.start
+        return self.view[offset : offset + length]
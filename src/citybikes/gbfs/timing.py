@@ -0,0 +1,105 @@
+import time
+import random
+import inspect
+import logging
+from contextlib import contextmanager
+
+log = logging.getLogger("timing")
+
+
+class Timing:
+    """Per request breakdown of where time goes, for Server-Timing headers
+    and the slow request log"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.rows = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def db(self, db):
+        return TimedDB(db, self)
+
+    def breakdown(self):
+        phases = dict(self.phases)
+        # handlers query the db and build models out of the results
+        if "handler" in phases:
+            handler = phases.pop("handler") - phases.get("query", 0)
+            phases["models"] = phases.get("models", 0) + handler
+        phases["total"] = time.perf_counter() - self.start
+        return {k: round(v * 1000, 3) for k, v in phases.items()}
+
+    def header(self):
+        metrics = []
+        for name, ms in self.breakdown().items():
+            metric = f"{name};dur={ms}"
+            if name == "query":
+                metric += f';desc="{self.queries} queries, {self.rows} rows"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+class NoTiming:
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def db(self, db):
+        return db
+
+
+NO_TIMING = NoTiming()
+
+
+class TimedDB:
+    """Proxy to a CBD that accounts its calls into a Timing query phase"""
+
+    def __init__(self, db, timing):
+        self.db = db
+        self.timing = timing
+
+    def __getattr__(self, attr):
+        fn = getattr(self.db, attr)
+        if not inspect.iscoroutinefunction(fn):
+            return fn
+
+        async def _fn(*args, **kwargs):
+            with self.timing.phase("query"):
+                result = await fn(*args, **kwargs)
+            self.timing.queries += 1
+            if isinstance(result, list):
+                self.timing.rows += len(result)
+            return result
+
+        return _fn
+
+
+class SlowLog:
+    """Logs the timing breakdown of a sample of requests over threshold
+    seconds"""
+
+    def __init__(self, threshold, rate=1.0):
+        self.threshold = threshold
+        self.rate = rate
+
+    def sample(self):
+        return random.random() < self.rate
+
+    def check(self, request, elapsed, timing):
+        if elapsed < self.threshold:
+            return
+        log.warning(
+            "Slow request %s: %.1fms %s",
+            request.url.path,
+            elapsed * 1000,
+            timing.breakdown(),
+        )
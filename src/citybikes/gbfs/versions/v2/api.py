@@ -2,6 +2,7 @@ from functools import partial
 
 from starlette.routing import Mount
 
+from citybikes.gbfs import canonical
 from citybikes.gbfs.types import GBFS2
 from citybikes.gbfs.api import Gbfs as BaseGbfs
 
@@ -21,10 +22,16 @@ class Gbfs(BaseGbfs):
             self.route("/vehicle_types.json", self.vehicle_types),
             self.route("/station_information.json", self.station_information),
             self.route("/station_status.json", self.station_status),
+            # lookups are cheap, and would evict the feeds of the network
+            self.route(
+                "/station_status/{station_id}.json", self.station, cached=False
+            ),
+            self.stream("/station_status.sse", self.push),
             self.route("/free_bike_status.json", self.free_bike_status),
         ]
 
         return [
+            self.stream("/station_status.ndjson", self.firehose),
             Mount("/{uid}", routes=network_routes),
         ]
 
@@ -105,16 +112,46 @@ class Gbfs(BaseGbfs):
         return GBFS2.VehicleTypes(vehicle_types=vehicle_types)
 
     async def station_information(self, request, db, uid):
-        stations = await db.get_stations(uid)
-        stations = map(lambda s: GBFS2.Station2GbfsStationInfo(s), stations)
+        stations = await self.stations(request, db, uid, self.bbox(request))
+        stations = map(GBFS2.station_info, stations)
         return GBFS2.StationInfoR(stations=list(stations))
 
-    async def station_status(self, request, db, uid):
-        stations = await db.get_stations(uid)
-        stations = map(lambda s: GBFS2.Station2GbfsStationStatus(s), stations)
+    def status(self, stations):
+        stations = map(GBFS2.station_status, stations)
         return GBFS2.StationStatusR(stations=list(stations))
 
+    async def station_status(self, request, db, uid):
+        bbox = self.bbox(request)
+        if (since := self.since(request)) is not None:
+            cursor, full, stations, removed = await db.get_changes(uid, since)
+            stations = map(canonical.station, self.clip(stations, bbox))
+            return GBFS2.StationStatusDelta(
+                stations=self.status(stations).stations,
+                removed=removed,
+                cursor=cursor,
+                full=full,
+            )
+
+        if (ids := self.station_ids(request)) is not None:
+            stations = self.clip(await db.get_stations_by_id(uid, ids), bbox)
+            stations = map(canonical.station, stations)
+        else:
+            stations = await self.stations(request, db, uid, bbox)
+        return self.status(stations)
+
     async def free_bike_status(self, request, db, uid):
-        vehicles = await db.get_vehicles(uid)
-        vehicles = map(lambda v: GBFS2.Vehicle2GbfsBikeStatus(v), vehicles)
+        bbox = self.bbox(request)
+        if (since := self.since(request)) is not None:
+            cursor, full, vehicles, removed = await db.get_changes(
+                uid, since, "vehicle"
+            )
+            vehicles = map(canonical.vehicle, self.clip(vehicles, bbox))
+        else:
+            vehicles = await self.vehicles(request, db, uid, bbox)
+        vehicles = map(GBFS2.bike_status, vehicles)
+
+        if since is not None:
+            return GBFS2.BikeStatusDelta(
+                bikes=list(vehicles), removed=removed, cursor=cursor, full=full
+            )
         return GBFS2.BikeStatusR(bikes=list(vehicles))
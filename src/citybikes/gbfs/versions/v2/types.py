@@ -58,6 +58,14 @@ class BikeStatusR(BaseModel):
     bikes: list[BikeStatus]
 
 
+# with ?since=<cursor>, only bikes changed after cursor and ids removed
+class BikeStatusDelta(BaseModel):
+    bikes: list[BikeStatus]
+    removed: list[str]
+    cursor: int
+    full: bool
+
+
 class SystemInfo(BaseModel):
     system_id: str
     language: str
@@ -100,6 +108,14 @@ class StationStatusR(BaseModel):
     stations: list[StationStatus]
 
 
+# with ?since=<cursor>, only stations changed after cursor and ids removed
+class StationStatusDelta(BaseModel):
+    stations: list[StationStatus]
+    removed: list[str]
+    cursor: int
+    full: bool
+
+
 class Version(BaseModel):
     version: str
     url: str
@@ -136,6 +152,8 @@ class Response(BaseModel):
         StationInfoR,
         StationStatusR,
         BikeStatusR,
+        StationStatusDelta,
+        BikeStatusDelta,
     ]
 
 
@@ -162,99 +180,58 @@ class Vehicles:
     scooter = scooter
 
 
-class VehicleCounts:
-    # XXX I hate this
-
-    class Normal(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.normal_bike.vehicle_type_id
-
-    class NormalKid(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.normal_kid_bike.vehicle_type_id
-
-    class ElectricBike(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.electric_bike.vehicle_type_id
-
-    class CargoBike(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.cargo_bike.vehicle_type_id
-
-    class ElectricCargoBike(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.electric_cargo_bike.vehicle_type_id
-
-    Default = Normal
-
-    # aliases that map to Citybikes fields
-    ebikes = ElectricBike
-    normal_bikes = Normal
-    cargo = CargoBike
-    ecargo = ElectricCargoBike
-    kid_bikes = NormalKid
-
-
-class Station2GbfsStationInfo(StationInfo):
-    def __init__(self, station):
-        d = {
-            "station_id": station.uid,
-            "name": station.name,
-            "lat": station.latitude,
-            "lon": station.longitude,
-            "address": station.extra.address,
-            "post_code": station.extra.post_code,
-            "rental_methods": station.extra.payment,
-            # XXX Virtual
-            # "is_virtual_station": ...
-            "capacity": station.extra.slots,
-            "rental_uris": station.extra.rental_uris,
-        }
-
-        if station.extra.payment_terminal is not None:
-            m = set(d["rental_methods"] or [] + ["key", "creditcard"])
-            d["rental_methods"] = list(m)
-
-        super().__init__(**d)
-
-
-class Station2GbfsStationStatus(StationStatus):
-    @staticmethod
-    def vehicle_types(station):
-        counts = station.stat.vehicle_counts()
-
-        if not counts:
-            return [VehicleCounts.Default(count=station.stat.bikes)]
-
-        return [getattr(VehicleCounts, k)(count=v) for k, v in counts]
-
-    def __init__(self, station):
-        stat = station.stat.model_dump(exclude_none=True)
-        d = {
-            "station_id": station.uid,
-            "num_bikes_available": station.bikes,
-            "vehicle_types_available": self.vehicle_types(station),
-            "num_docks_available": station.free,
-            # pybikes ignores non installed stations
-            "is_installed": True,
-            # XXX status ? and if not available, default to true
-            "is_renting": stat.get("online", True),
-            "is_returning": stat.get("online", True),
-            "last_reported": station.timestamp,
-        }
-        super().__init__(**d)
-
-
-class Vehicle2GbfsBikeStatus(BikeStatus):
-    @staticmethod
-    def type_id(vehicle):
-        vt = getattr(Vehicles, vehicle.kind, Vehicles.default)
-        return vt.vehicle_type_id
-
-    def __init__(self, vehicle):
-        stat = vehicle.stat.model_dump(exclude_none=True)
-        d = {
-            "lat": vehicle.latitude,
-            "lon": vehicle.longitude,
-            "bike_id": vehicle.uid,
-            "vehicle_type_id": self.type_id(vehicle),
-            "is_reserved": False,
-            "is_disabled": not stat.get("online", True),
-            "last_reported": vehicle.stat.timestamp,
-        }
-        super().__init__(**d)
+# projections of canonical stations and vehicles (see gbfs.canonical), whose
+# values are final, so models are built without validation
+
+
+def timestamp(dt):
+    return int(dt.timestamp())
+
+
+def station_info(station):
+    return StationInfo.model_construct(
+        station_id=station.uid,
+        name=station.name,
+        lat=station.latitude,
+        lon=station.longitude,
+        address=station.address,
+        post_code=station.post_code,
+        rental_methods=station.rental_methods,
+        # XXX Virtual
+        # "is_virtual_station": ...
+        capacity=station.capacity,
+        rental_uris=station.rental_uris,
+    )
+
+
+def vehicle_types_available(station):
+    return [
+        VehicleTypeCount.model_construct(vehicle_type_id=t, count=n)
+        for t, n in station.vehicle_types
+    ]
+
+
+def station_status(station):
+    return StationStatus.model_construct(
+        station_id=station.uid,
+        num_bikes_available=station.bikes,
+        vehicle_types_available=vehicle_types_available(station),
+        num_docks_available=station.free,
+        # pybikes ignores non installed stations
+        is_installed=True,
+        is_renting=station.online,
+        is_returning=station.online,
+        last_reported=timestamp(station.last_reported),
+    )
+
+
+def bike_status(vehicle):
+    return BikeStatus.model_construct(
+        bike_id=vehicle.uid,
+        vehicle_type_id=vehicle.vehicle_type_id,
+        lat=vehicle.latitude,
+        lon=vehicle.longitude,
+        is_reserved=False,
+        is_disabled=not vehicle.online,
+        last_reported=timestamp(vehicle.last_reported),
+    )
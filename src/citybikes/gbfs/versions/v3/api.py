@@ -1,12 +1,20 @@
+import time
 from functools import partial
 
 from starlette.routing import Mount
+from starlette.exceptions import HTTPException
 
+from citybikes.db import geo
+from citybikes.gbfs import canonical
 from citybikes.gbfs.types import GBFS3
-from citybikes.gbfs.api import Gbfs as BaseGbfs
+from citybikes.gbfs.api import Gbfs as BaseGbfs, parse_time
 
 
 LANGUAGES = ["en"]
+# most stations returned by nearby.json
+MAX_NEARBY = 100
+# longest period of history.json, that defaults to the last day
+MAX_HISTORY_DAYS = 7
 
 
 class Gbfs(BaseGbfs):
@@ -21,11 +29,22 @@ class Gbfs(BaseGbfs):
             self.route("/vehicle_status.json", self.vehicle_status),
             self.route("/station_information.json", self.station_information),
             self.route("/station_status.json", self.station_status),
+            # lookups are cheap, and would evict the feeds of the network
+            self.route(
+                "/station_status/{station_id}.json", self.station, cached=False
+            ),
+            self.stream("/station_status.sse", self.push),
+            self.route("/stats.json", self.system_stats),
+            # its default period moves with the time of the request
+            self.route("/history.json", self.history, cached=False),
         ]
 
         return [
+            self.stream("/station_status.ndjson", self.firehose),
             Mount("/{uid}", routes=network_routes),
             self.route("/manifest.json", self.manifest),
+            self.route("/nearby.json", self.nearby),
+            self.route("/stats.json", self.stats),
         ]
 
     async def gbfs(self, request, db, uid):
@@ -97,20 +116,50 @@ class Gbfs(BaseGbfs):
         return GBFS3.VehicleTypes(vehicle_types=vehicle_types)
 
     async def vehicle_status(self, request, db, uid):
-        vehicles = await db.get_vehicles(uid)
-        vehicles = map(lambda v: GBFS3.Vehicle2GbfsVehicleStatus(v), vehicles)
+        bbox = self.bbox(request)
+        if (since := self.since(request)) is not None:
+            cursor, full, vehicles, removed = await db.get_changes(
+                uid, since, "vehicle"
+            )
+            vehicles = map(canonical.vehicle, self.clip(vehicles, bbox))
+        else:
+            vehicles = await self.vehicles(request, db, uid, bbox)
+        vehicles = map(GBFS3.vehicle_status, vehicles)
+
+        if since is not None:
+            return GBFS3.VehicleStatusDelta(
+                vehicles=list(vehicles), removed=removed, cursor=cursor, full=full
+            )
         return GBFS3.VehicleStatusR(vehicles=list(vehicles))
 
     async def station_information(self, request, db, uid):
-        stations = await db.get_stations(uid)
-        stations = map(lambda s: GBFS3.Station2GbfsStationInfo(s), stations)
+        stations = await self.stations(request, db, uid, self.bbox(request))
+        stations = map(GBFS3.station_info, stations)
         return GBFS3.StationInfoR(stations=list(stations))
 
-    async def station_status(self, request, db, uid):
-        stations = await db.get_stations(uid)
-        stations = map(lambda s: GBFS3.Station2GbfsStationStatus(s), stations)
+    def status(self, stations):
+        stations = map(GBFS3.station_status, stations)
         return GBFS3.StationStatusR(stations=list(stations))
 
+    async def station_status(self, request, db, uid):
+        bbox = self.bbox(request)
+        if (since := self.since(request)) is not None:
+            cursor, full, stations, removed = await db.get_changes(uid, since)
+            stations = map(canonical.station, self.clip(stations, bbox))
+            return GBFS3.StationStatusDelta(
+                stations=self.status(stations).stations,
+                removed=removed,
+                cursor=cursor,
+                full=full,
+            )
+
+        if (ids := self.station_ids(request)) is not None:
+            stations = self.clip(await db.get_stations_by_id(uid, ids), bbox)
+            stations = map(canonical.station, stations)
+        else:
+            stations = await self.stations(request, db, uid, bbox)
+        return self.status(stations)
+
     async def manifest(self, request, db):
         tags = await db.get_tags()
 
@@ -131,3 +180,71 @@ class Gbfs(BaseGbfs):
         ]
 
         return GBFS3.Manifest(datasets=datasets)
+
+    async def nearby(self, request, db):
+        params = request.query_params
+        try:
+            lat, lon = float(params["lat"]), float(params["lon"])
+            k = int(params.get("k", 10))
+        except (KeyError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid lat, lon or k")
+        if not geo.valid(lat, lon) or k < 1:
+            raise HTTPException(status_code=400, detail="Invalid lat, lon or k")
+        k = min(k, MAX_NEARBY)
+        available = params.get("available", "0") == "1"
+
+        hits = await db.nearby(lat, lon, k, available)
+        stations = [GBFS3.nearby(t, canonical.station(s), m) for t, s, m in hits]
+        return GBFS3.NearbyR(stations=stations)
+
+    def period(self, request):
+        """the ?start=&end= (timestamps or epochs) of history, as epochs"""
+        params = request.query_params
+        try:
+            end = params.get("end")
+            end = int(parse_time(end).timestamp()) if end else int(time.time())
+            start = params.get("start")
+            start = int(parse_time(start).timestamp()) if start else end - 86400
+        except (ValueError, OverflowError, OSError):
+            raise HTTPException(status_code=400, detail="Invalid start or end")
+        if not 0 <= end - start <= MAX_HISTORY_DAYS * 86400:
+            raise HTTPException(status_code=400, detail="Invalid start or end")
+        return start, end
+
+    async def history(self, request, db, uid):
+        start, end = self.period(request)
+        station_id = request.query_params.get("station_id")
+        series = await db.get_history(uid, station_id, start, end)
+        return GBFS3.HistoryR(
+            stations=[
+                GBFS3.StationHistory.model_construct(
+                    station_id=sid, samples=list(map(GBFS3.history_sample, samples))
+                )
+                for sid, samples in series.items()
+                if samples
+            ]
+        )
+
+    async def system_stats(self, request, db, uid):
+        rows = await db.get_stats(uid)
+        if not rows:
+            raise HTTPException(status_code=404)
+        return GBFS3.stats(rows[0], GBFS3.SystemStats, system_id=uid)
+
+    async def stats(self, request, db):
+        rows = await db.get_stats()
+        totals = {}
+        for row in rows:
+            for k, v in row.items():
+                if k != "tag" and v is not None:
+                    totals[k] = totals.get(k, 0) + v
+        for k in ["stations", "online", "bikes", "docks", "vehicles"]:
+            totals.setdefault(k, 0)
+
+        return GBFS3.StatsR(
+            num_systems=len(rows),
+            totals=GBFS3.stats(totals),
+            systems=[
+                GBFS3.stats(r, GBFS3.SystemStats, system_id=r["tag"]) for r in rows
+            ],
+        )
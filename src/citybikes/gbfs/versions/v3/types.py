@@ -1,5 +1,7 @@
-from datetime import datetime
+from datetime import datetime, timezone
 
+from citybikes.db import history
+from citybikes.gbfs import canonical
 from citybikes.gbfs.constants import Vehicles as BVehicles
 from typing import Annotated, Optional, Union
 
@@ -75,6 +77,14 @@ class VehicleStatusR(BaseModel):
     vehicles: list[VehicleStatus]
 
 
+# with ?since=<cursor>, only vehicles changed after cursor and ids removed
+class VehicleStatusDelta(BaseModel):
+    vehicles: list[VehicleStatus]
+    removed: list[str]
+    cursor: int
+    full: bool
+
+
 class SystemInfo(BaseModel):
     system_id: str
     languages: list[str]
@@ -114,6 +124,57 @@ class StationStatus(BaseModel):
     last_reported: Timestamp
 
 
+# not GBFS, stations closest to a point across networks
+class NearbyStation(StationStatus):
+    system_id: str
+    name: i18nL
+    lat: Float
+    lon: Float
+    distance_meters: float
+
+
+class NearbyR(BaseModel):
+    stations: list[NearbyStation]
+
+
+# not GBFS, totals of a network, or of every network
+class Stats(BaseModel):
+    num_stations: int
+    num_stations_online: int
+    num_stations_offline: int
+    num_vehicles_available: int
+    num_docks_available: int
+    vehicle_types_available: list[VehicleTypeCount]
+    num_free_vehicles: int
+
+
+class SystemStats(Stats):
+    system_id: str
+
+
+class StatsR(BaseModel):
+    num_systems: int
+    totals: Stats
+    systems: list[SystemStats]
+
+
+# not GBFS, availability of stations over time, see db.history
+class HistorySample(BaseModel):
+    time: Timestamp
+    num_vehicles_available: int
+    num_docks_available: int
+    vehicle_types_available: list[VehicleTypeCount]
+
+
+class StationHistory(BaseModel):
+    station_id: str
+    samples: list[HistorySample]
+
+
+class HistoryR(BaseModel):
+    stations: list[StationHistory]
+
+
 class StationInfoR(BaseModel):
     stations: list[StationInfo]
 
@@ -122,6 +183,14 @@ class StationStatusR(BaseModel):
     stations: list[StationStatus]
 
 
+# with ?since=<cursor>, only stations changed after cursor and ids removed
+class StationStatusDelta(BaseModel):
+    stations: list[StationStatus]
+    removed: list[str]
+    cursor: int
+    full: bool
+
+
 class Version(BaseModel):
     version: str
     url: str
@@ -157,6 +226,12 @@ class Response(BaseModel):
         StationInfoR,
         StationStatusR,
         Manifest,
+        StationStatusDelta,
+        VehicleStatusDelta,
+        NearbyR,
+        SystemStats,
+        StatsR,
+        HistoryR,
     ]
 
 
@@ -183,99 +258,100 @@ class Vehicles:
     scooter = scooter
 
 
-class VehicleCounts:
-    # XXX I hate this
-
-    class Normal(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.normal_bike.vehicle_type_id
-
-    class NormalKid(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.normal_kid_bike.vehicle_type_id
-
-    class ElectricBike(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.electric_bike.vehicle_type_id
-
-    class CargoBike(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.cargo_bike.vehicle_type_id
-
-    class ElectricCargoBike(VehicleTypeCount):
-        vehicle_type_id: str = Vehicles.electric_cargo_bike.vehicle_type_id
-
-    Default = Normal
-
-    # aliases that map to Citybikes fields
-    ebikes = ElectricBike
-    normal_bikes = Normal
-    cargo = CargoBike
-    ecargo = ElectricCargoBike
-    kid_bikes = NormalKid
-
-
-class Station2GbfsStationInfo(StationInfo):
-    def __init__(self, station):
-        d = {
-            "station_id": station.uid,
-            "name": station.name,
-            "lat": station.latitude,
-            "lon": station.longitude,
-            "address": station.extra.address,
-            "post_code": station.extra.post_code,
-            "rental_methods": station.extra.payment,
-            # XXX Virtual
-            # "is_virtual_station": ...
-            "capacity": station.extra.slots,
-            "rental_uris": station.extra.rental_uris,
-        }
-
-        if station.extra.payment_terminal is not None:
-            m = set(d["rental_methods"] or [] + ["key", "creditcard"])
-            d["rental_methods"] = list(m)
-
-        super().__init__(**d)
-
-
-class Station2GbfsStationStatus(StationStatus):
-    @staticmethod
-    def vehicle_types(station):
-        counts = station.stat.vehicle_counts()
-
-        if not counts:
-            return [VehicleCounts.Default(count=station.stat.bikes)]
-
-        return [getattr(VehicleCounts, k)(count=v) for k, v in counts]
-
-    def __init__(self, station):
-        stat = station.stat.model_dump(exclude_none=True)
-        d = {
-            "station_id": station.uid,
-            "num_vehicles_available": station.bikes,
-            "vehicle_types_available": self.vehicle_types(station),
-            "num_docks_available": station.free,
-            # pybikes ignores non installed stations
-            "is_installed": True,
-            # XXX status ? and if not available, default to true
-            "is_renting": stat.get("online", True),
-            "is_returning": stat.get("online", True),
-            "last_reported": station.timestamp,
-        }
-        super().__init__(**d)
-
-
-class Vehicle2GbfsVehicleStatus(VehicleStatus):
-    @staticmethod
-    def type_id(vehicle):
-        vt = getattr(Vehicles, vehicle.kind, Vehicles.default)
-        return vt.vehicle_type_id
-
-    def __init__(self, vehicle):
-        stat = vehicle.stat.model_dump(exclude_none=True)
-        d = {
-            "lat": vehicle.latitude,
-            "lon": vehicle.longitude,
-            "vehicle_id": vehicle.uid,
-            "vehicle_type_id": self.type_id(vehicle),
-            "is_reserved": False,
-            "is_disabled": not stat.get("online", True),
-            "last_reported": vehicle.stat.timestamp,
-        }
-        super().__init__(**d)
+# projections of canonical stations and vehicles (see gbfs.canonical), whose
+# values are final, so models are built without validation
+
+
+def station_info(station):
+    return StationInfo.model_construct(
+        station_id=station.uid,
+        name=toi18n(station.name),
+        lat=station.latitude,
+        lon=station.longitude,
+        address=station.address,
+        post_code=station.post_code,
+        rental_methods=station.rental_methods,
+        # XXX Virtual
+        # "is_virtual_station": ...
+        capacity=station.capacity,
+        rental_uris=station.rental_uris,
+    )
+
+
+def vehicle_types_available(station):
+    return [
+        VehicleTypeCount.model_construct(vehicle_type_id=t, count=n)
+        for t, n in station.vehicle_types
+    ]
+
+
+def station_status(station):
+    return StationStatus.model_construct(
+        station_id=station.uid,
+        num_vehicles_available=station.bikes,
+        vehicle_types_available=vehicle_types_available(station),
+        num_docks_available=station.free,
+        # pybikes ignores non installed stations
+        is_installed=True,
+        is_renting=station.online,
+        is_returning=station.online,
+        last_reported=station.last_reported.isoformat(),
+    )
+
+
+def vehicle_status(vehicle):
+    return VehicleStatus.model_construct(
+        vehicle_id=vehicle.uid,
+        vehicle_type_id=vehicle.vehicle_type_id,
+        lat=vehicle.latitude,
+        lon=vehicle.longitude,
+        is_reserved=False,
+        is_disabled=not vehicle.online,
+        last_reported=vehicle.last_reported.isoformat(),
+    )
+
+
+def nearby(tag, station, meters):
+    return NearbyStation.model_construct(
+        **dict(station_status(station)),
+        system_id=tag,
+        name=toi18n(station.name),
+        lat=station.latitude,
+        lon=station.longitude,
+        distance_meters=round(meters, 1),
+    )
+
+
+def stats(row, cls=Stats, **kwargs):
+    """Stats out of a network_stats row, or the sum of several"""
+    return cls.model_construct(
+        num_stations=row["stations"],
+        num_stations_online=row["online"],
+        num_stations_offline=row["stations"] - row["online"],
+        num_vehicles_available=row["bikes"],
+        num_docks_available=row["docks"],
+        vehicle_types_available=[
+            VehicleTypeCount.model_construct(vehicle_type_id=t, count=row[k])
+            for k, t in canonical.VEHICLE_TYPES.items()
+            if row.get(k) is not None
+        ],
+        num_free_vehicles=row["vehicles"],
+        **kwargs,
+    )
+
+
+def history_sample(sample):
+    """HistorySample out of a db.history.Sample"""
+    return HistorySample.model_construct(
+        time=datetime.fromtimestamp(sample.time, timezone.utc).isoformat(),
+        num_vehicles_available=sample.bikes or 0,
+        num_docks_available=sample.free or 0,
+        vehicle_types_available=[
+            VehicleTypeCount.model_construct(
+                vehicle_type_id=canonical.VEHICLE_TYPES[k], count=getattr(sample, k)
+            )
+            # counts after bikes and free
+            for k in history.FIELDS[2:]
+            if getattr(sample, k) is not None
+        ],
+    )
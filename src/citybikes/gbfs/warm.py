@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+from citybikes import metrics
+
+log = logging.getLogger("warm")
+
+WARMED = metrics.counter(
+    "gbfs_cache_warmed_total", "Feeds rendered into the cache ahead of requests"
+)
+PENDING = metrics.gauge("gbfs_cache_warm_pending", "Feeds waiting to be warmed")
+
+
+class Warmer:
+    """Renders the most requested feeds into the cache as soon as their
+    network changes, instead of on the next request.
+
+    Feeds are ranked by request count, halved every decay seconds so the
+    ranking follows recent traffic. Only the top ones are warmed, hottest
+    first, and warming sleeps in between so it takes at most budget of the
+    event loop. The ranking is saved to path, to prime the cache on startup.
+    """
+
+    # XXX keys include the host, cap them so clients can not grow these
+    max_keys = 4096
+
+    def __init__(self, app, watcher, top=64, budget=0.25, decay=300, path=None):
+        self.app = app
+        self.top = top
+        self.budget = budget
+        self.decay = decay
+        self.path = path
+        # key (url) -> [uid, count]
+        self.hits = {}
+        self.pending = set()
+        self.wake = asyncio.Event()
+        self.decayed = time.monotonic()
+        watcher.subscribe(self.changed)
+
+    def hit(self, uid, key):
+        """a request of key, a cached feed. Uncached ones (ie: station
+        lookups) are never warmed, and not counted"""
+        entry = self.hits.get(key)
+        if entry is None:
+            if len(self.hits) >= self.max_keys:
+                return
+            entry = self.hits[key] = [uid, 0]
+        entry[1] += 1
+
+    def hottest(self):
+        ranked = sorted(self.hits.items(), key=lambda kv: kv[1][1], reverse=True)
+        return ranked[: self.top]
+
+    def changed(self, tags):
+        # feeds not tied to a network are dropped on any change
+        tags = tags | {None}
+        self.warm(key for key, (uid, _) in self.hottest() if uid in tags)
+
+    def warm(self, keys):
+        self.pending.update(keys)
+        PENDING.set(len(self.pending))
+        if self.pending:
+            self.wake.set()
+
+    def age(self):
+        now = time.monotonic()
+        if now - self.decayed < self.decay:
+            return
+        self.decayed = now
+        for key, entry in list(self.hits.items()):
+            entry[1] /= 2
+            if entry[1] < 1:
+                del self.hits[key]
+        self.save()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                hot = json.load(f)
+        except (OSError, ValueError):
+            log.exception("Failed loading hot feeds from %s", self.path)
+            return
+        for key, uid, count in hot[: self.max_keys]:
+            self.hits[key] = [uid, count]
+        self.warm(key for key, _ in self.hottest())
+
+    def save(self):
+        if not self.path:
+            return
+        hot = [[key, uid, count] for key, (uid, count) in self.hottest()]
+        # XXX with several workers, the last one to save wins
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(hot, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            log.exception("Failed saving hot feeds to %s", self.path)
+
+    async def render(self, key):
+        from citybikes.gbfs.render import fetch
+
+        # through the app, so it is cached as any other render of key
+        status, _ = await fetch(self.app, key, {"warming": True})
+        if status == 200:
+            WARMED.inc()
+
+    async def run(self):
+        while True:
+            self.age()
+            if not self.pending:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), self.decay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            key = max(self.pending, key=lambda k: self.hits.get(k, [None, 0])[1])
+            self.pending.discard(key)
+            PENDING.set(len(self.pending))
+
+            start = time.perf_counter()
+            try:
+                await self.render(key)
+            except Exception:
+                log.exception("Failed warming %s", key)
+            elapsed = time.perf_counter() - start
+            # rendering blocks the loop, rest long enough to keep in budget
+            await asyncio.sleep(elapsed * (1 - self.budget) / self.budget)
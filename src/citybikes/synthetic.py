@@ -0,0 +1,103 @@
+import random
+import hashlib
+from datetime import datetime, timezone
+
+# Synthetic pybikes networks, shaped like the messages hyper publishes, to
+# seed databases of arbitrary size. Mixes mimic the extra fields of real
+# pybikes systems
+MIXES = {
+    # bikes and free only
+    "plain": [],
+    "ebikes": ["normal_bikes", "ebikes"],
+    # pybikes systems that report ebikes but not normal_bikes
+    "ebikes_no_normal": ["ebikes"],
+    "cargo": ["normal_bikes", "cargo", "ecargo"],
+    "kids": ["normal_bikes", "kid_bikes"],
+}
+
+KINDS = ["bike", "ebike", "scooter"]
+
+
+def uid(*parts):
+    return hashlib.md5(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def station(rng, tag, n, lat, lng, mix, timestamp):
+    slots = rng.randint(10, 40)
+    bikes = rng.randint(0, slots)
+    extra = {
+        "uid": str(n),
+        "slots": slots,
+        "address": f"Synthetic street {n}",
+        "online": rng.random() > 0.05,
+    }
+    if rng.random() > 0.5:
+        extra["payment"] = ["key", "creditcard"]
+        extra["payment-terminal"] = True
+
+    left = bikes
+    for k in MIXES[mix]:
+        extra[k] = rng.randint(0, left)
+        left -= extra[k]
+
+    return {
+        "id": uid(tag, "station", n),
+        "name": f"Station {n}",
+        "latitude": lat + rng.uniform(-0.05, 0.05),
+        "longitude": lng + rng.uniform(-0.05, 0.05),
+        "bikes": bikes,
+        "free": slots - bikes,
+        "timestamp": timestamp,
+        "extra": extra,
+    }
+
+
+def vehicle(rng, tag, n, lat, lng, timestamp):
+    extra = {"online": rng.random() > 0.05}
+    kind = rng.choice(KINDS)
+    if kind != "bike":
+        extra["battery"] = round(rng.uniform(0, 100), 1)
+    return {
+        "id": uid(tag, "vehicle", n),
+        "latitude": lat + rng.uniform(-0.05, 0.05),
+        "longitude": lng + rng.uniform(-0.05, 0.05),
+        "kind": kind,
+        "timestamp": timestamp,
+        "extra": extra,
+    }
+
+
+def network(tag, stations=100, vehicles=0, mix="plain", seed=None):
+    """a synthetic network message, deterministic for a given seed"""
+    rng = random.Random(seed if seed is not None else tag)
+    lat, lng = rng.uniform(-60, 60), rng.uniform(-170, 170)
+    timestamp = datetime.now(timezone.utc).isoformat()
+
+    return {
+        "tag": tag,
+        "meta": {
+            "name": f"Synthetic {tag}",
+            "city": "Synthetic",
+            "country": "XX",
+            "latitude": lat,
+            "longitude": lng,
+            "company": ["CityBikes"],
+            "license": {"name": "CC0", "url": "https://example.com/license"},
+        },
+        "stations": [
+            station(rng, tag, n, lat, lng, mix, timestamp) for n in range(stations)
+        ],
+        "vehicles": [
+            vehicle(rng, tag, n, lat, lng, timestamp) for n in range(vehicles)
+        ],
+    }
+
+
+def networks(sizes, mixes=None, vehicles=None):
+    """one network per size and mix, tagged synth-<size>-<mix>. Networks
+    get as many vehicles as stations unless told otherwise"""
+    for size in sizes:
+        for mix in mixes or MIXES:
+            tag = f"synth-{size}-{mix}".replace("_", "-")
+            n_vehicles = size if vehicles is None else vehicles
+            yield network(tag, stations=size, vehicles=n_vehicles, mix=mix)
@@ -1,6 +1,7 @@
 import os
 import asyncio
 import json
+import sqlite3
 from contextlib import asynccontextmanager
 from importlib import resources
 from unittest import mock
@@ -10,9 +11,10 @@ import pytest_asyncio
 from starlette.schemas import SchemaGenerator
 from starlette.testclient import TestClient
 
-from citybikes.db import CBD
+from citybikes.db import CBD, migrate as migrate_sync
 from citybikes.db.asyncio import get_session, migrate
 from citybikes.gbfs.app import app
+from tests import fixtures
 
 
 DB_URI = os.getenv("TEST_DB_URI", ":memory:")
@@ -20,14 +22,31 @@ DB_URI = os.getenv("TEST_DB_URI", ":memory:")
 
 @pytest_asyncio.fixture(scope="session")
 async def db():
-    test_data = resources.files("tests") / "fixtures/test_data.sql"
     async with get_session(DB_URI) as db:
         assert await migrate(db)
         if DB_URI == ":memory:":
-            await db.executescript(test_data.read_text())
+            await db.executescript(fixtures.sql())
         yield db
 
 
+@pytest.fixture(scope="session")
+def source():
+    """the test data on a sync connection, to rebuild messages from"""
+    con = sqlite3.connect(":memory:")
+    con.row_factory = lambda *a: dict(sqlite3.Row(*a))
+    assert migrate_sync(con)
+    con.executescript(fixtures.sql())
+    yield con
+    con.close()
+
+
+@pytest.fixture(scope="session")
+def messages(source):
+    """hyper messages of every network of the test data, by tag"""
+    tags = [r["tag"] for r in source.execute("SELECT tag FROM networks ORDER BY tag")]
+    return [fixtures.as_message(source, tag) for tag in tags]
+
+
 @pytest_asyncio.fixture(scope="function", autouse=True)
 async def rollback_db(db):
     yield
@@ -47,7 +66,11 @@ def client(db):
     async def get_session(*args, **kwargs):
         yield db
 
-    with mock.patch("citybikes.gbfs.app.get_session", get_session):
+    # read only sessions (ie: streams) are opened by citybikes.db.shards
+    with (
+        mock.patch("citybikes.gbfs.app.get_session", get_session),
+        mock.patch("citybikes.db.shards.get_session", get_session),
+    ):
         from citybikes.gbfs.app import app
 
         with TestClient(app) as client:
@@ -78,11 +101,10 @@ def client_app(client):
 
 async def get_urls(app):
     # XXX ideally we use the db and tags fixture here
-    test_data = resources.files("tests") / "fixtures/test_data.sql"
     async with get_session(DB_URI) as db:
         assert await migrate(db)
         if DB_URI == ":memory:":
-            await db.executescript(test_data.read_text())
+            await db.executescript(fixtures.sql())
         tags = await CBD(db).get_tags()
 
     schema = SchemaGenerator({})
@@ -93,6 +115,17 @@ async def get_urls(app):
     # urls to exclude in testing
     exclude = [
         "/",
+        "/metrics",
+        "/2/station_status.ndjson",
+        "/3/station_status.ndjson",
+        "/2/{uid}/station_status.sse",
+        "/3/{uid}/station_status.sse",
+        "/2/{uid}/station_status/{station_id}.json",
+        "/3/{uid}/station_status/{station_id}.json",
+        "/3/nearby.json",
+        "/3/stats.json",
+        "/3/{uid}/stats.json",
+        "/3/{uid}/history.json",
     ]
 
     for url in paths:
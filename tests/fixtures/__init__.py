@@ -0,0 +1,42 @@
+import json
+from importlib import resources
+
+
+def sql():
+    """test_data.sql, followed by the network_stats backfill"""
+    # XXX network_stats are not kept in test_data.sql, they would drift from
+    # its stations. They are backfilled as migrations/0007 does
+    test_data = resources.files("tests") / "fixtures/test_data.sql"
+    backfill = resources.files("citybikes.db") / "network_stats.sql"
+    return test_data.read_text() + backfill.read_text()
+
+
+def as_message(con, tag):
+    """rebuild a hyper message out of a stored network"""
+    network = con.execute("SELECT * FROM networks WHERE tag = ?", (tag,)).fetchone()
+    stations = con.execute("SELECT * FROM stations WHERE network_tag = ?", (tag,))
+    vehicles = con.execute("SELECT * FROM vehicles WHERE network_tag = ?", (tag,))
+    return {
+        "tag": tag,
+        "meta": json.loads(network["meta"]),
+        "stations": [
+            {
+                "id": s["hash"],
+                "name": s["name"],
+                "latitude": s["latitude"],
+                "longitude": s["longitude"],
+                **json.loads(s["stat"]),
+            }
+            for s in stations.fetchall()
+        ],
+        "vehicles": [
+            {
+                "id": v["hash"],
+                "latitude": v["latitude"],
+                "longitude": v["longitude"],
+                "kind": v["kind"],
+                **json.loads(v["stat"]),
+            }
+            for v in vehicles.fetchall()
+        ],
+    }
@@ -0,0 +1,85 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from starlette.exceptions import HTTPException
+
+from citybikes.gbfs.admission import Admission, SHED
+
+
+def request(host, headers=None):
+    return SimpleNamespace(client=SimpleNamespace(host=host), headers=headers or {})
+
+
+def test_admission_sheds_low_priority_first():
+    admission = Admission(max_wait=1)
+    admission.in_flight, admission.service_time = 10, 0.05
+
+    with admission.admit("station_status"):
+        pass
+    admission.in_flight = 10
+    shed = SHED.values.get(("overload", "system_information"), 0)
+    with pytest.raises(HTTPException) as e:
+        with admission.admit("system_information"):
+            pass
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "1"}
+    assert SHED.values[("overload", "system_information")] == shed + 1
+
+    admission.in_flight = 50
+    with pytest.raises(HTTPException):
+        with admission.admit("station_status"):
+            pass
+
+
+def test_admission_service_time():
+    admission = Admission(max_wait=0)
+    admission.alpha = 1
+    with admission.admit("station_status"):
+        time.sleep(0.01)
+    assert 0.01 <= admission.service_time < 0.05
+    assert admission.in_flight == 0
+
+
+def test_admission_rate_limit():
+    admission = Admission(rate=1, burst=2)
+    admission.limit(request("1.2.3.4"), "gbfs")
+    admission.limit(request("1.2.3.4"), "gbfs")
+    with pytest.raises(HTTPException) as e:
+        admission.limit(request("1.2.3.4"), "gbfs")
+    assert e.value.status_code == 429
+    assert e.value.headers == {"Retry-After": "1"}
+    # buckets are per client
+    admission.limit(request("4.3.2.1"), "gbfs")
+    # in-process fetches are not limited
+    for _ in range(3):
+        admission.limit(SimpleNamespace(client=None), "gbfs")
+
+
+def test_admission_rate_limit_header():
+    admission = Admission(rate=1, burst=1, header="x-forwarded-for")
+    # the address of the proxy, for every client
+    admission.limit(request("10.0.0.1", {"x-forwarded-for": "1.2.3.4"}), "gbfs")
+    admission.limit(request("10.0.0.1", {"x-forwarded-for": "4.3.2.1"}), "gbfs")
+    # the client can not pick its own address
+    with pytest.raises(HTTPException):
+        admission.limit(
+            request("10.0.0.1", {"x-forwarded-for": "5.5.5.5, 1.2.3.4"}), "gbfs"
+        )
+    # without the header, by address
+    admission.limit(request("10.0.0.1"), "gbfs")
+
+
+def test_admission_in_app(client, tags):
+    url = f"/3/{tags[0]}/station_status.json"
+    assert client.get(url).status_code == 200
+
+    # off by default (MAX_RENDER_WAIT_MS)
+    assert client.app.admission is None
+    admission = client.app.admission = Admission(max_wait=2)
+    admission.in_flight, admission.service_time = 1, 60
+    response = client.get(f"/3/{tags[0]}/system_information.json")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "60"
+    # cache hits are not refused
+    assert client.get(url).status_code == 200
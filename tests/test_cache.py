@@ -0,0 +1,172 @@
+import pytest
+
+from citybikes.db import CBD
+from citybikes.gbfs.cache import FeedCache, NetworkCache, Watcher
+
+
+class FakeDB:
+    def __init__(self):
+        self.version = 1
+        self.updated = {"foo": 1, "bar": 1}
+        self.calls = 0
+
+    async def data_version(self):
+        self.calls += 1
+        return self.version
+
+    async def get_versions(self):
+        return dict(self.updated)
+
+
+@pytest.mark.asyncio
+async def test_watcher_invalidates_changed_networks():
+    db = FakeDB()
+    cache = FeedCache()
+    watcher = Watcher(db, interval=0)
+    watcher.subscribe(cache.invalidate)
+    await watcher.poll()
+
+    cache.set("foo", "/3/foo/gbfs.json", b"foo")
+    cache.set("bar", "/3/bar/gbfs.json", b"bar")
+    cache.set(None, "/3/manifest.json", b"manifest")
+
+    # no writes, nothing changes
+    await watcher.poll()
+    assert cache.get("foo", "/3/foo/gbfs.json") == b"foo"
+
+    db.version += 1
+    db.updated["foo"] += 1
+    await watcher.poll()
+
+    assert cache.get("foo", "/3/foo/gbfs.json") is None
+    assert cache.get(None, "/3/manifest.json") is None
+    assert cache.get("bar", "/3/bar/gbfs.json") == b"bar"
+
+
+def test_stale_render_not_cached():
+    cache = FeedCache()
+    generation = cache.generation("foo")
+    manifest = cache.generation(None)
+    # a change lands while rendering
+    cache.invalidate({"foo"})
+    cache.set("foo", "/3/foo/gbfs.json", b"stale", generation)
+    cache.set(None, "/3/manifest.json", b"stale", manifest)
+    assert cache.get("foo", "/3/foo/gbfs.json") is None
+    assert cache.get(None, "/3/manifest.json") is None
+
+    cache.set("foo", "/3/foo/gbfs.json", b"fresh", cache.generation("foo"))
+    assert cache.get("foo", "/3/foo/gbfs.json") == b"fresh"
+
+
+@pytest.mark.asyncio
+async def test_watcher_polls_at_most_every_interval():
+    db = FakeDB()
+    watcher = Watcher(db, interval=60)
+    await watcher.poll()
+    await watcher.poll()
+    assert db.calls == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = FeedCache()
+    cache.set("foo", "status", b"status")
+    for i in range(cache.max_entries * 2):
+        cache.set("foo", f"other-{i}", b"other")
+        assert cache.get("foo", "status") == b"status"
+    assert len(cache.feeds["foo"]) == cache.max_entries
+    assert cache.get("foo", "other-0") is None
+
+
+def test_station_lookups_not_cached(client, tags):
+    url = f"/3/{tags[0]}/station_status.json"
+    feed = client.get(url)
+    for station in feed.json()["data"]["stations"][:3]:
+        client.get(f"/3/{tags[0]}/station_status/{station['station_id']}.json")
+    assert list(client.app.cache.feeds[tags[0]]) == [str(feed.url)]
+
+
+def test_cached_feeds(client):
+    url = "/3/manifest.json"
+    response = client.get(url)
+    assert client.app.cache.get(None, str(response.url)) == response.content
+    assert client.get(url).content == response.content
+
+
+class FakeNetworks:
+    def __init__(self):
+        self.networks = {"bar": "Bar", "foo": "Foo"}
+        self.queries = 0
+
+    async def get_tags(self):
+        self.queries += 1
+        return sorted(self.networks)
+
+    async def get_network(self, uid):
+        self.queries += 1
+        return self.networks.get(uid)
+
+
+@pytest.mark.asyncio
+async def test_network_cache():
+    db = FakeNetworks()
+    watcher = Watcher(FakeDB(), interval=0)
+    networks = NetworkCache(db, watcher)
+
+    assert await networks.get_tags() == ["bar", "foo"]
+    assert await networks.network_exists("foo")
+    assert await networks.get_network("foo") == "Foo"
+    assert await networks.get_network("foo") == "Foo"
+    # unknown networks do not need a query either
+    for _ in range(10):
+        assert not await networks.network_exists("foobar")
+        assert await networks.get_network("foobar") is None
+    assert db.queries == 2
+
+    db.networks["foo"] = "Foo 2"
+    db.networks["baz"] = "Baz"
+    watcher.listeners[0]({"foo", "baz"})
+    assert await networks.network_exists("baz")
+    assert await networks.get_network("foo") == "Foo 2"
+    assert db.queries == 4
+
+
+@pytest.mark.asyncio
+async def test_network_cache_drops_racing_loads():
+    db = FakeNetworks()
+    networks = NetworkCache(db, Watcher(FakeDB()))
+
+    get_tags = db.get_tags
+
+    async def racing_get_tags():
+        tags = await get_tags()
+        networks.invalidate({"baz"})
+        return tags
+
+    db.get_tags = racing_get_tags
+    assert await networks.get_tags() == ["bar", "foo"]
+    assert networks.tags is None
+
+
+def test_network_cache_in_app(client, tags):
+    db = client.app.db
+    assert isinstance(db, NetworkCache)
+    assert client.get("/2/foobar/gbfs.json").status_code == 404
+    assert client.get(f"/3/{tags[0]}/system_information.json").status_code == 200
+    assert list(db.tags) == tags
+    assert tags[0] in db.networks
+
+
+@pytest.mark.asyncio
+async def test_versions_change_within_a_second(db, tags):
+    # a second commit on the same second leaves networks.updated as is
+    cbd = CBD(db)
+    before = await cbd.get_versions()
+    await db.execute(
+        """
+        INSERT INTO network_seq (tag, seq) VALUES (?, 1)
+        ON CONFLICT (tag) DO UPDATE SET seq = seq + 1
+    """,
+        (tags[0],),
+    )
+    after = await cbd.get_versions()
+    assert {t for t in after if after[t] != before[t]} == {tags[0]}
@@ -0,0 +1,65 @@
+import pytest
+
+from citybikes.db import CBD
+from citybikes.gbfs import canonical
+from citybikes.gbfs.canonical import Snapshots
+from citybikes.gbfs.types import GBFS2, GBFS3
+
+
+class CountingDB:
+    def __init__(self, db):
+        self.db = db
+        self.loads = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.db, attr)
+
+    async def get_stations(self, uid, bbox=None):
+        self.loads += 1
+        return await self.db.get_stations(uid, bbox)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_per_version(db, tags):
+    cbd = CountingDB(CBD(db))
+    snapshots = Snapshots()
+
+    stations = await snapshots.stations(cbd, tags[0])
+    assert await snapshots.stations(cbd, tags[0]) is stations
+    assert cbd.loads == 1
+
+    # a new update of the network, with the same updated second
+    await db.execute(
+        "UPDATE networks SET stations = stations WHERE tag = ?", (tags[0],)
+    )
+    assert await snapshots.stations(cbd, tags[0]) is not stations
+    assert cbd.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_projections(db, tags):
+    station = (await CBD(db).get_stations(tags[0]))[0]
+    c = canonical.station(station)
+
+    v2, v3 = GBFS2.station_status(c), GBFS3.station_status(c)
+    assert v2.num_bikes_available == v3.num_vehicles_available == station.bikes
+    assert v2.model_dump()["vehicle_types_available"] == (
+        v3.model_dump()["vehicle_types_available"]
+    )
+    assert v2.last_reported == int(c.last_reported.timestamp())
+    assert v3.last_reported == c.last_reported.isoformat()
+
+    # projections are what the models would validate to
+    for model, projected in [
+        (GBFS2.StationStatus, v2),
+        (GBFS3.StationStatus, v3),
+        (GBFS2.StationInfo, GBFS2.station_info(c)),
+        (GBFS3.StationInfo, GBFS3.station_info(c)),
+    ]:
+        dump = projected.model_dump()
+        if "last_reported" in dump:
+            # validated from the source timestamp
+            source = {**dump, "last_reported": station.stat.timestamp}
+            assert model(**source).model_dump() == dump
+        else:
+            assert model(**dump).model_dump() == dump
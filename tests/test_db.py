@@ -0,0 +1,14 @@
+import pytest
+
+from citybikes.db.asyncio import get_session, migrate, check_version
+
+
+@pytest.mark.asyncio
+async def test_check_version(tmp_path):
+    uri = str(tmp_path / "test.db")
+    async with get_session(uri) as db:
+        assert not await check_version(db)
+        assert await migrate(db)
+
+    async with get_session(f"file:{uri}?mode=ro", uri=True) as db:
+        assert await check_version(db)
@@ -0,0 +1,94 @@
+import copy
+
+import pytest
+
+from citybikes import synthetic
+from citybikes.db import get_session as get_sync_session, migrate
+from citybikes.db.asyncio import CBD, get_session
+from citybikes.db.ingest import store_network
+from citybikes.db.memory import MemoryCBD
+
+
+def updates():
+    first = synthetic.network("delta", stations=20, vehicles=5, seed=0)
+
+    second = copy.deepcopy(first)
+    for e in second["stations"] + second["vehicles"]:
+        e["timestamp"] = "2030-01-01T00:00:00+00:00"
+    second["stations"][0]["bikes"] += 1
+    second["stations"][0]["free"] -= 1
+    removed = second["stations"].pop(1)
+    second["vehicles"][0]["latitude"] += 0.001
+
+    # nothing but timestamps
+    third = copy.deepcopy(second)
+    for e in third["stations"] + third["vehicles"]:
+        e["timestamp"] = "2030-01-01T00:01:00+00:00"
+
+    return first, second, third, removed
+
+
+async def check_changes(db, store):
+    first, second, third, removed = updates()
+
+    store(first)
+    cursor, full, stations, gone = await db.get_changes("delta", 0)
+    assert full and len(stations) == 20 and gone == []
+
+    assert await db.get_changes("delta", cursor) == (cursor, False, [], [])
+
+    store(second)
+    c, full, stations, gone = await db.get_changes("delta", cursor)
+    assert (c, full) == (cursor + 1, False)
+    assert [s.uid for s in stations] == [second["stations"][0]["id"]]
+    assert gone == [removed["id"]]
+
+    _, _, vehicles, gone = await db.get_changes("delta", cursor, "vehicle")
+    assert [v.uid for v in vehicles] == [second["vehicles"][0]["id"]]
+    assert gone == []
+
+    store(third)
+    assert await db.get_changes("delta", cursor + 1) == (cursor + 2, False, [], [])
+
+    # unknown cursors get everything back
+    c, full, stations, _ = await db.get_changes("delta", cursor + 10)
+    assert full and len(stations) == 19
+
+
+@pytest.mark.asyncio
+async def test_changes_sqlite(tmp_path):
+    path = str(tmp_path / "delta.db")
+    with get_sync_session(path) as con:
+        assert migrate(con)
+        async with get_session(path) as db:
+            await check_changes(CBD(db), lambda n: store_network(con, n))
+
+
+@pytest.mark.asyncio
+async def test_changes_memory():
+    db = MemoryCBD()
+    await check_changes(db, db.update)
+
+
+@pytest.mark.parametrize("version, feed", [
+    ("2", "station_status"),
+    ("2", "free_bike_status"),
+    ("3", "station_status"),
+    ("3", "vehicle_status"),
+])  # fmt: skip
+def test_delta_feeds(client, tags, version, feed):
+    for tag in tags:
+        url = f"/{version}/{tag}/{feed}.json"
+        data = client.get(url).json()["data"]
+        delta = client.get(url, params={"since": 0}).json()["data"]
+        assert delta["full"] and delta["removed"] == []
+        key = "stations" if "stations" in data else list(data)[0]
+        assert delta[key] == data[key]
+
+        delta = client.get(url, params={"since": delta["cursor"]}).json()["data"]
+        assert not delta["full"]
+
+
+def test_delta_invalid_since(client, tags):
+    response = client.get(f"/3/{tags[0]}/station_status.json?since=foo")
+    assert response.status_code == 400
@@ -0,0 +1,58 @@
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+
+from citybikes.db import CBD
+
+
+@pytest.mark.parametrize("version", ["2", "3"])
+def test_firehose_matches_feeds(client, tags, version):
+    response = client.get(f"/{version}/station_status.ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["system_id"] for line in lines] == sorted(
+        line["system_id"] for line in lines
+    )
+    assert set(line["system_id"] for line in lines) <= set(tags)
+
+    for line in lines:
+        tag = line.pop("system_id")
+        feed = client.get(f"/{version}/{tag}/station_status.json").json()
+        assert line == feed
+
+
+def test_firehose_since(client):
+    lines = client.get("/3/station_status.ndjson").text.splitlines()
+    newest = max(json.loads(line)["last_updated"] for line in lines)
+
+    response = client.get("/3/station_status.ndjson", params={"since": newest})
+    assert response.text == ""
+
+    response = client.get("/3/station_status.ndjson", params={"since": "2000-01-01"})
+    assert len(response.text.splitlines()) == len(lines)
+
+    response = client.get("/2/station_status.ndjson", params={"since": "946684800"})
+    assert len(response.text.splitlines()) == len(lines)
+
+
+def test_firehose_invalid_since(client):
+    response = client.get("/3/station_status.ndjson", params={"since": "yesterday"})
+    assert response.status_code == 400
+
+
+def test_firehose_own_connection(client, db, tags):
+    opened = []
+
+    @asynccontextmanager
+    async def streams():
+        opened.append("open")
+        yield CBD(db)
+        opened.append("closed")
+
+    client.app.streams = streams
+    response = client.get("/3/station_status.ndjson")
+    assert len(response.text.splitlines()) == len(tags)
+    assert opened == ["open", "closed"]
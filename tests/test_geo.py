@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+from citybikes.db import geo, migrate
+
+
+def test_distance():
+    assert geo.distance(0, 0, 1, 0) == pytest.approx(geo.DEGREE)
+    assert geo.distance(41.38, 2.17, 41.38, 2.17) == 0
+    # Barcelona - Madrid
+    assert geo.distance(41.3851, 2.1734, 40.4168, -3.7038) == pytest.approx(
+        505_000, rel=0.01
+    )
+
+
+def test_grid_index_is_used():
+    con = sqlite3.connect(":memory:")
+    con.row_factory = lambda *a: dict(sqlite3.Row(*a))
+    assert migrate(con)
+    for table in ["stations", "vehicles"]:
+        plan = con.execute(
+            f"""
+            EXPLAIN QUERY PLAN SELECT * FROM {table}
+            WHERE CAST((latitude + 90) * 100 AS INTEGER)
+                IN (SELECT value FROM json_each(?))
+              AND longitude BETWEEN ? AND ?
+              AND latitude BETWEEN ? AND ?
+              AND +network_tag = ?
+        """,
+            ["[1]", 0, 0, 0, 0, "foo"],
+        ).fetchall()
+        assert f"USING INDEX idx_{table}_grid" in plan[0]["detail"]
+
+
+def around_first(feed, key):
+    first = feed["data"][key][0]
+    lat, lon = first["lat"], first["lon"]
+    return (lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01)
+
+
+@pytest.mark.parametrize("path, key", [
+    ("/2/{tag}/station_information.json", "stations"),
+    ("/3/{tag}/station_information.json", "stations"),
+    ("/3/{tag}/vehicle_status.json", "vehicles"),
+    ("/2/{tag}/free_bike_status.json", "bikes"),
+])  # fmt: skip
+def test_bbox(client, tags, path, key):
+    for tag in tags:
+        feed = client.get(path.format(tag=tag)).json()
+        if not feed["data"][key]:
+            continue
+        bbox = around_first(feed, key)
+        expected = [
+            e for e in feed["data"][key] if geo.inside(bbox, e["lat"], e["lon"])
+        ]
+        params = {"bbox": ",".join(map(str, bbox))}
+        clipped = client.get(path.format(tag=tag), params=params).json()
+        assert clipped["data"][key] == expected
+        assert 0 < len(expected) <= len(feed["data"][key])
+
+
+def test_bbox_status(client, tags):
+    for version in ["2", "3"]:
+        info = client.get(f"/{version}/{tags[0]}/station_information.json").json()
+        bbox = around_first(info, "stations")
+        ids = [
+            s["station_id"]
+            for s in info["data"]["stations"]
+            if geo.inside(bbox, s["lat"], s["lon"])
+        ]
+        params = {"bbox": ",".join(map(str, bbox))}
+        url = f"/{version}/{tags[0]}/station_status.json"
+        status = client.get(url, params=params).json()
+        assert [s["station_id"] for s in status["data"]["stations"]] == ids
+
+
+@pytest.mark.parametrize(
+    "bbox",
+    [
+        "1,2,3",
+        "a,b,c,d",
+        "10,0,0,10",
+        "0,-100000,1,100000",
+        "-181,0,1,1",
+        "0,0,1,nan",
+        "0,0,inf,1",
+    ],
+)
+def test_invalid_bbox(client, tags, bbox):
+    url = f"/3/{tags[0]}/station_status.json"
+    assert client.get(url, params={"bbox": bbox}).status_code == 400
+
+
+def test_nearby(client, tags):
+    info = client.get(f"/3/{tags[0]}/station_information.json").json()
+    station = info["data"]["stations"][0]
+
+    params = {"lat": station["lat"], "lon": station["lon"], "k": 5}
+    response = client.get("/3/nearby.json", params=params)
+    assert response.status_code == 200
+    nearby = response.json()["data"]["stations"]
+
+    assert len(nearby) == 5
+    assert nearby[0]["station_id"] == station["station_id"]
+    assert nearby[0]["system_id"] == tags[0]
+    assert nearby[0]["distance_meters"] < 1
+    distances = [s["distance_meters"] for s in nearby]
+    assert distances == sorted(distances)
+
+
+def test_nearby_invalid(client):
+    assert client.get("/3/nearby.json").status_code == 400
+    assert client.get("/3/nearby.json?lat=1&lon=foo").status_code == 400
+    for params in ["lat=nan&lon=1", "lat=1&lon=inf", "lat=91&lon=1", "lat=1&lon=2&k=0"]:
+        assert client.get(f"/3/nearby.json?{params}").status_code == 400
+    # k is capped
+    response = client.get("/3/nearby.json?lat=1&lon=2&k=100000")
+    assert response.status_code == 200
+
+
+
+def test_bands():
+    assert geo.bands(41.3, 41.4) == (13130, 13140)
+    # clamped to the poles
+    assert geo.bands(-100000, 100000) == (0, 180 * geo.GRID)
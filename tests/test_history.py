@@ -0,0 +1,228 @@
+import copy
+import time
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from citybikes import synthetic
+from citybikes.db import get_session as get_sync_session, migrate
+from citybikes.db import history
+from citybikes.db.asyncio import CBD, get_session
+from citybikes.db.history import HOUR, History, pack, unpack
+from citybikes.db.ingest import store_network
+from citybikes.db.maintenance import connect
+from citybikes.gbfs.canonical import VEHICLE_TYPES
+
+
+def at(t):
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+def update(network, t, changes=()):
+    """network at epoch t, with bikes of station i set to n in changes"""
+    network = copy.deepcopy(network)
+    for s in network["stations"]:
+        s["timestamp"] = at(t)
+    for i, n in changes:
+        s = network["stations"][i]
+        s["free"] += s["bikes"] - n
+        s["bikes"] = n
+    return network
+
+
+@pytest.fixture
+def con(tmp_path):
+    with get_sync_session(str(tmp_path / "history.db")) as con:
+        assert migrate(con)
+        yield con
+
+
+def test_pack():
+    samples = [
+        (0, 3, 10, -1, -1, -1, -1, -1),
+        (60, 2, 11, -1, -1, -1, -1, -1),
+        (61, 2, 11, 0, 2, -1, -1, -1),
+        (3599, 900, 0, 0, 2, -1, -1, -1),
+    ]
+    data = pack(samples)
+    assert unpack(data) == samples
+    assert unpack(pack(samples[:2]) + pack(samples[2:], samples[1])) == samples
+    # a change of bikes and free, time delta, mask and both deltas
+    assert len(pack(samples[1:2], samples[0])) == 4
+
+
+def test_downsample():
+    samples = [(t, t // 600, 0) for t in range(0, HOUR, 60)]
+    assert history.downsample(samples, 900) == [
+        (0, 0, 0),
+        (840, 1, 0),
+        (1740, 2, 0),
+        (2640, 4, 0),
+        (3540, 5, 0),
+    ]
+
+
+def test_record(con):
+    hour = int(time.time()) // HOUR * HOUR
+    network = synthetic.network("hist", stations=10, seed=0)
+    uid, bikes = network["stations"][0]["id"], network["stations"][0]["bikes"]
+    recorder = History()
+
+    store_network(con, update(network, hour + 10), recorder)
+    store_network(con, update(network, hour + 20), recorder)
+    store_network(con, update(network, hour + 30, [(0, bikes + 1)]), recorder)
+    # a new hour starts a row
+    store_network(con, update(network, hour + HOUR + 5, [(0, bikes + 1)]), recorder)
+
+    rows = con.execute("SELECT COUNT(*) AS n FROM history").fetchone()["n"]
+    assert rows == 20
+
+    series = history.get(con, "hist", uid)[uid]
+    assert [(s.time, s.bikes) for s in series] == [
+        (hour + 10, bikes),
+        (hour + 30, bikes + 1),
+        (hour + HOUR + 5, bikes + 1),
+    ]
+    assert series[1].free == network["stations"][0]["free"] - 1
+    assert series[0].ebikes is None
+
+    # a restart picks up from the last samples
+    store_network(con, update(network, hour + HOUR + 50, [(0, bikes)]), History())
+    series = history.get(con, "hist", uid)[uid]
+    assert [(s.time, s.bikes) for s in series][-2:] == [
+        (hour + HOUR + 5, bikes + 1),
+        (hour + HOUR + 50, bikes),
+    ]
+
+    # from start, with the sample in effect at start
+    series = history.get(con, "hist", uid, start=hour + 40, end=hour + HOUR + 10)
+    assert [s.time for s in series[uid]] == [hour + 30, hour + HOUR + 5]
+
+    network_series = history.get(con, "hist")
+    assert len(network_series) == 10
+    assert network_series[uid] == history.get(con, "hist", uid)[uid]
+
+
+def test_record_rollback(con):
+    hour = int(time.time()) // HOUR * HOUR
+    network = synthetic.network("hist", stations=3, seed=0)
+    uid, bikes = network["stations"][0]["id"], network["stations"][0]["bikes"]
+    recorder = History()
+    store_network(con, update(network, hour + 10), recorder)
+
+    con.execute(
+        "CREATE TEMP TRIGGER fail BEFORE UPDATE ON history "
+        "BEGIN SELECT RAISE(ABORT, 'fail'); END"
+    )
+    changed = update(network, hour + 20, [(0, bikes + 1)])
+    with pytest.raises(sqlite3.IntegrityError):
+        store_network(con, changed, recorder)
+    assert not con.in_transaction
+    con.execute("DROP TRIGGER fail")
+
+    # the failed sample is recorded once it is stored
+    store_network(con, changed, recorder)
+    series = history.get(con, "hist", uid)[uid]
+    assert [(s.time, s.bikes) for s in series] == [
+        (hour + 10, bikes),
+        (hour + 20, bikes + 1),
+    ]
+
+
+def test_rollup(con):
+    old = (int(time.time()) // HOUR - 24 * 10) * HOUR
+    network = synthetic.network("hist", stations=3, seed=0)
+    recorder = History()
+    for m in range(60):
+        store_network(con, update(network, old + m * 60, [(0, m % 13)]), recorder)
+    uid = network["stations"][0]["id"]
+    before = history.get(con, "hist", uid)[uid]
+    assert len(before) == 60
+
+    con = connect(con.execute("PRAGMA database_list").fetchone()["file"])
+    assert history.rollup(con, 7, 900, batch=2) == (3, 0)
+    after = history.get(con, "hist", uid)[uid]
+    times = [old, old + 840, old + 1740, old + 2640, old + 3540]
+    assert [s.time for s in after] == times
+    assert all(s in before for s in after)
+
+    # rolled up rows are left alone
+    assert history.rollup(con, 7, 900) == (0, 0)
+    assert history.rollup(con, 7, 900, keep_days=9) == (0, 3)
+    con.close()
+
+
+@pytest.mark.asyncio
+async def test_cbd_history(tmp_path):
+    path = str(tmp_path / "history.db")
+    hour = int(time.time()) // HOUR * HOUR
+    network = synthetic.network("hist", stations=5, seed=0)
+    with get_sync_session(path) as con:
+        assert migrate(con)
+        recorder = History()
+        for m in range(5):
+            store_network(con, update(network, hour + m, [(m, 0)]), recorder)
+        expected = history.get(con, "hist")
+
+        async with get_session(path) as db:
+            assert await CBD(db).get_history("hist") == expected
+            uid = network["stations"][1]["id"]
+            got = await CBD(db).get_history("hist", uid, start=hour + 2)
+            assert got == {uid: expected[uid][-1:]}
+
+
+@pytest.mark.asyncio
+async def test_history_feed(client, db, tags):
+    hour = int(time.time()) // HOUR - 1
+    cur = await db.execute(
+        "SELECT hash FROM stations WHERE network_tag = ? ORDER BY hash", (tags[0],)
+    )
+    uid = (await cur.fetchone())["hash"]
+    # bikes, free, then ebikes and no other count
+    samples = [(10, 3, 7, 2, -1, -1, -1, -1), (70, 4, 6, 3, -1, -1, -1, -1)]
+    await db.execute(
+        "INSERT INTO history (network_tag, hash, hour, data) VALUES (?, ?, ?, ?)",
+        (tags[0], uid, hour, pack(samples)),
+    )
+
+    url = f"/3/{tags[0]}/history.json"
+    response = client.get(url)
+    assert response.status_code == 200
+    stations = response.json()["data"]["stations"]
+    assert [s["station_id"] for s in stations] == [uid]
+    assert stations[0]["samples"] == [
+        {
+            "time": at(hour * HOUR + 10),
+            "num_vehicles_available": 3,
+            "num_docks_available": 7,
+            "vehicle_types_available": [
+                {"vehicle_type_id": VEHICLE_TYPES["ebikes"], "count": 2}
+            ],
+        },
+        {
+            "time": at(hour * HOUR + 70),
+            "num_vehicles_available": 4,
+            "num_docks_available": 6,
+            "vehicle_types_available": [
+                {"vehicle_type_id": VEHICLE_TYPES["ebikes"], "count": 3}
+            ],
+        },
+    ]
+
+    start = at(hour * HOUR + 60)
+    got = client.get(url, params={"station_id": uid, "start": start}).json()
+    # with the sample in effect at start
+    assert got["data"]["stations"] == stations
+    got = client.get(url, params={"station_id": "foo"}).json()
+    assert got["data"]["stations"] == []
+    got = client.get(url, params={"end": str(hour * HOUR)}).json()
+    assert got["data"]["stations"] == []
+
+    for params in [
+        {"start": "yesterday"},
+        {"start": str(hour * HOUR), "end": str(hour * HOUR - 1)},
+        {"start": "0"},
+    ]:
+        assert client.get(url, params=params).status_code == 400
+    assert client.get("/3/foobar/history.json").status_code == 404
@@ -0,0 +1,61 @@
+import json
+import gzip
+import sqlite3
+
+import pytest
+
+from citybikes.db import migrate
+from citybikes.cmd.load import load, read
+
+
+def rows(con, table):
+    return con.execute(
+        f"SELECT hash, latitude, longitude, stat, network_tag FROM {table} "
+        "ORDER BY hash"
+    ).fetchall()
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "json", "ndjson.gz"])
+def test_read(tmp_path, messages, fmt):
+    expected = messages
+    path = str(tmp_path / f"dump.{fmt}")
+    with (gzip.open if fmt.endswith(".gz") else open)(path, "wt") as f:
+        if fmt == "json":
+            json.dump(expected, f)
+        else:
+            f.writelines(json.dumps(n) + "\n\n" for n in expected)
+
+    assert list(read(path)) == expected
+
+
+def test_load(source, messages):
+    con = sqlite3.connect(":memory:")
+    con.row_factory = lambda *a: dict(sqlite3.Row(*a))
+    assert migrate(con)
+
+    dump = messages
+    count = load(con, iter(dump))
+    assert count == (
+        len(dump),
+        sum(len(n["stations"]) for n in dump),
+        sum(len(n["vehicles"]) for n in dump),
+    )
+
+    for table in ["stations", "vehicles"]:
+        assert rows(con, table) == rows(source, table)
+    indexes = {r["name"] for r in con.execute("SELECT name FROM sqlite_master")}
+    assert {"idx_stations_grid", "idx_vehicles_grid"} <= indexes
+
+
+def test_load_rolls_back(messages):
+    con = sqlite3.connect(":memory:")
+    con.row_factory = lambda *a: dict(sqlite3.Row(*a))
+    assert migrate(con)
+
+    with pytest.raises(KeyError):
+        load(con, iter([messages[0], {"tag": "broken"}]))
+    con.rollback()
+
+    assert con.execute("SELECT count(*) AS n FROM stations").fetchone()["n"] == 0
+    indexes = {r["name"] for r in con.execute("SELECT name FROM sqlite_master")}
+    assert "idx_stations_grid" in indexes
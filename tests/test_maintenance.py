@@ -0,0 +1,142 @@
+import random
+import sqlite3
+
+import pytest
+
+from citybikes.db import migrate
+from citybikes.db.maintenance import (
+    INCREMENTAL,
+    connect,
+    convert,
+    expire,
+    maintain,
+    stats,
+)
+from tests import fixtures
+
+
+@pytest.fixture
+def con(tmp_path):
+    path = str(tmp_path / "maintenance.db")
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    assert migrate(con)
+    con.executescript(fixtures.sql())
+    con.commit()
+    con.close()
+    con = connect(path)
+    yield con
+    con.close()
+
+
+def count(con, table):
+    return con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def age(con, days, tag=None):
+    # update_network would set updated back to now
+    (trigger,) = con.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'update_network'"
+    ).fetchone()
+    con.execute("DROP TRIGGER update_network")
+    con.execute(
+        "UPDATE networks SET updated = datetime('now', ?) WHERE ? IS NULL OR tag = ?",
+        (f"-{days} days", tag, tag),
+    )
+    con.execute(trigger)
+
+
+def test_migrate_sets_incremental(con):
+    assert con.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL
+
+
+def test_expire(con):
+    con.execute("UPDATE networks SET updated = datetime('now')")
+    tag = con.execute("SELECT tag FROM networks LIMIT 1").fetchone()[0]
+    age(con, 2, tag)
+    networks = count(con, "networks")
+    con.execute(
+        "INSERT INTO history (network_tag, hash, hour, data) VALUES (?, 'foo', 0, x'')",
+        (tag,),
+    )
+
+    assert expire(con, 24) == [tag]
+    assert count(con, "networks") == networks - 1
+    for table, column in [
+        ("stations", "network_tag"),
+        ("vehicles", "network_tag"),
+        ("changes", "network_tag"),
+        ("network_seq", "tag"),
+        ("network_stats", "tag"),
+        ("history", "network_tag"),
+    ]:
+        (left,) = con.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {column} = ?", (tag,)
+        ).fetchone()
+        assert left == 0, table
+
+    assert expire(con, 24) == []
+
+
+def test_maintain(con):
+    age(con, 2)
+    report = maintain(con, expire_after=24)
+
+    assert report["expired"]
+    assert count(con, "stations") == 0
+    assert set(report["before"]) == {"size", "free", "fragmentation"}
+    assert report["after"]["size"] < report["before"]["size"]
+    assert report["after"]["free"] == 0
+
+
+def test_convert(tmp_path):
+    path = str(tmp_path / "legacy.con")
+    con = connect(path)
+    con.execute("PRAGMA auto_vacuum = NONE")
+    con.execute("CREATE TABLE t (x)")
+    con.executemany("INSERT INTO t VALUES (?)", [("x" * 1000,)] * 100)
+    con.execute("DELETE FROM t")
+    assert stats(con)["free"] > 0
+
+    # scheduled maintenance does not VACUUM a live db
+    maintain(con)
+    assert con.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL
+    assert stats(con)["free"] > 0
+
+    assert convert(con)
+    assert con.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL
+    assert stats(con)["free"] == 0
+    assert not convert(con)
+    con.close()
+
+
+def test_optimize_keeps_plans(con):
+    # on a handful of stations a scan is cheaper, spread some over the world
+    rng = random.Random(1)
+    con.executemany(
+        "INSERT INTO stations (hash, latitude, longitude, network_tag) "
+        "VALUES (?, ?, ?, ?)",
+        [
+            (f"s{i}", rng.uniform(-60, 60), rng.uniform(-180, 180), f"n{i % 50}")
+            for i in range(5000)
+        ],
+    )
+    # next to the subscriber, no ANALYZE holds the write lock
+    maintain(con)
+    assert not con.execute(
+        "SELECT * FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchall()
+
+    maintain(con, analyze=True)
+    plan = con.execute(
+        """
+        EXPLAIN QUERY PLAN SELECT * FROM stations
+        WHERE CAST((latitude + 90) * 100 AS INTEGER)
+            IN (SELECT value FROM json_each(?))
+          AND longitude BETWEEN ? AND ?
+          AND latitude BETWEEN ? AND ?
+          AND +network_tag = ?
+    """,
+        ["[1]", 0, 0, 0, 0, "foo"],
+    ).fetchall()
+    assert any("idx_stations_grid" in row[-1] for row in plan)
@@ -0,0 +1,132 @@
+import json
+import asyncio
+
+import pytest
+
+from citybikes.db import CBD
+from citybikes.db.memory import MemoryCBD
+from tests import fixtures
+
+
+@pytest.mark.asyncio
+async def test_memory_matches_sqlite(db, source, tags):
+    cbd = CBD(db)
+    loaded = MemoryCBD()
+    loaded.load(source)
+    updated = MemoryCBD()
+    for tag in tags:
+        updated.update(fixtures.as_message(source, tag))
+
+    for mem in [loaded, updated]:
+        assert await mem.get_tags() == tags
+        for tag in tags:
+            network = await cbd.get_network(tag)
+            assert (await mem.get_network(tag)).meta == network.meta
+            assert await mem.get_stations(tag) == await cbd.get_stations(tag)
+            assert await mem.get_vehicles(tag) == await cbd.get_vehicles(tag)
+            assert await mem.vehicle_types(tag) == await cbd.vehicle_types(tag)
+            assert await mem.get_stats(tag) == await cbd.get_stats(tag)
+            assert await mem.network_exists(tag)
+
+        assert await mem.get_stats() == await cbd.get_stats()
+
+        assert not await mem.network_exists("foobar")
+
+
+@pytest.mark.asyncio
+async def test_memory_aupdate(source, tags):
+    synced, threaded = MemoryCBD(), MemoryCBD()
+    for tag in tags:
+        synced.update(fixtures.as_message(source, tag))
+        await threaded.aupdate(fixtures.as_message(source, tag))
+    # ignored, as an empty network
+    empty = {**fixtures.as_message(source, tags[0]), "stations": [], "vehicles": []}
+    await threaded.aupdate(empty)
+
+    assert threaded.version == synced.version == len(tags)
+    for tag in tags:
+        assert await threaded.get_stations(tag) == await synced.get_stations(tag)
+    assert await threaded.get_versions() == await synced.get_versions()
+
+
+@pytest.mark.asyncio
+async def test_areader_skips_bad_messages():
+    # hyper is only required to subscribe
+    pytest.importorskip("citybikes.hyper")
+    import zmq
+    import zmq.asyncio
+
+    from citybikes.cmd.subscriber import areader
+
+    pub = zmq.asyncio.Context.instance().socket(zmq.PUB)
+    port = pub.bind_to_random_port("tcp://127.0.0.1")
+    got = []
+
+    async def handle_message(topic, message):
+        got.append(json.loads(message))
+
+    reader = asyncio.create_task(areader(f"tcp://127.0.0.1:{port}", "", handle_message))
+    try:
+        # subscribers miss what is sent before they connect
+        for _ in range(100):
+            await pub.send_multipart([b"", b"not json"])
+            await pub.send_multipart([b"", b'{"tag": "foo"}'])
+            await asyncio.sleep(0.01)
+            if got:
+                break
+        assert got[0] == {"tag": "foo"}
+        assert not reader.done()
+    finally:
+        reader.cancel()
+        pub.close()
+
+
+@pytest.mark.asyncio
+async def test_memory_iter_stations(db, source):
+    cbd = CBD(db)
+    mem = MemoryCBD()
+    mem.load(source)
+
+    expected = [(t, s) async for t, _, s in cbd.iter_stations()]
+    assert [(t, s) async for t, _, s in mem.iter_stations()] == expected
+    assert [n async for n in mem.iter_stations("9999-01-01")] == []
+
+
+def test_memory_keeps_snapshot_on_empty_update(source, tags):
+    mem = MemoryCBD()
+    mem.load(source)
+    tag = tags[0]
+    before = mem.snapshots[tag]
+    mem.update({**fixtures.as_message(source, tag), "stations": [], "vehicles": []})
+    assert mem.snapshots[tag] is before
+
+
+@pytest.mark.asyncio
+async def test_memory_geo(db, source, tags):
+    cbd = CBD(db)
+    mem = MemoryCBD()
+    mem.load(source)
+
+    for tag in tags:
+        s = (await cbd.get_stations(tag))[0]
+        lat, lon = s.latitude, s.longitude
+        bbox = (lon - 0.02, lat - 0.02, lon + 0.02, lat + 0.02)
+        assert await mem.get_stations(tag, bbox) == await cbd.get_stations(tag, bbox)
+        assert await mem.get_vehicles(tag, bbox) == await cbd.get_vehicles(tag, bbox)
+
+        expected = await cbd.nearby(lat, lon, 5)
+        got = await mem.nearby(lat, lon, 5)
+        assert [(t, s.uid) for t, s, _ in got] == [(t, s.uid) for t, s, _ in expected]
+
+
+@pytest.mark.asyncio
+async def test_memory_stations_by_id(db, source, tags):
+    cbd = CBD(db)
+    mem = MemoryCBD()
+    mem.load(source)
+
+    for tag in tags:
+        ids = [s.uid for s in await cbd.get_stations(tag)][:3] + ["foo"]
+        expected = await cbd.get_stations_by_id(tag, ids)
+        assert len(expected) == 3
+        assert await mem.get_stations_by_id(tag, ids) == expected
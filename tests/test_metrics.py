@@ -0,0 +1,33 @@
+from citybikes.metrics import Registry, Histogram, Counter
+
+
+def test_histogram_render():
+    registry = Registry()
+    h = registry.register(Histogram("foo_seconds", "Foo", ["feed"], buckets=(1, 2)))
+    h.observe(0.5, feed="bar")
+    h.observe(1.5, feed="bar")
+    h.observe(3, feed="bar")
+
+    text = registry.render()
+    assert 'foo_seconds_bucket{feed="bar",le="1"} 1' in text
+    assert 'foo_seconds_bucket{feed="bar",le="2"} 2' in text
+    assert 'foo_seconds_bucket{feed="bar",le="+Inf"} 3' in text
+    assert 'foo_seconds_sum{feed="bar"} 5.0' in text
+    assert 'foo_seconds_count{feed="bar"} 3' in text
+
+
+def test_counter_render():
+    registry = Registry()
+    c = registry.register(Counter("foo_total", "Foo", ["table"]))
+    c.inc(table="bar")
+    c.inc(2, table="bar")
+    assert 'foo_total{table="bar"} 3' in registry.render()
+
+
+def test_metrics_endpoint(client):
+    client.get("/3/manifest.json")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    duration = 'gbfs_request_duration_seconds_count{version="3.0",feed="manifest"'
+    assert duration in response.text
+    assert 'cbd_query_duration_seconds_count{method="get_tags"}' in response.text
@@ -0,0 +1,59 @@
+import pytest
+
+from citybikes.db import get_session, migrate
+from citybikes.db.ingest import store_network
+from citybikes.db.shards import open_cbd
+from citybikes.gbfs.offload import OFFLOADED, Offload
+from citybikes.gbfs.render import fetch, renderer
+
+BASE = "http://localhost:8000"
+
+
+@pytest.fixture
+def path(tmp_path, messages):
+    path = str(tmp_path / "offload.db")
+    with get_session(path) as con:
+        assert migrate(con)
+        for network in messages:
+            store_network(con, network)
+    return path
+
+
+@pytest.mark.asyncio
+async def test_offload(path, messages):
+    rows = max(len(n["stations"]) for n in messages)
+    large = [n["tag"] for n in messages if len(n["stations"]) >= rows]
+    urls = [
+        f"{BASE}/3/{n['tag']}/{feed}"
+        for n in messages
+        for feed in ["station_status.json", "station_information.json"]
+    ]
+    urls += [
+        f"{BASE}/2/{large[0]}/station_status.json",
+        f"{BASE}/3/{large[0]}/gbfs.json",
+        # lookups are left inline
+        f"{BASE}/3/{large[0]}/station_status.json?station_id=foo",
+    ]
+
+    async with open_cbd(path) as db:
+        app = renderer(db)
+        inline = [await fetch(app, url) for url in urls]
+
+        before = dict(OFFLOADED.values)
+        app.offload = Offload(path, workers=1, threshold=rows)
+        try:
+            assert [await fetch(app, url) for url in urls] == inline
+            assert (await fetch(app, f"{BASE}/3/foobar/station_status.json"))[0] == 404
+        finally:
+            app.offload.close()
+
+    offloaded = {
+        k: v - before.get(k, 0)
+        for k, v in OFFLOADED.values.items()
+        if v != before.get(k, 0)
+    }
+    # only feeds that grow with the network, of the largest ones
+    assert offloaded == {
+        ("station_status",): len(large) + 1,
+        ("station_information",): len(large),
+    }
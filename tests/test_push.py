@@ -0,0 +1,167 @@
+import json
+import asyncio
+
+import pytest
+
+from citybikes.db import CBD
+from citybikes.gbfs.push import Broadcaster, DROPPED
+from citybikes.gbfs.render import renderer, fetch
+
+
+class FakeWatcher:
+    def __init__(self):
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    async def poll(self):
+        pass
+
+
+def parse(message):
+    name, data = message.decode().rstrip("\n").split("\n")
+    return name.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+async def settle(push):
+    await asyncio.gather(*push.tasks)
+
+
+async def touch(db, tag, bikes):
+    # a new update of the network, where its first station changed
+    await db.execute("UPDATE networks SET stations = stations WHERE tag = ?", (tag,))
+    await db.execute(
+        """
+        UPDATE stations SET stat = json_set(stat, '$.bikes', ?)
+        WHERE hash = (SELECT min(hash) FROM stations WHERE network_tag = ?)
+    """,
+        (bikes, tag),
+    )
+
+
+@pytest.mark.asyncio
+async def test_push_status(db, tags):
+    app = renderer(CBD(db))
+    push = Broadcaster(app, FakeWatcher())
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+
+    queues = []
+    for _ in range(3):
+        queue, snapshot = await push.subscribe(tags[0], url, "status")
+        assert snapshot == (await fetch(app, url))[1]
+        queues.append(queue)
+
+    # nothing changed
+    push.changed({tags[0]})
+    await settle(push)
+    assert all(q.empty() for q in queues)
+
+    await touch(db, tags[0], 1234)
+    push.changed({tags[1]})
+    await settle(push)
+    assert all(q.empty() for q in queues)
+
+    push.changed({tags[0]})
+    await settle(push)
+    messages = [q.get_nowait() for q in queues]
+    # rendered once, shared by every client
+    assert all(m is messages[0] for m in messages)
+    name, feed = parse(messages[0])
+    assert name == "status"
+    assert feed == json.loads((await fetch(app, url))[1])
+    assert 1234 in [s["num_vehicles_available"] for s in feed["data"]["stations"]]
+
+    for queue in queues:
+        push.unsubscribe(tags[0], url, "status", queue)
+    assert push.channels == {}
+
+
+@pytest.mark.asyncio
+async def test_push_diff(db, tags):
+    app = renderer(CBD(db))
+    push = Broadcaster(app, FakeWatcher())
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+
+    queue, _ = await push.subscribe(tags[0], url, "diff")
+    push.changed({tags[0]})
+    await settle(push)
+    assert queue.empty()
+
+    await touch(db, tags[0], 1234)
+    push.changed({tags[0]})
+    await settle(push)
+    name, feed = parse(queue.get_nowait())
+    assert name == "diff"
+    assert not feed["data"]["full"]
+    assert [s["num_vehicles_available"] for s in feed["data"]["stations"]] == [1234]
+
+
+@pytest.mark.asyncio
+async def test_push_drops_oldest(db, tags):
+    app = renderer(CBD(db))
+    push = Broadcaster(app, FakeWatcher(), queue_size=1)
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+
+    queue, _ = await push.subscribe(tags[0], url, "status")
+    dropped = DROPPED.values.get((), 0)
+    for i in range(3):
+        await touch(db, tags[0], 1000 + i)
+        push.changed({tags[0]})
+        await settle(push)
+
+    assert queue.qsize() == 1
+    assert DROPPED.values[()] == dropped + 2
+
+
+def test_push_unknown_network(client):
+    assert client.get("/3/foobar/station_status.sse").status_code == 404
+    assert client.get("/2/foobar/station_status.sse").status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_push_diff_resyncs(db, tags):
+    app = renderer(CBD(db))
+    push = Broadcaster(app, FakeWatcher(), queue_size=1)
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+
+    queue, _ = await push.subscribe(tags[0], url, "diff")
+    for i in range(3):
+        await touch(db, tags[0], 1000 + i)
+        push.changed({tags[0]})
+        await settle(push)
+
+    # diffs are not dropped, the client starts over from a snapshot
+    assert queue.qsize() == 1
+    name, feed = parse(queue.get_nowait())
+    assert name == "snapshot"
+    assert feed == json.loads((await fetch(app, url))[1])
+    assert 1002 in [s["num_vehicles_available"] for s in feed["data"]["stations"]]
+
+
+@pytest.mark.asyncio
+async def test_push_diff_without_cursor(db, tags):
+    app = renderer(CBD(db))
+    push = Broadcaster(app, FakeWatcher())
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+    working = push.fetch
+
+    async def failing(url):
+        return None
+
+    # no cursor to diff from, the client is turned away
+    push.fetch = failing
+    assert await push.subscribe(tags[0], url, "diff") == (None, None)
+    assert not push.channels
+
+    # a channel left without one diffs from scratch
+    push.fetch = working
+    queue, _ = await push.subscribe(tags[0], url, "diff")
+    channel = push.channels[(tags[0], url, "diff")]
+    channel.cursor = None
+    push.changed({tags[0]})
+    await settle(push)
+    name, data = parse(queue.get_nowait())
+    assert name == "diff"
+    assert len(data["data"]["stations"]) == len(await CBD(db).get_stations(tags[0]))
+    assert channel.cursor is not None
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from citybikes.db import get_session, migrate
+from citybikes.db.ingest import store_network
+from citybikes.db.shards import ShardedCBD, open_cbd, paths, shard_of, tag_of
+from citybikes.gbfs.render import fetch, renderer
+
+SHARDS = 3
+
+
+@pytest.fixture
+def dbs(tmp_path, messages):
+    """the same networks on a single db, and split over shards"""
+    single = str(tmp_path / "single.db")
+    sharded = str(tmp_path / "sharded.db")
+    files = paths(sharded, SHARDS)
+    for path in [single] + files:
+        with get_session(path) as con:
+            assert migrate(con)
+    for network in messages:
+        for path in [single, files[shard_of(network["tag"], SHARDS)]]:
+            with get_session(path) as con:
+                store_network(con, network)
+    return single, sharded
+
+
+def test_paths():
+    assert paths("citybikes.db", 1) == ["citybikes.db"]
+    assert paths("data/citybikes.db", 2) == [
+        "data/citybikes.0.db",
+        "data/citybikes.1.db",
+    ]
+    # stable across processes
+    assert shard_of("bicing", 4) == 2
+
+
+@pytest.mark.asyncio
+async def test_sharded_matches_single(dbs, messages):
+    tags = [n["tag"] for n in messages]
+    assert len({shard_of(t, SHARDS) for t in tags}) > 1
+
+    single, sharded = dbs
+    async with open_cbd(single) as one, open_cbd(sharded, SHARDS) as many:
+        assert isinstance(many, ShardedCBD)
+        assert await many.get_tags() == await one.get_tags() == tags
+        assert (await many.get_updated()).keys() == set(tags)
+        assert await many.get_last_updated() == await one.get_last_updated()
+        assert await many.get_stats() == await one.get_stats()
+        for tag in tags:
+            assert await many.get_stations(tag) == await one.get_stations(tag)
+            assert await many.get_vehicles(tag) == await one.get_vehicles(tag)
+            assert await many.vehicle_types(tag) == await one.vehicle_types(tag)
+            assert await many.network_exists(tag)
+        assert not await many.network_exists("foobar")
+
+        station = (await one.get_stations(tags[0]))[0]
+        lat, lon = station.latitude, station.longitude
+        assert await many.nearby(lat, lon, k=20) == await one.nearby(lat, lon, k=20)
+
+        # merged in tag order
+        got = [(t, s) async for t, _, s in many.iter_stations()]
+        assert got == [(t, s) async for t, _, s in one.iter_stations()]
+
+        version = await many.data_version()
+        assert await many.data_version() == version
+
+
+@pytest.mark.asyncio
+async def test_sharded_feeds(dbs, messages):
+    single, sharded = dbs
+    base = "http://localhost:8000"
+    feeds = ["/3/manifest.json", "/3/stats.json"]
+    for network in messages:
+        feeds += [f"/3/{network['tag']}/station_status.json"]
+
+    async with open_cbd(single) as one, open_cbd(sharded, SHARDS) as many:
+        for path in feeds:
+            status, body = await fetch(renderer(many), base + path)
+            assert status == 200
+            expected = (await fetch(renderer(one), base + path))[1]
+            # but last_updated, of when each was stored
+            assert json.loads(body)["data"] == json.loads(expected)["data"]
+
+
+def test_tag_of():
+    network = {"tag": "bicing", "meta": {}, "stations": [], "vehicles": []}
+    assert tag_of(json.dumps(network)) == "bicing"
+    assert tag_of(json.dumps(network, indent=2)) == "bicing"
+    # tag elsewhere, decoded
+    network = {"meta": {"tag": "nope"}, "tag": "bicing"}
+    assert tag_of(json.dumps(network)) == "bicing"
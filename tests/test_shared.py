@@ -0,0 +1,31 @@
+import pytest
+
+from citybikes.gbfs.render import renderer, feed_paths, fetch
+from citybikes.gbfs.shared import publish, SharedFeeds
+from citybikes.db import CBD
+
+
+BASE_URL = "http://testserver/"
+
+
+@pytest.mark.asyncio
+async def test_rendered_feeds_match_app(db, tags, client):
+    app = renderer(CBD(db))
+    for path in feed_paths(app, tags):
+        status, body = await fetch(app, BASE_URL.rstrip("/") + path)
+        assert status == 200
+        assert body == client.get(path).content
+
+
+def test_serve_from_snapshot(client, tmp_path):
+    path = str(tmp_path / "feeds.snapshot")
+    publish(path, {"/3/manifest.json": b'{"foo": "bar"}'}, BASE_URL)
+    client.app.shared = SharedFeeds(path, interval=0)
+
+    assert client.get("/3/manifest.json").json() == {"foo": "bar"}
+
+    # not on snapshot, falls back to rendering
+    assert client.get("/3/manifest.json?foo").json() != {"foo": "bar"}
+
+    publish(path, {"/3/manifest.json": b'{"foo": "baz"}'}, BASE_URL)
+    assert client.get("/3/manifest.json").json() == {"foo": "baz"}
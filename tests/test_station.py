@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.mark.parametrize("version", ["2", "3"])
+def test_station_status(client, tags, version):
+    feed = client.get(f"/{version}/{tags[0]}/station_status.json").json()
+    expected = feed["data"]["stations"][0]
+
+    url = f"/{version}/{tags[0]}/station_status/{expected['station_id']}.json"
+    response = client.get(url)
+    assert response.status_code == 200
+    station = response.json()
+    assert station["last_updated"] == feed["last_updated"]
+    assert station["data"]["stations"] == [expected]
+
+
+@pytest.mark.parametrize("version", ["2", "3"])
+def test_station_status_not_found(client, tags, version):
+    feed = client.get(f"/{version}/{tags[0]}/station_status.json").json()
+    station_id = feed["data"]["stations"][0]["station_id"]
+
+    response = client.get(f"/{version}/{tags[0]}/station_status/foo.json")
+    assert response.status_code == 404
+    assert client.get(f"/{version}/foobar/station_status/foo.json").status_code == 404
+    # stations are scoped to their network
+    url = f"/{version}/{tags[1]}/station_status/{station_id}.json"
+    assert client.get(url).status_code == 404
+
+
+@pytest.mark.parametrize("version", ["2", "3"])
+def test_station_status_batch(client, tags, version):
+    url = f"/{version}/{tags[0]}/station_status.json"
+    stations = client.get(url).json()["data"]["stations"]
+    ids = [s["station_id"] for s in stations[:5]]
+
+    params = {"station_id": ",".join(reversed(ids)) + ",foo"}
+    batch = client.get(url, params=params).json()["data"]["stations"]
+    assert batch == stations[:5]
+
+    # repeated params work as well
+    params = [("station_id", i) for i in ids[:2]]
+    batch = client.get(url, params=params).json()["data"]["stations"]
+    assert batch == stations[:2]
+
+
+def test_station_status_batch_invalid(client, tags):
+    url = f"/3/{tags[0]}/station_status.json"
+    assert client.get(url, params={"station_id": ","}).status_code == 400
+    ids = ",".join(str(i) for i in range(101))
+    assert client.get(url, params={"station_id": ids}).status_code == 400
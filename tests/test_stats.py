@@ -0,0 +1,126 @@
+import sqlite3
+from importlib import resources
+
+import pytest
+
+from citybikes import synthetic
+from citybikes.db import CBD, migrate, script
+from citybikes.db.ingest import aggregate, store_network
+from tests.fixtures import as_message
+
+
+def station(i, bikes, free, **extra):
+    return {"id": str(i), "bikes": bikes, "free": free, "extra": extra}
+
+
+def test_aggregate():
+    network = {
+        "stations": [
+            station(0, 5, 3, ebikes=2, normal_bikes=3),
+            # normal_bikes is the rest of bikes
+            station(1, 4, 1, ebikes=1),
+            station(2, -1, None, online=False),
+            station(3, 2, 2),
+            # repeated ids count once, as stored
+            station(3, 2, 2),
+        ],
+        "vehicles": [{"id": "v"}],
+    }
+    assert aggregate(network) == {
+        "stations": 4,
+        "online": 3,
+        "bikes": 11,
+        "docks": 6,
+        "ebikes": 3,
+        "normal_bikes": 8,
+        "cargo": None,
+        "ecargo": None,
+        "kid_bikes": None,
+        "vehicles": 1,
+    }
+
+
+@pytest.fixture
+def con():
+    con = sqlite3.connect(":memory:")
+    con.row_factory = lambda *a: dict(sqlite3.Row(*a))
+    assert migrate(con)
+    yield con
+    con.close()
+
+
+def stats(con, tag):
+    row = con.execute("SELECT * FROM network_stats WHERE tag = ?", (tag,)).fetchone()
+    return row and {k: v for k, v in row.items() if k != "tag"}
+
+
+def test_stats_on_ingest(con):
+    network = synthetic.network("stats", stations=50, vehicles=5, mix="ebikes")
+    store_network(con, network)
+    assert stats(con, "stats") == aggregate(network)
+
+    network["stations"] = network["stations"][:10]
+    network["stations"][0]["bikes"] += 3
+    store_network(con, network)
+    assert stats(con, "stats") == aggregate(network)
+
+    # empty messages are ignored, as the network
+    store_network(con, {**network, "stations": [], "vehicles": []})
+    assert stats(con, "stats") == aggregate(network)
+
+
+def test_migration_backfill(con):
+    test_data = resources.files("tests") / "fixtures/test_data.sql"
+    migrations = resources.files("citybikes.db") / "migrations"
+    # without network_stats, as networks stored before the migration
+    con.executescript(test_data.read_text())
+    assert not con.execute("SELECT * FROM network_stats").fetchall()
+    con.executescript(script(migrations / "0007_add_network_stats.sql"))
+
+    tags = [r["tag"] for r in con.execute("SELECT tag FROM networks")]
+    assert tags
+    for tag in tags:
+        assert stats(con, tag) == aggregate(as_message(con, tag))
+
+
+@pytest.mark.asyncio
+async def test_stats_match_status_feeds(client, db, tags):
+    totals = {"bikes": 0, "docks": 0, "types": {}}
+    for tag in tags:
+        feed = client.get(f"/3/{tag}/station_status.json").json()["data"]
+        got = client.get(f"/3/{tag}/stats.json").json()["data"]
+
+        stations = feed["stations"]
+        bikes = sum(s["num_vehicles_available"] for s in stations)
+        docks = sum(s["num_docks_available"] for s in stations)
+        types = {}
+        for s in stations:
+            for t in s["vehicle_types_available"]:
+                kind = t["vehicle_type_id"]
+                types[kind] = types.get(kind, 0) + t["count"]
+
+        assert got["system_id"] == tag
+        assert got["num_stations"] == len(stations)
+        assert got["num_vehicles_available"] == bikes
+        assert got["num_docks_available"] == docks
+        assert {
+            t["vehicle_type_id"]: t["count"] for t in got["vehicle_types_available"]
+        } == types
+        assert got["num_free_vehicles"] == len(await CBD(db).get_vehicles(tag))
+
+        totals["bikes"] += bikes
+        totals["docks"] += docks
+        for t, n in types.items():
+            totals["types"][t] = totals["types"].get(t, 0) + n
+
+    got = client.get("/3/stats.json").json()["data"]
+    assert got["num_systems"] == len(tags)
+    assert [s["system_id"] for s in got["systems"]] == tags
+    assert got["totals"]["num_vehicles_available"] == totals["bikes"]
+    assert got["totals"]["num_docks_available"] == totals["docks"]
+    assert {
+        t["vehicle_type_id"]: t["count"]
+        for t in got["totals"]["vehicle_types_available"]
+    } == totals["types"]
+
+    assert client.get("/3/foobar/stats.json").status_code == 404
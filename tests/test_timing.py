@@ -0,0 +1,15 @@
+def test_server_timing(client):
+    client.app.server_timing = True
+    client.app.cache = None
+    response = client.get("/3/bicing/station_status.json")
+    header = response.headers["Server-Timing"]
+    phases = [m.split(";")[0] for m in header.split(", ")]
+    for phase in ["exists", "last_updated", "query", "models", "dump", "encode"]:
+        assert phase in phases
+    stations = len(response.json()["data"]["stations"])
+    assert f'{stations} rows"' in header
+
+
+def test_no_server_timing(client):
+    response = client.get("/3/bicing/station_status.json")
+    assert "Server-Timing" not in response.headers
@@ -0,0 +1,83 @@
+import sqlite3
+
+from citybikes.db.wal import Checkpointer, WAL_PENDING, wal_size
+
+
+def writer(path):
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode = WAL")
+    con.execute("PRAGMA wal_autocheckpoint = 0")
+    con.execute("CREATE TABLE foo (bar TEXT)")
+    con.commit()
+    return con
+
+
+def fill(con, n=200):
+    con.executemany("INSERT INTO foo VALUES (?)", [("x" * 1000,)] * n)
+    con.commit()
+
+
+def test_passive_checkpoint(tmp_path):
+    path = str(tmp_path / "wal.db")
+    con = writer(path)
+    fill(con)
+    checkpointer = Checkpointer(path, limit=0)
+
+    mode, busy = checkpointer.tick()
+    assert (mode, busy) == ("PASSIVE", 0)
+    assert WAL_PENDING.values[()] == 0
+    # passive checkpoints never shrink the file
+    assert wal_size(path) > 0
+
+    checkpointer.stop()
+    con.close()
+
+
+def test_passive_checkpoint_with_reader(tmp_path):
+    path = str(tmp_path / "wal.db")
+    con = writer(path)
+    fill(con)
+
+    # a reader holding a snapshot keeps newer frames from being checkpointed
+    reader = sqlite3.connect(path)
+    reader.isolation_level = None
+    reader.execute("BEGIN")
+    reader.execute("SELECT count(*) FROM foo").fetchone()
+    fill(con)
+
+    checkpointer = Checkpointer(path, limit=0)
+    checkpointer.tick()
+    assert WAL_PENDING.values[()] > 0
+
+    reader.execute("COMMIT")
+    checkpointer.tick()
+    assert WAL_PENDING.values[()] == 0
+
+    checkpointer.stop()
+    reader.close()
+    con.close()
+
+
+def test_truncate_over_limit(tmp_path):
+    path = str(tmp_path / "wal.db")
+    con = writer(path)
+    fill(con)
+    checkpointer = Checkpointer(path, limit=1024)
+
+    mode, busy = checkpointer.tick()
+    assert (mode, busy) == ("TRUNCATE", 0)
+    assert wal_size(path) == 0
+
+    checkpointer.stop()
+    con.close()
+
+
+def test_checkpointer_thread(tmp_path):
+    path = str(tmp_path / "wal.db")
+    con = writer(path)
+    checkpointer = Checkpointer(path, interval=0.01)
+    checkpointer.start()
+    fill(con)
+    checkpointer.stop()
+    assert not checkpointer.is_alive()
+    con.close()
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from citybikes.db import CBD
+from citybikes.gbfs.admission import Admission
+from citybikes.gbfs.cache import FeedCache
+from citybikes.gbfs.render import renderer, fetch
+from citybikes.gbfs.warm import Warmer
+
+
+class FakeWatcher:
+    def __init__(self):
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    async def poll(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_warm_hottest_of_changed_networks():
+    warmer = Warmer(None, FakeWatcher(), top=3)
+    for uid, key, n in [
+        ("foo", "/3/foo/station_status.json", 10),
+        ("foo", "/3/foo/gbfs.json", 1),
+        ("bar", "/3/bar/station_status.json", 5),
+        (None, "/3/manifest.json", 3),
+        ("foo", "/3/foo/station_information.json", 2),
+    ]:
+        for _ in range(n):
+            warmer.hit(uid, key)
+
+    warmer.changed({"foo"})
+    # gbfs.json is not in the top 3
+    assert warmer.pending == {"/3/foo/station_status.json", "/3/manifest.json"}
+
+
+@pytest.mark.asyncio
+async def test_warm_renders_into_cache(db, tags):
+    app = renderer(CBD(db))
+    app.cache = FeedCache()
+    warmer = Warmer(app, FakeWatcher(), budget=0.5)
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+    warmer.hit(tags[0], url)
+
+    task = asyncio.create_task(warmer.run())
+    warmer.changed({tags[0]})
+    for _ in range(100):
+        if app.cache.get(tags[0], url):
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+    assert app.cache.get(tags[0], url) == (await fetch(app, url))[1]
+    assert not warmer.pending
+
+
+class RacingDB:
+    """a network change lands while the feed renders"""
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+
+    def __getattr__(self, attr):
+        return getattr(self.db, attr)
+
+    async def get_stations(self, uid, *args, **kwargs):
+        self.cache.invalidate({uid})
+        return await self.db.get_stations(uid, *args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_warm_stale_render_not_cached(db, tags):
+    app = renderer(CBD(db))
+    app.cache = FeedCache()
+    app.db = RacingDB(app.db, app.cache)
+    warmer = Warmer(app, FakeWatcher())
+    url = f"http://testserver/3/{tags[0]}/station_status.json"
+
+    await warmer.render(url)
+    assert app.cache.get(tags[0], url) is None
+
+
+@pytest.mark.asyncio
+async def test_warm_skips_admission(db, tags):
+    app = renderer(CBD(db))
+    app.cache = FeedCache()
+    app.admission = Admission(max_wait=1)
+    # as if renders were backed up
+    app.admission.in_flight, app.admission.service_time = 10, 1
+    warmer = Warmer(app, FakeWatcher())
+    url = f"http://testserver/3/{tags[0]}/station_information.json"
+
+    assert (await fetch(app, url))[0] == 503
+    await warmer.render(url)
+    assert app.cache.get(tags[0], url) is not None
+
+
+@pytest.mark.asyncio
+async def test_warm_save_and_load(tmp_path):
+    path = str(tmp_path / "hot.json")
+    warmer = Warmer(None, FakeWatcher(), path=path)
+    warmer.hit("foo", "/3/foo/gbfs.json")
+    warmer.save()
+
+    warmer = Warmer(None, FakeWatcher(), path=path)
+    warmer.load()
+    assert warmer.hits == {"/3/foo/gbfs.json": ["foo", 1]}
+    assert warmer.pending == {"/3/foo/gbfs.json"}
+
+
+def test_warm_counts_requests(client, tags):
+    # off by default (WARM)
+    assert client.app.warmer is None
+    client.app.warmer = Warmer(client.app, FakeWatcher())
+    response = client.get(f"/3/{tags[0]}/gbfs.json")
+    assert client.app.warmer.hits[str(response.url)] == [tags[0], 1]
+    # only plain, cached feeds
+    client.get(f"/3/{tags[0]}/station_status.json?since=0")
+    # nor station lookups, that are never cached
+    response = client.get(f"/3/{tags[0]}/station_status.json")
+    station_id = response.json()["data"]["stations"][0]["station_id"]
+    assert client.get(f"/3/{tags[0]}/station_status/{station_id}.json").is_success
+    assert len(client.app.warmer.hits) == 2